@@ -1,7 +1,12 @@
 from collections import OrderedDict
 
-from cherry.agents.models import ConvNetS, ConvNetM, ConvNetL, MLP, ReplayBuffer
-from cherry.agents.algorithms import DQN, DDQN, VPG, DDPG
+from cherry.agents.models import ConvNetS, ConvNetM, ConvNetL, MLP, \
+    ConvNetDWS, ConvNetDWM, ConvNetDWL, ConvNetRecurrent, ReplayBuffer, \
+    SequenceReplayBuffer, RolloutBuffer, TargetNetwork, MultiTaskModel, \
+    EnsembleLinear, EnsembleCritic, EnsembleReplayBuffer, freeze_encoder, \
+    load_encoder
+from cherry.agents.algorithms import DQN, DDQN, DRQN, EnsembleDQN, \
+    MultiTaskDQN, VPG, DDPG, TD3, SAC, A3C, PPO
 from utils.helpers import get_logger
 
 logger = get_logger(__file__)
@@ -10,13 +15,24 @@ MODELS = OrderedDict({None: None,
                       'convnet-small': ConvNetS,
                       'convnet-medium': ConvNetM,
                       'convnet-large': ConvNetL,
+                      'convnet-dw-small': ConvNetDWS,
+                      'convnet-dw-medium': ConvNetDWM,
+                      'convnet-dw-large': ConvNetDWL,
+                      'convnet-recurrent': ConvNetRecurrent,
                       'mlp': MLP})
 
 ALGOS = OrderedDict({None: None,
                      'dqn': DQN,
                      'ddqn': DDQN,
+                     'drqn': DRQN,
+                     'dqn-ensemble': EnsembleDQN,
+                     'dqn-multitask': MultiTaskDQN,
                      'vpg': VPG,
-                     'ddpg': DDPG})
+                     'ppo': PPO,
+                     'ddpg': DDPG,
+                     'td3': TD3,
+                     'sac': SAC,
+                     'a3c': A3C})
 
 
 def get_model(model_type):
@@ -0,0 +1,214 @@
+# https://arxiv.org/abs/1602.01783 (Asynchronous methods for deep RL, Mnih
+# et al.), Hogwild (https://arxiv.org/abs/1106.5730) updates on CPU
+import time
+import queue
+
+import tqdm
+import torch
+import numpy as np
+import torch.multiprocessing as mp
+
+from cherry.agents.vpg import VPG
+from utils.helpers import get_logger, build_optimizer
+from utils.checkpoint import write_model
+
+
+def optimizers(agent):
+
+  return [opt for opt in [agent.policy_optimizer, agent.value_optimizer]
+          if opt is not None]
+
+
+def share_optimizer(optimizer):
+  """
+    Moves the optimizer state to shared memory, one zero gradient step
+    creates the state (a no-op update for Adam/RMSprop) in whatever layout
+    this torch version uses
+  """
+
+  params = [p for group in optimizer.param_groups for p in group['params']]
+
+  for p in params:
+    p.grad = torch.zeros_like(p)
+
+  optimizer.step()
+  optimizer.zero_grad(set_to_none=True)
+
+  states = []
+  for p in params:
+    state = optimizer.state[p]
+    for key, value in state.items():
+      if torch.is_tensor(value):
+        state[key] = value.share_memory_()
+    states.append(state)
+
+  return states
+
+
+def attach_shared(agent, opt_name, fused, policy, value, states):
+  """Point a worker agent at the shared models and optimizer state"""
+
+  agent.policy = policy
+  agent.value = policy if agent.shared_trunk else value
+
+  agent.policy_optimizer = build_optimizer(opt_name, policy.parameters(),
+                                           fused=fused, lr=agent.policy_lr)
+  agent.value_optimizer = None if agent.shared_trunk else \
+      build_optimizer(opt_name, value.parameters(), fused=fused,
+                      lr=agent.value_lr)
+
+  for optimizer, opt_states in zip(optimizers(agent), states):
+    params = [p for group in optimizer.param_groups for p in group['params']]
+    for p, state in zip(params, opt_states):
+      optimizer.state[p] = state
+
+
+def run_worker(rank, model, agent_cfgs, env_cfgs, train_cfgs, policy, value,
+               states, counter, results, stop, log_level):
+  """
+    Worker process, collects rollouts on its own env and applies its
+    gradients lock-free (Hogwild) to the shared models
+  """
+
+  from cherry.envs import build_env
+
+  torch.set_num_threads(1)
+
+  max_steps = train_cfgs['max_steps']
+  train_eps = train_cfgs['n_train_episodes']
+
+  seed = env_cfgs.get('seed')
+  seed = None if seed is None else seed + rank
+  env = build_env(dict(env_cfgs, seed=seed))
+
+  if seed is not None:
+    torch.manual_seed(seed)
+
+  agent = VPG(agent_cfgs, model=model, device=torch.device('cpu'),
+              log_level=log_level)
+  attach_shared(agent, agent_cfgs['opt_name'], agent_cfgs.get('fused_opt'),
+                policy, value, states)
+  agent.build_rollout(max_steps)
+
+  while not stop.is_set():
+
+    with counter.get_lock():
+      ep = counter.value
+      if ep >= train_eps:
+        break
+      counter.value += 1
+
+    agent.collect(env, max_steps, render=False, progress=False)
+    agent.optimize()
+
+    results.put((rank, ep, np.mean(agent.ep_rewards),
+                 np.max(agent.ep_rewards), len(agent.rollout)))
+
+  results.put((rank, None, None, None, None))
+
+
+class A3C():
+
+  def __init__(self, cfgs, model=None, model_file=None,
+               device=None, log_level='info'):
+    """
+      Asynchronous advantage actor-critic. Worker processes share the VPG
+      (logits, value) models and optimizer state in shared memory, playing
+      and exporting go through the wrapped VPG agent
+    """
+
+    self.cfgs = cfgs
+    self.log_level = log_level
+    self.logger = get_logger(__file__, log_level=log_level)
+
+    # workers run on CPU, shared memory tensors live there too
+    self.agent = VPG(cfgs, model=model, model_file=model_file,
+                     device=torch.device('cpu'), log_level=log_level)
+
+  def __getattr__(self, name):
+
+    # everything else (policy, state_size, play, ..) comes from VPG
+    return getattr(self.__dict__['agent'], name)
+
+  def train(self, env, train_cfgs, gitsha, model_dest):
+
+    agent = self.agent
+
+    n_workers = train_cfgs.get('n_workers', mp.cpu_count())
+    save_model = train_cfgs['save_model']
+    train_eps = train_cfgs['n_train_episodes']
+
+    policy = agent.policy.share_memory()
+    value = None if agent.shared_trunk else agent.value.share_memory()
+    states = [share_optimizer(opt) for opt in optimizers(agent)]
+
+    ctx = mp.get_context('spawn')
+
+    counter = ctx.Value('i', 0)
+    stop = ctx.Event()
+    results = ctx.Queue()
+
+    workers = [ctx.Process(target=run_worker,
+                           args=(rank, type(policy), self.cfgs, env.cfgs,
+                                 train_cfgs, policy, value, states, counter,
+                                 results, stop, self.log_level),
+                           daemon=True)
+               for rank in range(n_workers)]
+
+    for worker in workers:
+      worker.start()
+
+    self.logger.info('Started {} workers'.format(n_workers))
+
+    train_ep = tqdm.tqdm(total=train_eps, ascii=True, unit='ep', leave=True)
+
+    start = time.time()
+    env_steps, n_done, n_saved = 0, 0, 0
+    rewards = [0.0] * n_workers
+
+    try:
+      while n_done < n_workers:
+
+        try:
+          rank, ep, mean_reward, best_reward, steps = results.get(timeout=1.0)
+        except queue.Empty:
+          if not any(w.is_alive() for w in workers):
+            raise RuntimeError('Workers exited without finishing, exit '
+                               'codes {}'.format([w.exitcode
+                                                  for w in workers]))
+          continue
+
+        if ep is None:
+          n_done += 1
+          continue
+
+        env_steps += steps
+        rewards[rank] = mean_reward
+        train_ep.update(1)
+        train_ep.set_description('Average reward: {0:.3f}, '
+                                 'Steps/s : {1:.1f}'.format(
+                                     np.mean(rewards),
+                                     env_steps / (time.time() - start)))
+
+        if train_ep.n // save_model > n_saved:
+          n_saved = train_ep.n // save_model
+          tag = '{0:09d}-{1}'.format(env_steps, gitsha)
+          write_model(policy, tag, model_dest, score=np.mean(rewards))
+
+        if best_reward >= env.env_solution and not stop.is_set():
+          self.logger.info('Solved! At epside {}'
+                           ' reward {:.3f} > {:.3f}'.format(ep, best_reward,
+                                                            env.env_solution))
+          stop.set()
+
+    finally:
+      stop.set()
+      for worker in workers:
+        worker.join()
+      train_ep.close()
+
+    self.logger.info('Done training, Steps/s : {:.1f}'.format(
+        env_steps / (time.time() - start)))
+
+    tag = 'final-{0}'.format(gitsha)
+    write_model(policy, tag, model_dest)
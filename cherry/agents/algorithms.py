@@ -1,4 +1,11 @@
 from cherry.agents.dqn import DQN
 from cherry.agents.ddqn import DDQN
+from cherry.agents.drqn import DRQN
+from cherry.agents.ensemble import EnsembleDQN
+from cherry.agents.multitask import MultiTaskDQN
 from cherry.agents.vpg import VPG
 from cherry.agents.ddpg import DDPG
+from cherry.agents.td3 import TD3
+from cherry.agents.sac import SAC
+from cherry.agents.a3c import A3C
+from cherry.agents.ppo import PPO
@@ -0,0 +1,256 @@
+# https://arxiv.org/abs/1803.00933 (Distributed prioritized experience
+# replay, Horgan et al.), uniform replay
+import time
+import queue
+
+import tqdm
+import torch
+import numpy as np
+import torch.multiprocessing as mp
+
+from cherry.agents import TargetNetwork
+from utils.helpers import get_logger
+from utils.checkpoint import write_model
+
+
+def actor_eps(rank, n_actors, base_eps=0.4, alpha=7.):
+  """Per actor exploration eps^(1 + alpha * i / (N - 1))"""
+
+  if n_actors == 1:
+    return base_eps
+
+  return base_eps ** (1. + alpha * rank / (n_actors - 1))
+
+
+def run_actor(rank, agent_type, model, agent_cfgs, env_cfgs, train_cfgs,
+              shared, version, lock, transitions, stop, log_level):
+  """
+    Actor process, steps its own env with a CPU copy of the policy and
+    streams chunks of transitions to the learner. Weights are pulled from
+    the shared model whenever the learner bumped the version
+  """
+
+  from cherry.envs import build_env
+
+  torch.set_num_threads(1)
+
+  n_actors = train_cfgs['n_actors']
+  max_steps = train_cfgs['max_steps']
+  chunk_size = train_cfgs.get('actor_chunk', 64)
+  n_episodes = -(-train_cfgs['n_train_episodes'] // n_actors)
+
+  seed = env_cfgs.get('seed')
+  seed = None if seed is None else seed + rank
+  env = build_env(dict(env_cfgs, seed=seed))
+
+  # acting only, no replay memory needed
+  agent = agent_type(dict(agent_cfgs, replay_size=1, compile=False),
+                     model=model, device=torch.device('cpu'),
+                     log_level=log_level)
+  agent.eval()
+  agent.eps = actor_eps(rank, n_actors, train_cfgs.get('actor_eps', 0.4),
+                        train_cfgs.get('actor_alpha', 7.))
+
+  shared_sync = TargetNetwork(shared, agent.policy)
+  local_version = -1
+  chunk = []
+
+  def pull():
+
+    nonlocal local_version
+
+    if local_version == version.value:
+      return
+
+    with lock:
+      shared_sync.hard_update()
+      local_version = version.value
+
+  def send():
+
+    # plain arrays go through the pipe, shared memory tensors would have to
+    # outlive this process until the learner read them
+    states, actions, rewards, dones = zip(*chunk)
+    transitions.put(('chunk', rank, (torch.cat(states).numpy(),
+                                     np.array(actions),
+                                     np.array(rewards, dtype=np.float32),
+                                     np.array(dones))))
+    chunk.clear()
+    pull()
+
+  pull()
+
+  for ep in range(n_episodes):
+
+    # stop ends the run, not just the episode
+    if stop.is_set():
+      break
+
+    agent.reset()
+    agent.append_state(env.reset())
+
+    for step in range(max_steps):
+
+      if stop.is_set():
+        break
+
+      action = agent.get_action(agent.get_state())
+
+      next_state, reward, done, info = env.step(action)
+      agent.append_reward(reward)
+      agent.append_state(next_state)
+
+      chunk.append((agent.get_state(complete=True), action, reward, done))
+
+      if len(chunk) == chunk_size:
+        send()
+
+      if done:
+        transitions.put(('episode', rank, agent.get_episode_rewards()))
+        agent.reset()
+        agent.append_state(env.reset())
+
+  if chunk:
+    send()
+
+  transitions.put(('done', rank, None))
+
+
+class ApeX():
+
+  def __init__(self, agent, log_level='info'):
+    """
+      Multi-process actor-learner training of a DQN/DDQN agent. N actor
+      processes act with their own env and exploration rate, the agent
+      (learner) in this process replays and optimizes continuously
+    """
+
+    self.agent = agent
+    self.log_level = log_level
+    self.logger = get_logger(__file__, log_level=log_level)
+
+  def train(self, env, train_cfgs, gitsha, model_dest):
+
+    agent = self.agent
+
+    n_actors = train_cfgs['n_actors']
+    batch_size = train_cfgs['batch_size']
+    grad_accum = train_cfgs.get('grad_accum', 1)
+    update_target = train_cfgs['update_target']
+    save_model = train_cfgs['save_model']
+    learning_starts = max(train_cfgs.get('learning_starts', 0), batch_size)
+    weight_sync = train_cfgs.get('weight_sync', 50)
+    total_steps = train_cfgs['n_train_episodes'] * train_cfgs['max_steps']
+
+    ctx = mp.get_context('spawn')
+
+    model = type(agent.policy)
+    shared = model(agent.state_size, agent.action_size, torch.device('cpu'))
+    shared_sync = TargetNetwork(agent.policy, shared)
+    shared_sync.hard_update()
+    shared.share_memory()
+
+    version = ctx.Value('i', 0)
+    lock = ctx.Lock()
+    stop = ctx.Event()
+    transitions = ctx.Queue(maxsize=train_cfgs.get('queue_size', 64))
+
+    actors = [ctx.Process(target=run_actor,
+                          args=(rank, type(agent), model, agent.cfgs,
+                                env.cfgs, train_cfgs, shared, version, lock,
+                                transitions, stop, self.log_level),
+                          daemon=True)
+              for rank in range(n_actors)]
+
+    for actor in actors:
+      actor.start()
+
+    eps = [actor_eps(rank, n_actors, train_cfgs.get('actor_eps', 0.4),
+                     train_cfgs.get('actor_alpha', 7.))
+           for rank in range(n_actors)]
+    self.logger.info('Started {} actors, eps {}'.format(
+        n_actors, ['{:.4f}'.format(e) for e in eps]))
+
+    pbar = tqdm.tqdm(total=total_steps, ascii=True, unit='stp', leave=False)
+
+    start = time.time()
+    env_steps, updates, n_done = 0, 0, 0
+    ep_rewards = [0.0] * n_actors
+
+    try:
+      while n_done < n_actors:
+
+        # block only while there is nothing to learn from, otherwise take
+        # what is waiting (up to a chunk per actor) between updates
+        learning = len(agent.replay) >= learning_starts
+        messages = []
+
+        try:
+          messages.append(transitions.get_nowait() if learning
+                          else transitions.get(timeout=1.0))
+          while len(messages) < n_actors:
+            messages.append(transitions.get_nowait())
+        except queue.Empty:
+          if not messages and not any(a.is_alive() for a in actors):
+            raise RuntimeError('Actors exited without finishing, exit '
+                               'codes {}'.format([a.exitcode
+                                                  for a in actors]))
+
+        for kind, rank, payload in messages:
+
+          if kind == 'chunk':
+            agent.replay.push_batch(*map(torch.from_numpy, payload))
+            n = len(payload[0])
+
+            for step in range(env_steps + 1, env_steps + n + 1):
+              if step % update_target == 0:
+                agent.update_target(step)
+              if step % save_model == 0:
+                tag = '{0:09d}-{1}'.format(step, gitsha)
+                write_model(agent.policy, tag, model_dest,
+                            score=np.mean(ep_rewards))
+
+            env_steps += n
+            pbar.update(n)
+          elif kind == 'episode':
+            ep_rewards[rank] = payload
+          elif kind == 'done':
+            n_done += 1
+
+        if len(agent.replay) < learning_starts:
+          continue
+
+        if not agent.optimize(batch_size=batch_size, grad_accum=grad_accum):
+          continue
+        updates += 1
+
+        if updates % weight_sync == 0:
+          with lock:
+            shared_sync.hard_update()
+            version.value += 1
+
+          elapsed = time.time() - start
+          pbar.set_description('Rewards : {0}, Samples/s : {1:.1f}, '
+                               'Updates/s : {2:.1f}'.format(
+                                   ['{:.1f}'.format(r) for r in ep_rewards],
+                                   env_steps / elapsed, updates / elapsed))
+
+    finally:
+      stop.set()
+      # unblock actors waiting on a full queue
+      while any(actor.is_alive() for actor in actors):
+        try:
+          transitions.get(timeout=0.1)
+        except queue.Empty:
+          pass
+      for actor in actors:
+        actor.join()
+      pbar.close()
+
+    elapsed = time.time() - start
+    self.logger.info('Done training, Samples/s : {0:.1f}, '
+                     'Updates/s : {1:.1f}'.format(env_steps / elapsed,
+                                                   updates / elapsed))
+
+    tag = 'final-{0}'.format(gitsha)
+    write_model(agent.policy, tag, model_dest)
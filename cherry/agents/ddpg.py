@@ -3,6 +3,7 @@ import os
 import sys
 import math
 from pathlib import Path
+from contextlib import nullcontext
 from collections import deque, namedtuple
 
 import tqdm
@@ -16,8 +17,11 @@ import torch.nn.functional as F
 from skvideo.io import FFmpegWriter as vid_writer
 from torchvision.transforms import Compose, CenterCrop, Resize, ToPILImage
 
-from cherry.agents import ReplayBuffer
-from utils.helpers import get_logger, write_model, OPTS
+from cherry.agents import ReplayBuffer, TargetNetwork
+from cherry.agents.learner import build_learner
+from cherry.agents.schedulers import ReplayRatio
+from utils.helpers import get_logger, build_optimizer, maybe_compile
+from utils.checkpoint import write_model, load_weights
 
 
 class DDPG():
@@ -45,6 +49,8 @@ class DDPG():
     self.init_weights = cfgs.get('init_weights')
     self.continous = cfgs.get('continous')
     self.grad_clip = cfgs.get('grad_clip')
+    self.compile = cfgs.get('compile')
+    self.fused_opt = cfgs.get('fused_opt')
     self.device = device
     self.state_size = [self.state_len] + self.input_shape
 
@@ -58,40 +64,60 @@ class DDPG():
 
     self.transform = self.state_transformer()
 
-    self.actor = model(self.state_size, self.action_size,
-                       self.device).to(self.device)
+    self.actor = self.build_actor(model)
 
-    self.critic = model(self.state_size, self.action_size,
-                        self.device, continous=self.continous).to(self.device)
+    self.critic = self.build_critic(model)
 
     if self.init_weights:
       self.actor.apply(self.actor.init_weights)
       self.critic.apply(self.critic.init_weights)
 
-    self.actor_target = model(self.state_size, self.action_size,
-                              self.device).to(self.device)
+    self.actor_target = self.build_actor(model)
 
-    self.critic_target = model(self.state_size, self.action_size,
-                               self.device, continous=self.continous).to(self.device)
+    self.critic_target = self.build_critic(model)
 
     if model_file:
       self.load_model(model_file)
 
-    self.update_target(0)
+    self.critic_sync = TargetNetwork(self.critic, self.critic_target)
+    self.actor_sync = TargetNetwork(self.actor, self.actor_target)
 
-    optimizer = OPTS.get(cfgs['opt_name'])
+    # targets start as copies
+    self.critic_sync.hard_update()
+    self.actor_sync.hard_update()
 
-    self.actor_optimizer = optimizer(self.actor.parameters(),
-                                     lr=self.actor_lr)
-    self.critic_optimizer = optimizer(self.critic.parameters(),
-                                      lr=self.critic_lr)
+    # acting copy and its lock, swapped out by a learner thread
+    self.acting = self.actor
+    self.acting_lock = nullcontext()
+
+    self.actor_optimizer = build_optimizer(cfgs['opt_name'],
+                                           self.actor.parameters(),
+                                           fused=self.fused_opt,
+                                           lr=self.actor_lr)
+    self.critic_optimizer = build_optimizer(cfgs['opt_name'],
+                                            self.critic.parameters(),
+                                            fused=self.fused_opt,
+                                            lr=self.critic_lr)
+    self.critic_loss_fn = maybe_compile(self.critic_loss, self.compile)
+    self.actor_loss_fn = maybe_compile(self.actor_loss, self.compile)
 
     self.reset()
     buffer_shape = list(self.get_state(complete=True).shape)[1:]
 
     self.replay = ReplayBuffer(self.replay_size, buffer_shape,
                                self.action_size, state_type=torch.float32,
-                               action_type=torch.float32, device=self.device)
+                               action_type=torch.float32,
+                               reward_type=torch.float32, device=self.device)
+
+  def build_actor(self, model):
+
+    return model(self.state_size, self.action_size,
+                 self.device).to(self.device)
+
+  def build_critic(self, model):
+
+    return model(self.state_size, self.action_size, self.device,
+                 continous=self.continous).to(self.device)
 
   def state_transformer(self):
 
@@ -123,7 +149,7 @@ class DDPG():
   def load_model(self, model_file):
 
     self.logger.info('Loading agent weights from {}'.format(model_file))
-    self.actor.load_state_dict(torch.load(model_file))
+    load_weights(self.actor, model_file, self.device)
 
   def eval(self):
 
@@ -136,8 +162,8 @@ class DDPG():
 
   def get_action(self, state):
 
-    with torch.no_grad():
-      q, _ = self.actor(state)
+    with self.acting_lock, torch.no_grad():
+      q, _ = self.acting(state)
 
     q = self.scale_action(q) if self.continous else q.max(1)[1]
 
@@ -180,45 +206,71 @@ class DDPG():
 
     self.ep_rewards.append(self.rr)
 
-  def optimize(self, batch_size=32):
+  def critic_loss(self, states, action, reward, done):
 
-    if len(self.replay) < batch_size:
-      return
+    state_batch = states[:, :self.state_len]
+    next_state_batch = states[:, 1:]
 
-    batch = self.replay.sample(batch_size)
+    # no autograd graph for the target side
+    with torch.no_grad():
+      next_action_batch, _ = self.actor_target(next_state_batch)
+      next_action_batch = self.scale_action(next_action_batch)
+      _, q_values_next = self.critic_target(next_state_batch,
+                                            next_action_batch)
 
-    states, action, reward, done = batch
+      # Bellman Equation : Computes the expected Q values (target)
+      q_values_target = (q_values_next * self.gamma) * (1. - done) + reward
 
-    state_batch = states[:, :self.state_len]
-    next_state_batch = states[:, 1:]
+    _, q_values = self.critic(state_batch, action)
 
-    # Optimize the critic model
-    next_action_batch, _ = self.actor_target(next_state_batch)
-    next_action_batch = self.scale_action(next_action_batch)
-    _, q_values_next = self.critic_target(next_state_batch, next_action_batch)
+    return F.smooth_l1_loss(q_values, q_values_target)
 
-    # Bellman Equation : Computes the expected Q values (target)
-    q_values_target = (q_values_next * self.gamma) * (1. - done) + reward
+  def actor_loss(self, states):
 
+    state_batch = states[:, :self.state_len]
+
+    action, _ = self.actor(state_batch)
+    action = self.scale_action(action)
     _, q_values = self.critic(state_batch, action)
 
-    # critic loss
-    critic_loss = F.smooth_l1_loss(q_values, q_values_target)
+    return -q_values.mean()
 
-    self.critic_optimizer.zero_grad()
-    critic_loss.backward()
+  def optimize(self, batch_size=32, grad_accum=1):
+
+    if len(self.replay) < batch_size:
+      return False
+
+    # large batch as grad_accum batches of batch_size, shared by both models
+    batches = []
+    for _ in range(grad_accum):
+      states, action, reward, done = self.replay.sample(batch_size)
+      batches.append((states.to(self.device), action, reward, done))
+
+    self.optimize_critic(batches)
+    self.optimize_actor(batches)
+
+    return True
+
+  def optimize_critic(self, batches):
+
+    grad_accum = len(batches)
+
+    self.critic_optimizer.zero_grad(set_to_none=True)
+    for states, action, reward, done in batches:
+      critic_loss = self.critic_loss_fn(states, action, reward, done)
+      (critic_loss / grad_accum).backward()
     if self.grad_clip:
       nn.utils.clip_grad_value_(self.critic.parameters(), self.grad_clip)
     self.critic_optimizer.step()
 
-    # Optimize actor network
-    action, _ = self.actor(state_batch)
-    action = self.scale_action(action)
-    _, q_values = self.critic(state_batch, action)
+  def optimize_actor(self, batches):
+
+    grad_accum = len(batches)
 
-    actor_loss = -q_values.mean()
-    self.actor_optimizer.zero_grad()
-    actor_loss.backward()
+    self.actor_optimizer.zero_grad(set_to_none=True)
+    for states, _, _, _ in batches:
+      actor_loss = self.actor_loss_fn(states)
+      (actor_loss / grad_accum).backward()
     if self.grad_clip:
       nn.utils.clip_grad_value_(self.actor.parameters(), self.grad_clip)
     self.actor_optimizer.step()
@@ -226,16 +278,11 @@ class DDPG():
   def update_target(self, step):
 
     # Update the frozen target models
-    self.copy_model(self.critic, self.critic_target, self.tau)
-    self.copy_model(self.actor, self.actor_target, self.tau)
+    self.critic_sync.soft_update(self.tau)
+    self.actor_sync.soft_update(self.tau)
 
     self.logger.debug('Updating agent at {}'.format(step))
 
-  def copy_model(self, src, dest, w):
-
-    for src_param, dest_param in zip(src.parameters(), dest.parameters()):
-      dest_param.data.copy_(w * src_param.data + (1 - w) * dest_param.data)
-
   def set_action_limits(self, limits):
 
     self.env_lo = torch.Tensor(limits[0]).to(self.device)
@@ -243,14 +290,15 @@ class DDPG():
 
   def train(self, env, train_cfgs, gitsha, model_dest):
 
-    batch_size = train_cfgs['batch_size']
     update_target = train_cfgs['update_target']
     save_model = train_cfgs['save_model']
     train_eps = train_cfgs['n_train_episodes']
     max_steps = train_cfgs['max_steps']
-    policy_update = train_cfgs['policy_update']
     n_exploration_steps = train_cfgs['n_exploration_steps']
 
+    scheduler = ReplayRatio(train_cfgs)
+    learner = build_learner(self, self.actor, train_cfgs)
+
     train_ep = tqdm.tqdm(range(train_eps), ascii=True,
                          unit='episode', leave=False)
 
@@ -292,15 +340,18 @@ class DDPG():
         states = self.get_state(complete=True)
         self.push_to_memory(states, action, reward, done)
 
-        if global_step % policy_update == 0:
-          self.optimize(batch_size=batch_size)
+        n_updates = scheduler.step(global_step)
+        if n_updates:
+          learner.submit(scheduler.update, self.optimize, n_updates)
 
         if global_step % update_target == 0:
-          self.update_target(global_step)
+          learner.submit(self.update_target, global_step)
 
         if global_step % save_model == 0:
           tag = '{0:09d}-{1}'.format(global_step, gitsha)
-          write_model(self.actor, tag, model_dest)
+          learner.submit(write_model, self.actor, tag, model_dest,
+                         score=np.mean(self.ep_rewards)
+                         if self.ep_rewards else None)
 
       if not done:
         ep_reward = self.get_episode_rewards()
@@ -308,6 +359,7 @@ class DDPG():
 
       mean_reward = np.mean(self.ep_rewards)
       train_ep.set_description('Average reward: {:.3f}'.format(mean_reward))
+      self.logger.debug('Episode {0}, {1}'.format(ep, scheduler.summary()))
 
       best_reward = np.max(self.ep_rewards)
       if best_reward >= env.env_solution:
@@ -316,6 +368,9 @@ class DDPG():
                                                           env.env_solution))
         break
 
+    learner.close()
+    self.logger.info('Done training, {}'.format(scheduler.summary()))
+
     tag = 'final-{0}'.format(gitsha)
     write_model(self.actor, tag, model_dest)
 
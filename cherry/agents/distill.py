@@ -0,0 +1,229 @@
+# https://arxiv.org/abs/1511.06295 (Policy distillation, Rusu et al.)
+import random
+from pathlib import Path
+
+import tqdm
+import torch
+import numpy as np
+import torch.nn.functional as F
+
+from utils.helpers import get_logger, build_optimizer
+from utils.checkpoint import write_model
+
+
+class Distiller():
+
+  def __init__(self, cfgs, teacher=None, student=None,
+               device=None, log_level='info'):
+    """
+      Distills the acting network of a trained agent (teacher) into a
+      smaller student model, trained on the teacher's Q-values/logits
+    """
+
+    self.teacher = teacher
+    self.device = device
+    self.lr = cfgs.get('lr', 0.0001)
+    self.epochs = cfgs.get('epochs', 10)
+    self.batch_size = cfgs.get('batch_size', 64)
+    self.loss_type = cfgs.get('loss', 'kl')
+    self.temperature = cfgs.get('temperature', 0.01)
+    self.val_split = cfgs.get('val_split', 0.1)
+    self.eps = cfgs.get('eps', 0.05)
+
+    assert self.loss_type in ['kl', 'mse'], 'loss has to be kl/mse'
+    assert self.device is not None, 'Device has to be CPU/GPU'
+    # targets + actions from policy(states) -> (q/logits, v), argmax acting,
+    # single env frame stack (reset, append_state, get_state), so no PPO
+    assert hasattr(teacher, 'policy') and \
+        hasattr(teacher, 'append_state') and \
+        not isinstance(teacher.action_size, list) and \
+        not hasattr(teacher.policy, 'init_hidden'), \
+        'Teacher has to be a discrete action agent with a feed forward ' \
+        'policy (dqn, ddqn, vpg), not {}'.format(type(teacher).__name__)
+
+    self.logger = get_logger(__file__, log_level=log_level)
+
+    self.student = student(teacher.state_size, teacher.action_size,
+                           self.device).to(self.device)
+
+    self.optimizer = build_optimizer(cfgs.get('opt_name', 'adam'),
+                                     self.student.parameters(),
+                                     fused=cfgs.get('fused_opt'), lr=self.lr)
+
+    self.teacher.eval()
+
+    self.logger.info('Done setting up {} with {} student'.format(
+        __class__.__name__, type(self.student).__name__))
+
+  def act(self, net, state, eps):
+
+    if random.random() < eps:
+      return random.randrange(self.teacher.action_size)
+
+    with torch.no_grad():
+      q, _ = net(state)
+
+    return q.max(1)[1].item()
+
+  def collect(self, env, n_observations, max_steps):
+
+    states = []
+
+    pbar = tqdm.tqdm(total=n_observations, ascii=True, unit='obs')
+
+    while len(states) < n_observations:
+
+      self.teacher.reset()
+      self.teacher.append_state(env.reset())
+
+      for step in range(max_steps):
+
+        state = self.teacher.get_state()
+        states.append(state)
+        pbar.update(1)
+
+        action = self.act(self.teacher.policy, state, self.eps)
+        next_state, reward, done, info = env.step(action)
+
+        if done or len(states) >= n_observations:
+          break
+
+        self.teacher.append_state(next_state)
+
+    pbar.close()
+
+    return torch.cat(states)
+
+  def evaluate(self, net, env, n_episodes, max_steps):
+
+    scores = []
+
+    for ep in range(n_episodes):
+
+      score = 0.0
+      self.teacher.reset()
+      self.teacher.append_state(env.reset())
+
+      for step in range(max_steps):
+
+        action = self.act(net, self.teacher.get_state(), self.eps)
+        next_state, reward, done, info = env.step(action)
+        score += reward
+
+        if done:
+          break
+
+        self.teacher.append_state(next_state)
+
+      scores.append(score)
+
+    return np.mean(scores)
+
+  def teacher_targets(self, states):
+
+    targets = []
+
+    with torch.no_grad():
+      for chunk in torch.split(states, self.batch_size * 4):
+        q, _ = self.teacher.policy(chunk)
+        targets.append(q.float().cpu())
+
+    return torch.cat(targets)
+
+  def loss(self, q, targets):
+
+    if self.loss_type == 'mse':
+      return F.mse_loss(q, targets)
+
+    # KL(teacher || student) with a sharpened teacher distribution
+    p = F.softmax(targets / self.temperature, dim=1)
+    return F.kl_div(F.log_softmax(q, dim=1), p, reduction='batchmean')
+
+  def agreement(self, states, targets):
+
+    self.student.eval()
+
+    matches = []
+
+    with torch.no_grad():
+      for s, t in zip(torch.split(states, self.batch_size * 4),
+                      torch.split(targets, self.batch_size * 4)):
+        q, _ = self.student(s)
+        matches.append(q.max(1)[1].cpu() == t.max(1)[1])
+
+    self.student.train()
+
+    return torch.cat(matches).float().mean().item()
+
+  def train(self, states):
+
+    targets = self.teacher_targets(states)
+
+    n_val = int(len(states) * self.val_split)
+    idx = torch.randperm(len(states))
+    val_idx, train_idx = idx[:n_val], idx[n_val:]
+
+    train_ep = tqdm.tqdm(range(self.epochs), ascii=True, unit='epoch')
+    agreement = float('nan')
+
+    for ep in train_ep:
+
+      losses = []
+      order = train_idx[torch.randperm(len(train_idx))]
+
+      for batch in torch.split(order, self.batch_size):
+
+        q, _ = self.student(states[batch])
+        loss = self.loss(q, targets[batch].to(self.device))
+
+        self.optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        self.optimizer.step()
+
+        losses.append(loss.item())
+
+      agreement = self.agreement(states[val_idx], targets[val_idx]) \
+          if n_val else float('nan')
+
+      train_ep.set_description('Loss : {0:.4f}, '
+                               'Agreement : {1:.3f}'.format(np.mean(losses),
+                                                            agreement))
+
+    return agreement
+
+  def distill(self, env, distill_cfgs, gitsha, model_dest):
+
+    dataset = distill_cfgs.get('dataset')
+    max_steps = distill_cfgs.get('max_steps', 10000)
+    n_observations = distill_cfgs.get('n_observations', 100000)
+    n_eval_episodes = distill_cfgs.get('n_eval_episodes', 5)
+
+    if dataset and Path(dataset).is_file():
+      self.logger.info('Loading observations from {}'.format(dataset))
+      states = torch.load(dataset)
+    else:
+      self.logger.info('Collecting {} observations'.format(n_observations))
+      states = self.collect(env, n_observations, max_steps)
+      if dataset:
+        torch.save(states, dataset)
+        self.logger.info('Saved observations to {}'.format(dataset))
+
+    agreement = self.train(states)
+
+    tag = 'student-final-{0}'.format(gitsha)
+    write_model(self.student, tag, model_dest)
+
+    self.logger.info('Agreement with teacher {:.3f}'.format(agreement))
+
+    if not n_eval_episodes:
+      return
+
+    teacher_scr = self.evaluate(self.teacher.policy, env,
+                                n_eval_episodes, max_steps)
+    student_scr = self.evaluate(self.student.eval(), env,
+                                n_eval_episodes, max_steps)
+    retained = student_scr / teacher_scr if teacher_scr else float('nan')
+
+    self.logger.info('Teacher score {:.3f}, student score {:.3f}, '
+                     'retained {:.3f}'.format(teacher_scr, student_scr,
+                                              retained))
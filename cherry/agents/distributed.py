@@ -0,0 +1,73 @@
+from collections import OrderedDict
+
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+from cherry.agents.models import TargetNetwork
+from utils.helpers import get_logger
+
+logger = get_logger(__file__)
+
+# leaves room for the per env seeds (seed + idx) of vector envs on each rank
+SEED_STRIDE = 1000
+
+# learned models of each agent, the ones gradients are all-reduced for
+DDP_MODULES = OrderedDict({'dqn': ['policy'],
+                           'ddqn': ['policy'],
+                           'drqn': ['policy'],
+                           'dqn-multitask': ['policy'],
+                           'vpg': ['policy', 'value'],
+                           'ppo': ['policy'],
+                           'ddpg': ['actor', 'critic'],
+                           'td3': ['actor', 'critic']})
+
+
+def rank_seed(seed, rank):
+
+  return None if seed is None else seed + rank * SEED_STRIDE
+
+
+def init_distributed(rank, world_size, master_addr, master_port):
+
+  dist.init_process_group('gloo', init_method='tcp://{}:{}'.format(
+      master_addr, master_port), rank=rank, world_size=world_size)
+
+  logger.info('Joined process group, rank {}/{}'.format(rank, world_size))
+
+
+def distribute(agent, agent_type, train_cfgs):
+  """
+    Wraps the learned models of agent in DistributedDataParallel. Rank 0
+    weights are broadcast on wrapping, the target models are synced to
+    them. Acting stays on the plain models
+  """
+
+  assert agent_type in DDP_MODULES, \
+      'No data parallel training for {}'.format(agent_type)
+  assert not train_cfgs.get('n_actors'), 'Ape-X actors with --nproc'
+  assert not train_cfgs.get('learner_thread'), 'Learner thread with --nproc'
+  assert not getattr(agent, 'stop_gradient', False), \
+      'Stop gradient calls the model heads outside of forward'
+  assert not getattr(agent, 'frozen_encoder', False), \
+      'Frozen encoder calls the model heads outside of forward'
+
+  wrapped = {}
+
+  for name in DDP_MODULES[agent_type]:
+
+    model = getattr(agent, name)
+
+    # shared trunk, policy and value are the same model
+    if id(model) not in wrapped:
+      # heads unused by a loss (f.ex value head of DQN) get no gradients,
+      # buffers (batchnorm) stay per rank so forwards need no collectives
+      wrapped[id(model)] = DistributedDataParallel(
+          model, find_unused_parameters=True, broadcast_buffers=False)
+
+    setattr(agent, name, wrapped[id(model)])
+
+  for sync in vars(agent).values():
+    if isinstance(sync, TargetNetwork):
+      sync.hard_update()
+
+  return agent
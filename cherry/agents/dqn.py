@@ -3,6 +3,7 @@ import os
 import sys
 import math
 from pathlib import Path
+from contextlib import nullcontext
 from collections import deque, namedtuple
 
 import tqdm
@@ -16,8 +17,14 @@ import torch.nn.functional as F
 from skvideo.io import FFmpegWriter as vid_writer
 from torchvision.transforms import Compose, CenterCrop, Resize, ToPILImage
 
-from cherry.agents import ReplayBuffer
-from utils.helpers import get_logger, write_model, OPTS
+from cherry.agents import ReplayBuffer, TargetNetwork, freeze_encoder, \
+    load_encoder
+from cherry.agents.apex import ApeX
+from cherry.agents.learner import build_learner
+from cherry.agents.schedulers import ReplayRatio
+from utils.helpers import get_logger, build_optimizer, maybe_compile
+from utils.checkpoint import write_model, write_state, read_state, \
+    load_weights, unwrap_model
 
 
 class DQN():
@@ -41,6 +48,12 @@ class DQN():
     self.state_len = cfgs['state_len']
     self.action_size = cfgs['action_size']
     self.input_transforms = cfgs['input_transforms']
+    self.cfgs = cfgs
+    self.log_level = log_level
+    self.compile = cfgs.get('compile')
+    self.frozen_encoder = cfgs.get('frozen_encoder')
+    self.encoder_file = cfgs.get('encoder_file')
+    self.fused_opt = cfgs.get('fused_opt')
     self.grad_clip = cfgs['grad_clip']
     self.device = device
     self.eps = self.max_eps
@@ -61,21 +74,41 @@ class DQN():
 
     # self.policy.apply(self.policy.init_weights)
 
+    if self.encoder_file:
+      self.logger.info('Loading encoder weights from {}'.format(
+          self.encoder_file))
+      load_encoder(self.policy, self.encoder_file)
+
+    params = self.policy.parameters()
+    if self.frozen_encoder:
+      params = freeze_encoder(self.policy)
+
     self.target = model(self.state_size, self.action_size,
                         self.device).to(self.device)
 
-    self.target.load_state_dict(self.policy.state_dict())
+    self.target_sync = TargetNetwork(self.policy, self.target)
+    self.target_sync.hard_update()
     self.target.eval()
 
-    optimizer = OPTS.get(cfgs['opt_name'])
+    # acting copy and its lock, swapped out by a learner thread
+    self.acting = self.policy
+    self.acting_lock = nullcontext()
 
-    self.optimizer = optimizer(self.policy.parameters(), lr=self.lr)
+    self.optimizer = build_optimizer(cfgs['opt_name'], params,
+                                     fused=self.fused_opt, lr=self.lr)
+    self.loss_fn = maybe_compile(self.loss, self.compile)
 
     self.reset()
     buffer_shape = list(self.get_state(complete=True).shape)[1:]
+    buffer_type = torch.uint8
+
+    if self.frozen_encoder:
+      # float16 embeddings of state + next state instead of frames
+      buffer_shape = [2, self.embed(self.get_state()).size(1)]
+      buffer_type = torch.float16
 
-    self.replay = ReplayBuffer(self.replay_size, buffer_shape,
-                               1, device=self.device)
+    self.replay = ReplayBuffer(self.replay_size, buffer_shape, 1,
+                               state_type=buffer_type, device=self.device)
     if model_file:
       self.load_model(model_file)
 
@@ -106,7 +139,24 @@ class DQN():
   def load_model(self, model_file):
 
     self.logger.info('Loading agent weights from {}'.format(model_file))
-    self.policy.load_state_dict(torch.load(model_file))
+    load_weights(self.policy, model_file, self.device)
+
+  def state_dict(self):
+    """Training state besides the replay, see write_state"""
+
+    # keys without the module. prefix of data parallel models, a state
+    # resumes with any number of ranks
+    return {'policy': unwrap_model(self.policy).state_dict(),
+            'target': unwrap_model(self.target).state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'eps': self.eps}
+
+  def load_state_dict(self, state):
+
+    unwrap_model(self.policy).load_state_dict(state['policy'])
+    unwrap_model(self.target).load_state_dict(state['target'])
+    self.optimizer.load_state_dict(state['optimizer'])
+    self.eps = state['eps']
 
   def eval(self):
 
@@ -115,8 +165,8 @@ class DQN():
   def get_action(self, state):
 
     if random.random() > self.eps:
-      with torch.no_grad():
-        q, _ = self.policy(state)
+      with self.acting_lock, torch.no_grad():
+        q, _ = self.acting(state)
         a = q.max(1)[1].cpu().view(1, 1)
     else:
       a = torch.tensor([[random.randrange(self.action_size)]],
@@ -150,47 +200,82 @@ class DQN():
     size = [1, 0][complete]
     return torch.cat(list(self.history)[size:]).unsqueeze(0)
 
+  def embed(self, states):
+    """Frozen encoder features, float16 on the host"""
+
+    # encoder weights never change, no need for the acting copy + lock
+    with torch.no_grad():
+      return self.policy.features(states).half().cpu()
+
   def push_to_memory(self, states, action, reward, done):
 
+    if self.frozen_encoder:
+      # state + next state through the encoder as one batch
+      states = self.embed(torch.cat([states[:, :self.state_len],
+                                     states[:, 1:]])).unsqueeze(0)
+
     self.replay.push(states, action, reward, done)
 
   def get_episode_rewards(self):
 
     return np.sum(self.rewards)
 
-  def optimize(self, batch_size=32):
-
-    if len(self.replay) < batch_size:
-      return
-
-    batch = self.replay.sample(batch_size)
-
-    states, action, reward, done = batch
+  def loss(self, states, action, reward, done):
 
+    policy, target = self.policy, self.target
     state_batch = states[:, :self.state_len]
     next_state_batch = states[:, 1:]
 
-    q_values, _ = self.policy(state_batch)
+    if self.frozen_encoder:
+      # cached embeddings, only the heads run
+      policy, target = self.policy.heads, self.target.heads
+      state_batch = states[:, 0].float()
+      next_state_batch = states[:, 1].float()
+
+    q_values, _ = policy(state_batch)
     q_values = q_values.gather(1, action)
-    q_values_next, _ = self.target(next_state_batch)
-    q_values_next = q_values_next.max(1)[0].detach()
+
+    # no autograd graph for the target side
+    with torch.no_grad():
+      q_values_next, _ = target(next_state_batch)
+      q_values_next = q_values_next.max(1)[0]
 
     # Bellman Equation : Computes the expected Q values (target)
     q_values_target = (q_values_next * self.gamma) * (1. - done[:, 0]) + reward[:, 0]
 
     # Compute Huber loss
-    loss = F.smooth_l1_loss(q_values, q_values_target.unsqueeze(1))
+    return F.smooth_l1_loss(q_values, q_values_target.unsqueeze(1))
+
+  def optimize(self, batch_size=32, grad_accum=1):
+
+    if len(self.replay) < batch_size:
+      return False
+
+    self.optimizer.zero_grad(set_to_none=True)
+
+    # large batch as grad_accum batches of batch_size
+    for _ in range(grad_accum):
+
+      batch = self.replay.sample(batch_size)
+
+      states, action, reward, done = batch
+
+      # one host -> device copy for both overlapping slices
+      states = states.to(self.device)
+
+      loss = self.loss_fn(states, action, reward, done)
+      (loss / grad_accum).backward()
 
     # Optimize the model
-    self.optimizer.zero_grad()
-    loss.backward()
     nn.utils.clip_grad_value_(self.policy.parameters(), self.grad_clip)
     self.optimizer.step()
 
+    return True
+
   def update_target(self, step):
 
     self.logger.debug('Updating agent at {}'.format(step))
-    self.target.load_state_dict(self.policy.state_dict())
+    self.target_sync.hard_update()
 
   def show_score(self, pbar, step):
 
@@ -204,20 +289,43 @@ class DQN():
 
   def train(self, env, train_cfgs, gitsha, model_dest):
 
-    batch_size = train_cfgs['batch_size']
+    if train_cfgs.get('n_actors'):
+      assert not train_cfgs.get('resume'), 'No resume for Ape-X training'
+      assert not self.frozen_encoder, 'Actors push frames, no frozen encoder'
+      apex = ApeX(self, log_level=self.log_level)
+      return apex.train(env, train_cfgs, gitsha, model_dest)
+
     update_target = train_cfgs['update_target']
     save_model = train_cfgs['save_model']
     train_eps = train_cfgs['n_train_episodes']
     max_steps = train_cfgs['max_steps']
-    policy_update = train_cfgs['policy_update']
-
-    train_ep = tqdm.tqdm(range(train_eps), ascii=True,
-                         unit='episode', leave=False)
+    save_state = train_cfgs.get('save_state')
 
     global_step = 0
+    start_ep = 0
+    # checkpoint score, average reward of the last 100 episodes
+    scores = deque(maxlen=100)
+
+    if train_cfgs.get('resume'):
+      progress = read_state(self, model_dest)
+      start_ep = progress['episode']
+      scores.extend(progress['scores'])
+      self.logger.info('Resuming at episode {}'.format(start_ep))
+
+    scheduler = ReplayRatio(train_cfgs)
+    learner = build_learner(self, self.policy, train_cfgs)
+
+    train_ep = tqdm.tqdm(range(start_ep, train_eps), ascii=True,
+                         unit='episode', leave=False)
 
     for ep in train_ep:
 
+      # episodes restart on resume, the state is saved in between them
+      if save_state and ep > start_ep and ep % save_state == 0:
+        learner.submit(write_state, self, {'episode': ep,
+                                           'scores': list(scores)},
+                       model_dest)
+
       self.reset()
       frame = env.reset()
 
@@ -243,6 +351,7 @@ class DQN():
 
         if done:
           ep_reward = self.get_episode_rewards()
+          scores.append(ep_reward)
 
           self.reset()
           next_frame = env.reset()
@@ -254,15 +363,22 @@ class DQN():
                                                             ep_reward,
                                                             self.eps))
 
-        if global_step % policy_update == 0:
-          self.optimize(batch_size=batch_size)
+        n_updates = scheduler.step(global_step)
+        if n_updates:
+          learner.submit(scheduler.update, self.optimize, n_updates)
 
         if global_step % update_target == 0:
-          self.update_target(global_step)
+          learner.submit(self.update_target, global_step)
 
         if global_step % save_model == 0:
           tag = '{0:09d}-{1}'.format(global_step, gitsha)
-          write_model(self.policy, tag, model_dest)
+          learner.submit(write_model, self.policy, tag, model_dest,
+                         score=np.mean(scores) if scores else None)
+
+      self.logger.debug('Episode {0}, {1}'.format(ep, scheduler.summary()))
+
+    learner.close()
+    self.logger.info('Done training, {}'.format(scheduler.summary()))
 
     tag = 'final-{0}'.format(gitsha)
     write_model(self.policy, tag, model_dest)
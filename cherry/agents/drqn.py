@@ -0,0 +1,259 @@
+# https://arxiv.org/abs/1507.06527 (DRQN), burn-in + stored state from R2D2
+from collections import deque
+from contextlib import nullcontext
+
+import tqdm
+import torch
+import random
+import numpy as np
+from torch import nn
+import torch.nn.functional as F
+
+from cherry.agents import SequenceReplayBuffer, TargetNetwork
+from cherry.agents.dqn import DQN
+from cherry.agents.learner import build_learner
+from cherry.agents.schedulers import ReplayRatio
+from utils.helpers import get_logger, build_optimizer, maybe_compile
+from utils.checkpoint import write_model
+
+
+class DRQN(DQN):
+
+  def __init__(self, cfgs, model=None, model_file=None,
+               device=None, log_level='info'):
+    """
+      DQN with a recurrent model (f.ex convnet-recurrent) acting on one frame
+      per step instead of state_len stacked frames. Replay holds single
+      frames and learns on segments of seq_len steps, the recurrent state is
+      warmed up over the burn_in steps before them
+    """
+
+    self.history = None
+    self.hidden = None
+    self.losses = None
+    self.rewards = None
+    self.top_scr = 0.0
+    self.crop_shape = cfgs['crop_shape']
+    self.input_shape = cfgs['input_shape']
+    self.lr = cfgs['lr']
+    self.gamma = cfgs['gamma']
+    self.max_eps = cfgs['max_eps']
+    self.min_eps = cfgs['min_eps']
+    self.eps_decay = cfgs['eps_decay']
+    self.replay_size = cfgs['replay_size']
+    self.action_size = cfgs['action_size']
+    self.input_transforms = cfgs['input_transforms']
+    self.seq_len = cfgs.get('seq_len', 40)
+    self.burn_in = cfgs.get('burn_in', 20)
+    self.cfgs = cfgs
+    self.log_level = log_level
+    self.compile = cfgs.get('compile')
+    self.fused_opt = cfgs.get('fused_opt')
+    self.grad_clip = cfgs['grad_clip']
+    self.device = device
+    self.eps = self.max_eps
+    # one frame per step, the recurrent state replaces the frame stack
+    self.state_len = 1
+    self.state_size = [self.state_len] + self.input_shape
+
+    assert self.input_shape is not None, 'Input shape has to be not None'
+    assert self.action_size is not None, 'Action size has to non None'
+    assert self.device is not None, 'Device has to be CPU/GPU'
+
+    self.zero_state = torch.zeros([1] + self.input_shape, dtype=torch.uint8)
+
+    self.logger = get_logger(__file__, log_level=log_level)
+
+    self.transform = self.state_transformer()
+
+    self.policy = model(self.state_size, self.action_size,
+                        self.device).to(self.device)
+
+    assert hasattr(self.policy, 'init_hidden'), 'DRQN needs a recurrent model'
+
+    self.policy.apply(self.policy.init_weights)
+
+    self.target = model(self.state_size, self.action_size,
+                        self.device).to(self.device)
+
+    self.target_sync = TargetNetwork(self.policy, self.target)
+    self.target_sync.hard_update()
+    self.target.eval()
+
+    # acting copy and its lock, swapped out by a learner thread
+    self.acting = self.policy
+    self.acting_lock = nullcontext()
+
+    self.optimizer = build_optimizer(cfgs['opt_name'],
+                                     self.policy.parameters(),
+                                     fused=self.fused_opt, lr=self.lr)
+    self.loss_fn = maybe_compile(self.loss, self.compile)
+
+    self.reset()
+
+    self.replay = SequenceReplayBuffer(self.replay_size, self.input_shape,
+                                       self.burn_in + self.seq_len,
+                                       self.policy.hidden_size,
+                                       device=self.device)
+    if model_file:
+      self.load_model(model_file)
+
+  def reset(self):
+
+    self.top_scr = 0.0
+    self.flush_episode()
+
+    self.history = [self.zero_state]
+    # policy may be wrapped (data parallel), acting is the plain model
+    self.hidden = self.acting.init_hidden()
+
+  def append_state(self, state):
+
+    super(DRQN, self).append_state(state)
+    self.history = self.history[-1:]
+
+  def get_state(self, complete=False):
+
+    # current frame as [1 (batch), 1 (step)] + input_shape
+    return self.history[-1].unsqueeze(0)
+
+  def get_action(self, state):
+
+    # the recurrent state moves on also for random actions
+    with self.acting_lock, torch.no_grad():
+      q, _, self.hidden = self.acting(state, self.hidden)
+
+    if random.random() > self.eps:
+      a = q[:, -1].max(1)[1].cpu().view(1, 1)
+    else:
+      a = torch.tensor([[random.randrange(self.action_size)]],
+                       device='cpu', dtype=torch.long)
+
+    return a.numpy()[0, 0].item()
+
+  def loss(self, frames, action, reward, done, hidden):
+
+    n_steps = self.burn_in + self.seq_len
+
+    # the first step of an episode starts from a zero recurrent state
+    resets = F.pad(done[:, :, 0], (1, 0))
+
+    with torch.no_grad():
+      q_values_next, _, _ = self.target(frames, hidden, resets)
+      q_values_next = q_values_next[:, self.burn_in + 1:].max(2)[0]
+
+      # warm up the stored (stale) recurrent state
+      if self.burn_in:
+        _, _, hidden = self.policy(frames[:, :self.burn_in], hidden,
+                                   resets[:, :self.burn_in])
+
+    q_values, _, _ = self.policy(frames[:, self.burn_in:n_steps], hidden,
+                                 resets[:, self.burn_in:n_steps])
+    q_values = q_values.gather(2, action[:, self.burn_in:])
+
+    # Bellman Equation : Computes the expected Q values (target)
+    q_values_target = (q_values_next * self.gamma) * \
+        (1. - done[:, self.burn_in:, 0]) + reward[:, self.burn_in:, 0]
+
+    # Compute Huber loss
+    return F.smooth_l1_loss(q_values, q_values_target.unsqueeze(2))
+
+  def optimize(self, batch_size=32, grad_accum=1):
+
+    if len(self.replay) < batch_size:
+      return False
+
+    self.optimizer.zero_grad(set_to_none=True)
+
+    # large batch as grad_accum batches of batch_size
+    for _ in range(grad_accum):
+
+      frames, action, reward, done, hidden = self.replay.sample(batch_size)
+
+      loss = self.loss_fn(frames.to(self.device), action, reward, done,
+                          hidden)
+      (loss / grad_accum).backward()
+
+    # Optimize the model
+    nn.utils.clip_grad_value_(self.policy.parameters(), self.grad_clip)
+    self.optimizer.step()
+
+    return True
+
+  def train(self, env, train_cfgs, gitsha, model_dest):
+
+    assert not train_cfgs.get('n_actors'), 'DRQN trains in a single process'
+
+    update_target = train_cfgs['update_target']
+    save_model = train_cfgs['save_model']
+    train_eps = train_cfgs['n_train_episodes']
+    max_steps = train_cfgs['max_steps']
+
+    scheduler = ReplayRatio(train_cfgs)
+    learner = build_learner(self, self.policy, train_cfgs)
+
+    train_ep = tqdm.tqdm(range(train_eps), ascii=True,
+                         unit='episode', leave=False)
+
+    global_step = 0
+    # checkpoint score, average reward of the last 100 episodes
+    scores = deque(maxlen=100)
+
+    for ep in train_ep:
+
+      self.reset()
+      frame = env.reset()
+
+      self.append_state(frame)
+
+      train_step = tqdm.tqdm(range(max_steps), ascii=True,
+                             unit='stp', leave=False)
+
+      for step in train_step:
+
+        global_step = ep * max_steps + step
+        self.set_eps(global_step)
+
+        state = self.get_state()
+        hidden = self.hidden
+        action = self.get_action(state)
+
+        next_state, reward, done, info = env.step(action)
+        self.append_reward(reward)
+
+        # frame acted on + recurrent state before it
+        self.replay.push(state[0, 0], action, reward, done, hidden[0])
+
+        if done:
+          ep_reward = self.get_episode_rewards()
+          scores.append(ep_reward)
+
+          self.reset()
+          next_state = env.reset()
+
+          train_step.set_description('{0}/{1}, Reward : {2:.3f}, '
+                                     'Eps : {3:.4f}'.format(ep, step,
+                                                            ep_reward,
+                                                            self.eps))
+
+        self.append_state(next_state)
+
+        n_updates = scheduler.step(global_step)
+        if n_updates:
+          learner.submit(scheduler.update, self.optimize, n_updates)
+
+        if global_step % update_target == 0:
+          learner.submit(self.update_target, global_step)
+
+        if global_step % save_model == 0:
+          tag = '{0:09d}-{1}'.format(global_step, gitsha)
+          learner.submit(write_model, self.policy, tag, model_dest,
+                         score=np.mean(scores) if scores else None)
+
+      self.logger.debug('Episode {0}, {1}'.format(ep, scheduler.summary()))
+
+    learner.close()
+    self.logger.info('Done training, {}'.format(scheduler.summary()))
+
+    tag = 'final-{0}'.format(gitsha)
+    write_model(self.policy, tag, model_dest)
@@ -0,0 +1,377 @@
+import copy
+from pathlib import Path
+from collections import deque
+
+import tqdm
+import torch
+import numpy as np
+from gym import wrappers
+import torch.nn.functional as F
+
+from cherry.envs import build_vector_env
+from cherry.agents.models import EnsembleReplayBuffer
+from cherry.agents.schedulers import ReplayRatio
+from utils.helpers import get_logger
+from utils.checkpoint import write_model, read_checkpoint
+
+
+class EnsembleDQN():
+
+  def __init__(self, cfgs, model=None, model_file=None,
+               device=None, log_level='info'):
+    """
+      n_members independent DQN agents (f.ex a seed or lr sweep) trained
+      side by side in one process. Member parameters are stacked, forwards
+      are vmapped functional calls of one model and one Adam step updates
+      all members, each with its own lr. Member m acts on env m of a vector
+      env and replays from its own slice of the replay. Meant for small
+      (MLP) models which leave the CPU mostly idle when trained alone
+    """
+
+    self.histories = None
+    self.lr = cfgs['lr']
+    self.gamma = cfgs['gamma']
+    self.max_eps = cfgs['max_eps']
+    self.min_eps = cfgs['min_eps']
+    self.eps_decay = cfgs['eps_decay']
+    self.replay_size = cfgs['replay_size']
+    self.state_len = cfgs['state_len']
+    self.action_size = cfgs['action_size']
+    self.input_shape = cfgs['input_shape']
+    self.n_members = cfgs.get('n_members', 4)
+    self.seeds = cfgs.get('seeds')
+    self.grad_clip = cfgs.get('grad_clip')
+    self.cfgs = cfgs
+    self.log_level = log_level
+    self.model = model
+    self.model_file = model_file
+    self.device = device
+    self.eps = self.max_eps
+    self.state_size = [self.state_len] + self.input_shape
+
+    # one lr for all members or one per member
+    self.lrs = self.lr if isinstance(self.lr, list) else \
+        [self.lr] * self.n_members
+
+    assert self.input_shape, 'Input shape has to be not None'
+    assert self.action_size, 'Action size has to non None'
+    assert self.device, 'Device has to be CPU/GPU'
+    assert not cfgs.get('input_transforms'), 'Low dimensional states only'
+    assert cfgs['opt_name'] == 'adam', 'Stacked members are updated by Adam'
+    assert len(self.lrs) == self.n_members, 'One lr per member'
+    assert self.seeds is None or len(self.seeds) == self.n_members, \
+        'One seed per member'
+
+    self.zero_state = torch.zeros([1] + self.input_shape)
+
+    # torch.func (torch >= 2.0) is imported here, other agents run without
+    try:
+      from torch.func import stack_module_state
+    except ImportError:
+      raise ImportError('{} needs torch.func (torch >= 2.0), found torch '
+                        '{}'.format(__class__.__name__, torch.__version__))
+
+    self.logger = get_logger(__file__, log_level=log_level)
+
+    members = []
+    for m in range(self.n_members):
+      if self.seeds is not None:
+        torch.manual_seed(self.seeds[m])
+      members.append(model(self.state_size, self.action_size,
+                           self.device).to(self.device))
+
+    # stateless copy of the model, called with the stacked member weights
+    self.base = copy.deepcopy(members[0]).to('meta')
+
+    self.params, self.buffers = stack_module_state(members)
+    self.target = {k: v.detach().clone() for k, v in self.params.items()}
+
+    self.member_lr = torch.tensor(self.lrs, device=self.device)
+    self.adam_state = {k: (torch.zeros_like(v), torch.zeros_like(v))
+                       for k, v in self.params.items()}
+    self.adam_step = 0
+
+    self.replay = EnsembleReplayBuffer(self.n_members, self.replay_size,
+                                       [self.state_len + 1] +
+                                       self.input_shape, device=self.device)
+
+    if model_file:
+      self.load_model(model_file)
+
+    self.logger.info('Done setting up {} Agent, {} members'.format(
+        __class__.__name__, self.n_members))
+
+  def forward(self, params, states):
+    """Q values of all members, states as [n_members, batch, ..]"""
+
+    from torch.func import functional_call, vmap
+
+    def member(p, b, x):
+      return functional_call(self.base, (p, b), (x,))
+
+    return vmap(member)(params, self.buffers, states)
+
+  def load_model(self, model_file):
+    """Weights of one member checkpoint, copied to every member"""
+
+    self.logger.info('Loading agent weights from {}'.format(model_file))
+
+    state_dict = read_checkpoint(model_file, map_location=self.device)
+
+    with torch.no_grad():
+      for k, v in list(self.params.items()) + list(self.buffers.items()):
+        v.copy_(state_dict[k])
+
+  def member(self, m):
+    """Member m as a standalone model (f.ex for checkpoints)"""
+
+    model = self.model(self.state_size, self.action_size, self.device)
+
+    state_dict = {k: v[m].detach() for k, v in self.params.items()}
+    state_dict.update({k: v[m] for k, v in self.buffers.items()})
+    model.load_state_dict(state_dict)
+
+    return model
+
+  def reset(self):
+
+    no_history = [self.zero_state for _ in range(self.state_len + 1)]
+    self.histories = [deque(no_history, maxlen=self.state_len + 1)
+                      for _ in range(self.n_members)]
+
+  def frame(self, state):
+
+    state = self.zero_state if state is None else state
+
+    return torch.as_tensor(np.asarray(state), dtype=torch.float32).view(
+        [1] + self.input_shape)
+
+  def append_states(self, states):
+
+    for history, state in zip(self.histories, states):
+      history.append(self.frame(state))
+
+  def set_state(self, idx, state):
+    """First frame of an episode fills the history of member idx"""
+
+    frame = self.frame(state)
+
+    for _ in range(self.state_len + 1):
+      self.histories[idx].append(frame)
+
+  def get_states(self, complete=False):
+
+    size = [1, 0][complete]
+
+    return torch.stack([torch.cat(list(history)[size:])
+                        for history in self.histories])
+
+  def set_eps(self, step):
+
+    self.eps = max(self.max_eps - (self.max_eps - self.min_eps) * step /
+                   self.eps_decay, self.min_eps)
+
+  def get_actions(self, states):
+
+    with torch.no_grad():
+      q, _ = self.forward(self.params, states.unsqueeze(1))
+
+    actions = q[:, 0].max(1)[1].cpu()
+
+    # epsilon greedy, drawn for every member
+    explore = torch.rand(self.n_members) < self.eps
+    random_actions = torch.randint(0, self.action_size, (self.n_members,))
+
+    return torch.where(explore, random_actions, actions)
+
+  def loss(self, states, action, reward, done):
+
+    state_batch = states[:, :, :self.state_len]
+    next_state_batch = states[:, :, 1:]
+
+    q_values, _ = self.forward(self.params, state_batch)
+    q_values = q_values.gather(2, action)
+
+    # no autograd graph for the target side
+    with torch.no_grad():
+      q_values_next, _ = self.forward(self.target, next_state_batch)
+      q_values_next = q_values_next.max(2, keepdim=True)[0]
+
+    # Bellman Equation : Computes the expected Q values (target)
+    q_values_target = (q_values_next * self.gamma) * (1. - done) + reward
+
+    # members are independent, the sum gives each member its own gradients
+    return F.smooth_l1_loss(q_values, q_values_target,
+                            reduction='none').mean((1, 2)).sum()
+
+  def step_adam(self, betas=(0.9, 0.999), eps=1e-8):
+    """Adam step on the stacked parameters with a lr per member"""
+
+    self.adam_step += 1
+
+    b1, b2 = betas
+    bias1 = 1. - b1 ** self.adam_step
+    bias2 = 1. - b2 ** self.adam_step
+
+    with torch.no_grad():
+      for k, p in self.params.items():
+
+        if p.grad is None:
+          continue
+
+        exp_avg, exp_avg_sq = self.adam_state[k]
+        exp_avg.mul_(b1).add_(p.grad, alpha=1. - b1)
+        exp_avg_sq.mul_(b2).addcmul_(p.grad, p.grad, value=1. - b2)
+
+        lr = self.member_lr.view([-1] + [1] * (p.dim() - 1))
+        denom = (exp_avg_sq / bias2).sqrt_().add_(eps)
+        p.sub_(lr * (exp_avg / bias1) / denom)
+
+  def optimize(self, batch_size=32, grad_accum=1):
+
+    if len(self.replay) < batch_size:
+      return False
+
+    for p in self.params.values():
+      p.grad = None
+
+    for _ in range(grad_accum):
+
+      states, action, reward, done = self.replay.sample(batch_size)
+
+      loss = self.loss(states.to(self.device), action, reward, done)
+      (loss / grad_accum).backward()
+
+    if self.grad_clip:
+      for p in self.params.values():
+        if p.grad is not None:
+          p.grad.clamp_(-self.grad_clip, self.grad_clip)
+
+    self.step_adam()
+
+    return True
+
+  def update_target(self, step):
+
+    self.logger.debug('Updating agent at {}'.format(step))
+
+    with torch.no_grad():
+      for k, p in self.params.items():
+        self.target[k].copy_(p)
+
+  def write_members(self, tag, model_dest, scores=None):
+
+    for m in range(self.n_members):
+      score = np.mean(scores[m]) if scores and scores[m] else None
+      write_model(self.member(m), '{}-member{:02d}'.format(tag, m),
+                  model_dest, score=score)
+
+  def train(self, env, train_cfgs, gitsha, model_dest):
+
+    update_target = train_cfgs['update_target']
+    save_model = train_cfgs['save_model']
+    n_train_steps = train_cfgs['n_train_steps']
+    subproc = train_cfgs.get('subproc')
+
+    # member m acts on env m, the trainer's env only lends its cfgs
+    venv = build_vector_env(env.cfgs, self.n_members, subproc=subproc,
+                            seeds=self.seeds)
+    env.close()
+    scheduler = ReplayRatio(train_cfgs)
+
+    self.reset()
+    for idx, state in enumerate(venv.reset()):
+      self.set_state(idx, state)
+
+    ep_rewards = np.zeros(self.n_members)
+    scores = [deque(maxlen=100) for _ in range(self.n_members)]
+
+    train_step = tqdm.tqdm(range(n_train_steps), ascii=True, unit='stp')
+
+    for step in train_step:
+
+      self.set_eps(step)
+
+      actions = self.get_actions(self.get_states())
+      next_states, rewards, dones, infos = venv.step(actions.tolist())
+
+      self.append_states(next_states)
+      self.replay.push(self.get_states(complete=True), actions,
+                       torch.tensor(rewards, dtype=torch.float32),
+                       torch.tensor(dones))
+
+      ep_rewards += rewards
+      for idx, done in enumerate(dones):
+        if done:
+          scores[idx].append(ep_rewards[idx])
+          ep_rewards[idx] = 0.0
+          # envs reset on done, next_states holds the first frame
+          self.set_state(idx, next_states[idx])
+
+      n_updates = scheduler.step(step)
+      if n_updates:
+        scheduler.update(self.optimize, n_updates)
+
+      if step % update_target == 0:
+        self.update_target(step)
+
+      if step % save_model == 0:
+        self.write_members('{0:09d}-{1}'.format(step, gitsha), model_dest,
+                           scores)
+
+      if step % 1000 == 0:
+        mean_rewards = [np.mean(s) if s else 0.0 for s in scores]
+        train_step.set_description('Best reward : {0:.3f}, '
+                                   'Eps : {1:.4f}'.format(max(mean_rewards),
+                                                          self.eps))
+
+    venv.close()
+
+    self.logger.info('Done training, {}'.format(scheduler.summary()))
+
+    for m in range(self.n_members):
+      seed = None if self.seeds is None else self.seeds[m]
+      self.logger.info('Member {0:02d}, seed {1}, lr {2}, average reward '
+                       '{3:.3f}'.format(m, seed, self.lrs[m],
+                                        np.mean(scores[m]) if scores[m]
+                                        else 0.0))
+
+    self.write_members('final-{0}'.format(gitsha), model_dest)
+
+  def play(self, env, test_cfgs, gitsha):
+
+    # greedy member 0, all members hold the loaded checkpoint
+    self.eps = 0.0
+
+    state_dest = test_cfgs['state_dest']
+    test_episodes = test_cfgs['n_test_episodes']
+    max_steps = test_cfgs['max_steps']
+
+    vid_dst = Path(state_dest)
+    vid_dst.mkdir(parents=True, exist_ok=True)
+
+    env.update_env(wrappers.Monitor, directory=vid_dst.as_posix(), force=True)
+    test_ep = tqdm.tqdm(range(test_episodes), ascii=True, unit='episode')
+
+    for ep in test_ep:
+
+      self.reset()
+      state = env.reset()
+
+      self.set_state(0, state)
+
+      test_step = tqdm.tqdm(range(max_steps), ascii=True, unit='stp')
+      total_reward = 0.0
+
+      for step in test_step:
+
+        action = self.get_actions(self.get_states())[0].item()
+        next_state, reward, done, info = env.step(action)
+        total_reward += reward
+
+        if done:
+          test_step.set_description('{0}/{1} Reward : {2:.3f}'.format(
+              ep, step, total_reward))
+          break
+
+        self.append_states([next_state])
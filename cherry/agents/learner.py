@@ -0,0 +1,115 @@
+import copy
+import queue
+import threading
+from contextlib import nullcontext
+
+from torch import nn
+
+from cherry.agents import TargetNetwork
+
+
+class InlineLearner():
+
+  def __init__(self):
+    """Runs learner jobs right away in the calling (acting) thread"""
+
+    pass
+
+  def submit(self, fn, *args, **kwargs):
+
+    fn(*args, **kwargs)
+
+  def close(self):
+
+    pass
+
+
+class LearnerThread(threading.Thread):
+
+  def __init__(self, agent, net, max_pending=4, sync_every=1):
+    """
+      Runs learner jobs (optimize, target updates, checkpoints) on a
+      dedicated thread while the calling thread keeps acting. The agent acts
+      with a copy of net, refreshed under a lock every sync_every jobs.
+      At most max_pending jobs are queued, submit blocks beyond that which
+      bounds how stale the acting copy can get
+    """
+
+    super(LearnerThread, self).__init__(daemon=True)
+
+    self.jobs = queue.Queue(maxsize=max_pending)
+    self.sync_every = sync_every
+    self.error = None
+    self.lock = threading.Lock()
+
+    self.agent = agent
+    self.net = net
+    self.acting = copy.deepcopy(net)
+    self.acting_sync = TargetNetwork(net, self.acting)
+
+    agent.acting = self.acting
+    agent.acting_lock = self.lock
+
+  def submit(self, fn, *args, **kwargs):
+
+    if self.error is not None:
+      raise self.error
+
+    self.jobs.put((fn, args, kwargs))
+
+  def close(self):
+
+    self.jobs.put(None)
+    self.join()
+
+    # act with the learned weights again
+    self.agent.acting = self.net
+    self.agent.acting_lock = nullcontext()
+
+    if self.error is not None:
+      raise self.error
+
+  def run(self):
+
+    n_jobs = 0
+
+    while True:
+
+      job = self.jobs.get()
+
+      if job is None:
+        break
+
+      if self.error is not None:
+        continue
+
+      fn, args, kwargs = job
+
+      try:
+        fn(*args, **kwargs)
+      except Exception as err:
+        self.error = err
+        continue
+
+      n_jobs += 1
+
+      if n_jobs % self.sync_every == 0:
+        with self.lock:
+          self.acting_sync.hard_update()
+
+
+def build_learner(agent, net, train_cfgs):
+
+  # acting copies are torch models, f.ex never of an onnxruntime policy
+  assert isinstance(net, nn.Module), \
+      'Learner needs a torch model, not {}'.format(type(net).__name__)
+
+  if not train_cfgs.get('learner_thread'):
+    return InlineLearner()
+
+  learner = LearnerThread(agent, net,
+                          max_pending=train_cfgs.get('max_pending', 4),
+                          sync_every=train_cfgs.get('learner_sync', 1))
+  learner.start()
+
+  return learner
@@ -1,16 +1,23 @@
+import os
+import threading
+
 import torch
+import numpy as np
 from torch import nn
 import torch.nn.functional as F
 from functools import reduce
 
+from utils.checkpoint import read_checkpoint
+
 
 class ReplayBuffer(object):
 
   def __init__(self, capacity, state_size, action_size,
-               state_type=torch.uint8, action_type=torch.long, device=None):
+               state_type=torch.uint8, action_type=torch.long,
+               reward_type=torch.int8, device=None):
     """
       Replay buffer for DQN + DDQN + DDPG. As default, States are kept in
-      unit8 for memory optimization
+      unit8 and rewards (clipped) in int8 for memory optimization
     """
 
     self.size = 0
@@ -19,37 +26,351 @@ class ReplayBuffer(object):
     self.device = device
     self.states = torch.zeros([capacity] + state_size, dtype=state_type)
     self.actions = torch.zeros((capacity, action_size), dtype=action_type)
-    self.rewards = torch.zeros((capacity, 1), dtype=torch.int8)
+    self.rewards = torch.zeros((capacity, 1), dtype=reward_type)
     self.dones = torch.zeros((capacity, 1), dtype=torch.bool)
+    # pushes (acting) and samples (learner) may come from different threads
+    self.lock = threading.Lock()
 
   def push(self, *args):
     """Saves a transition."""
 
     s, a, r, d = args
 
-    self.states[self.position] = s
-    self.actions[self.position] = a
-    self.rewards[self.position, 0] = r
-    self.dones[self.position, 0] = d
+    with self.lock:
+      self.states[self.position] = s
+      self.actions[self.position] = a
+      self.rewards[self.position, 0] = r
+      self.dones[self.position, 0] = d
+      self.position = (self.position + 1) % self.capacity
+
+      self.size = max(self.size, self.position)
+
+  def push_batch(self, states, actions, rewards, dones):
+    """Saves a chunk of transitions, wraps around like push"""
+
+    n = states.size(0)
+    i = (self.position + torch.arange(n)) % self.capacity
+
+    with self.lock:
+      self.states[i] = states
+      self.actions[i] = actions.view(n, -1).to(self.actions.dtype)
+      self.rewards[i, 0] = rewards.to(self.rewards.dtype)
+      self.dones[i, 0] = dones.to(self.dones.dtype)
+      self.position = (self.position + n) % self.capacity
+
+      self.size = min(self.size + n, self.capacity)
+
+  def sample(self, batch_size):
+
+    with self.lock:
+      i = torch.randint(0, high=self.size, size=(batch_size,))
+      s = self.states[i]
+      a = self.actions[i]
+      r = self.rewards[i]
+      d = self.dones[i]
+
+    return s, a.to(self.device), r.to(self.device).float(), \
+        d.to(self.device).float()
+
+  def save(self, dest):
+    """Columns as .npy files in dest, returns what load needs besides"""
+
+    with self.lock:
+      for name in ['states', 'actions', 'rewards', 'dones']:
+        np.save(os.path.join(dest, name + '.npy'), getattr(self, name).numpy())
+
+      return {'size': self.size, 'position': self.position}
+
+  def load(self, dest, size, position):
+    """
+      Columns saved by save, memory mapped copy-on-write. Nothing is read
+      up front, pages load when sampled and pushes stay in memory
+    """
+
+    with self.lock:
+      for name in ['states', 'actions', 'rewards', 'dones']:
+        column = np.load(os.path.join(dest, name + '.npy'), mmap_mode='c')
+        assert column.shape == tuple(getattr(self, name).shape), \
+            'Replay {} shape {} ≠ {}'.format(name, column.shape,
+                                             tuple(getattr(self, name).shape))
+        setattr(self, name, torch.from_numpy(column))
+
+      self.size = size
+      self.position = position
+
+  def __len__(self):
+    return self.size
+
+
+class EnsembleReplayBuffer(object):
+
+  def __init__(self, n_members, capacity, state_size,
+               state_type=torch.float32, device=None):
+    """
+      Replay buffer of n_members agents stepping side by side, every push
+      holds one transition per member. Each member samples its own indices
+    """
+
+    self.size = 0
+    self.position = 0
+    self.n_members = n_members
+    self.capacity = capacity
+    self.device = device
+    self.states = torch.zeros([n_members, capacity] + state_size,
+                              dtype=state_type)
+    self.actions = torch.zeros((n_members, capacity, 1), dtype=torch.long)
+    self.rewards = torch.zeros((n_members, capacity, 1), dtype=torch.float32)
+    self.dones = torch.zeros((n_members, capacity, 1), dtype=torch.bool)
+
+  def push(self, states, actions, rewards, dones):
+    """Saves a transition of every member, [n_members, ..] each"""
+
+    self.states[:, self.position] = states
+    self.actions[:, self.position, 0] = actions
+    self.rewards[:, self.position, 0] = rewards
+    self.dones[:, self.position, 0] = dones
     self.position = (self.position + 1) % self.capacity
 
     self.size = max(self.size, self.position)
 
   def sample(self, batch_size):
 
-    i = torch.randint(0, high=self.size, size=(batch_size,))
-    s = self.states[i]
-    a = self.actions[i].to(self.device)
-    r = self.rewards[i].to(self.device).float()
-    d = self.dones[i].to(self.device).float()
-    return s, a, r, d
+    m = torch.arange(self.n_members).unsqueeze(1)
+    i = torch.randint(0, high=self.size, size=(self.n_members, batch_size))
+
+    # [n_members, batch_size, ..]
+    return self.states[m, i], self.actions[m, i].to(self.device), \
+        self.rewards[m, i].to(self.device), \
+        self.dones[m, i].to(self.device).float()
 
   def __len__(self):
     return self.size
 
 
+class SequenceReplayBuffer(object):
+
+  def __init__(self, capacity, frame_shape, seq_len, hidden_size,
+               state_type=torch.uint8, hidden_type=torch.float16,
+               device=None):
+    """
+      Replay buffer for recurrent agents. Holds one frame per step, back to
+      back, plus the recurrent state the agent had before that step (fp16).
+      Samples contiguous segments of seq_len steps, a segment may run over
+      episode ends (dones mark them)
+    """
+
+    self.size = 0
+    self.position = 0
+    self.capacity = capacity
+    self.seq_len = seq_len
+    self.device = device
+    self.frames = torch.zeros([capacity] + frame_shape, dtype=state_type)
+    self.actions = torch.zeros((capacity, 1), dtype=torch.long)
+    self.rewards = torch.zeros((capacity, 1), dtype=torch.float32)
+    self.dones = torch.zeros((capacity, 1), dtype=torch.bool)
+    self.hiddens = torch.zeros((capacity, hidden_size), dtype=hidden_type)
+    # pushes (acting) and samples (learner) may come from different threads
+    self.lock = threading.Lock()
+
+  def push(self, frame, action, reward, done, hidden):
+    """Saves a step, the frame acted on and the hidden state before it"""
+
+    with self.lock:
+      self.frames[self.position] = frame
+      self.actions[self.position, 0] = action
+      self.rewards[self.position, 0] = reward
+      self.dones[self.position, 0] = done
+      self.hiddens[self.position] = hidden
+      self.position = (self.position + 1) % self.capacity
+
+      self.size = min(self.size + 1, self.capacity)
+
+  def sample(self, batch_size):
+    """
+      batch_size segments, seq_len + 1 frames (the last one is the next
+      frame of the last step), seq_len actions/rewards/dones and the hidden
+      state at the segment start
+    """
+
+    with self.lock:
+      # segment starts from the oldest step, never over the write position
+      oldest = self.position if self.size == self.capacity else 0
+      start = torch.randint(0, high=self.size - self.seq_len,
+                            size=(batch_size, 1))
+      i = (oldest + start + torch.arange(self.seq_len + 1)) % self.capacity
+
+      s = self.frames[i]
+      a = self.actions[i[:, :-1]]
+      r = self.rewards[i[:, :-1]]
+      d = self.dones[i[:, :-1]]
+      h = self.hiddens[i[:, 0]]
+
+    return s, a.to(self.device), r.to(self.device), \
+        d.to(self.device).float(), h.to(self.device).float()
+
+  def __len__(self):
+    # steps a full segment can start from
+    return max(self.size - self.seq_len, 0)
+
+
+class RolloutBuffer(object):
+
+  def __init__(self, capacity, state_size, state_type=torch.uint8,
+               device=None):
+    """
+      Fixed capacity on-policy buffer for VPG. Columns are written in place
+      every step and read back as views, episodes are appended back to back
+    """
+
+    self.capacity = capacity
+    self.device = device
+    self.states = torch.zeros([capacity] + state_size, dtype=state_type)
+    self.actions = torch.zeros(capacity, dtype=torch.long)
+    self.rewards = torch.zeros(capacity, dtype=torch.float32)
+    self.values = torch.zeros(capacity, dtype=torch.float32)
+    self.returns = torch.zeros(capacity, dtype=torch.float32)
+    self.advantages = torch.zeros(capacity, dtype=torch.float32)
+
+    self.reset()
+
+  def reset(self):
+
+    self.position = 0
+    self.ep_start = 0
+
+  def push(self, state, action, value):
+    """Saves a step, state as [1] + state_size"""
+
+    assert self.position < self.capacity, 'Rollout buffer is full'
+
+    self.states[self.position] = state[0]
+    self.actions[self.position] = action
+    self.values[self.position] = value
+    self.position += 1
+
+  def push_reward(self, reward):
+
+    self.rewards[self.position - 1] = reward
+
+  def episode(self):
+    """Slice of the steps since the last finished episode"""
+
+    return slice(self.ep_start, self.position)
+
+  def finish_episode(self, returns, advantages):
+
+    ep = self.episode()
+
+    self.returns[ep] = returns
+    self.advantages[ep] = advantages
+    self.ep_start = self.position
+
+  def discard_episode(self):
+
+    self.position = self.ep_start
+
+  def get(self):
+    """Views over all finished episodes"""
+
+    n = self.ep_start
+
+    return (self.states[:n], self.actions[:n].to(self.device),
+            self.returns[:n].to(self.device),
+            self.advantages[:n].to(self.device))
+
+  def __len__(self):
+    return self.ep_start
+
+
+class TargetNetwork(object):
+
+  def __init__(self, src, dest):
+    """
+      Keeps a frozen target model (dest) in sync with src. Hard (copy) and
+      Polyak (soft) updates run as multi-tensor ops over all parameters and
+      buffers (f.ex batch norm running stats)
+    """
+
+    src_buffers = list(src.buffers())
+    dest_buffers = list(dest.buffers())
+
+    float_buffers = [idx for idx, b in enumerate(src_buffers)
+                     if b.is_floating_point()]
+    other_buffers = [idx for idx, b in enumerate(src_buffers)
+                     if not b.is_floating_point()]
+
+    # floating point tensors are interpolated, the rest (counters) copied
+    self.src_float = list(src.parameters()) + \
+        [src_buffers[idx] for idx in float_buffers]
+    self.dest_float = list(dest.parameters()) + \
+        [dest_buffers[idx] for idx in float_buffers]
+    self.src_other = [src_buffers[idx] for idx in other_buffers]
+    self.dest_other = [dest_buffers[idx] for idx in other_buffers]
+
+  @staticmethod
+  def copy(dest, src):
+
+    if not dest:
+      return
+
+    if hasattr(torch, '_foreach_copy_'):
+      torch._foreach_copy_(dest, src)
+    else:
+      for d, s in zip(dest, src):
+        d.copy_(s)
+
+  @staticmethod
+  def lerp(dest, src, w):
+
+    if hasattr(torch, '_foreach_lerp_'):
+      torch._foreach_lerp_(dest, src, w)
+    else:
+      for d, s in zip(dest, src):
+        d.lerp_(s, w)
+
+  def hard_update(self):
+
+    with torch.no_grad():
+      self.copy(self.dest_float, self.src_float)
+      self.copy(self.dest_other, self.src_other)
+
+  def soft_update(self, tau):
+    """dest = tau * src + (1 - tau) * dest"""
+
+    with torch.no_grad():
+      self.lerp(self.dest_float, self.src_float, tau)
+      self.copy(self.dest_other, self.src_other)
+
+
+def freeze_encoder(model):
+  """
+    Stops training the modules listed in model.encoder (the ones features()
+    runs), batch norm stats included. Returns the parameters left to train
+  """
+
+  for name in model.encoder:
+    module = getattr(model, name)
+    module.requires_grad_(False)
+    module.eval()
+
+  return [p for p in model.parameters() if p.requires_grad]
+
+
+def load_encoder(model, encoder_file):
+  """Encoder weights only, f.ex from an agent with another action space"""
+
+  prefixes = tuple('{}.'.format(name) for name in model.encoder)
+  state_dict = read_checkpoint(encoder_file, map_location='cpu')
+
+  model.load_state_dict({k: v for k, v in state_dict.items()
+                         if k.startswith(prefixes)}, strict=False)
+
+
 class ConvNetS(torch.nn.Module):
 
+  # modules run by features(), see freeze_encoder
+  encoder = ['conv1', 'conv2']
+
   def __init__(self, state_size, action_size, device):
     """
       Small ConvNet with batch norm between 2-Conv layers. Followed
@@ -85,24 +406,35 @@ class ConvNetS(torch.nn.Module):
       torch.nn.init.kaiming_uniform_(m.weight)
       m.bias.data.fill_(0.0)
 
-  def forward(self, x):
+  def features(self, x):
 
     x = x.to(self.device).float() / 255.
 
     x = F.relu(self.conv1(x))
     x = F.relu(self.conv2(x))
-    x = x.view(x.size(0), -1)
+
+    return x.view(x.size(0), -1)
+
+  def heads(self, x, stop_gradient=False):
+
     x = F.relu(self.head(x))
 
     q = self.action(x)
-    v = self.value(x)
+    # value loss kept out of the layers shared with the logits
+    v = self.value(x.detach() if stop_gradient else x)
 
     # logits, value estimate for state
     return q, v
 
+  def forward(self, x):
+
+    return self.heads(self.features(x))
+
 
 class ConvNetM(torch.nn.Module):
 
+  encoder = ['conv1', 'bn1', 'conv2', 'bn2', 'conv3', 'bn3']
+
   def __init__(self, state_size, action_size, device):
     """
       Medium ConvNet with batch norm between 3-Conv layers. Followed
@@ -139,23 +471,32 @@ class ConvNetM(torch.nn.Module):
     if type(m) == nn.Conv2d:
       torch.nn.init.kaiming_normal_(m.weight, nonlinearity='relu')
 
-  def forward(self, x):
+  def features(self, x):
 
     x = x.to(self.device).float() / 255.
 
     x = F.relu(self.bn1(self.conv1(x)))
     x = F.relu(self.bn2(self.conv2(x)))
     x = F.relu(self.bn3(self.conv3(x)))
-    x = x.view(x.size(0), -1)
+
+    return x.view(x.size(0), -1)
+
+  def heads(self, x, stop_gradient=False):
 
     q = self.action(x)
-    v = self.value(x)
+    v = self.value(x.detach() if stop_gradient else x)
 
     return q, v
 
+  def forward(self, x):
+
+    return self.heads(self.features(x))
+
 
 class ConvNetL(torch.nn.Module):
 
+  encoder = ['conv1', 'conv2', 'conv3']
+
   def __init__(self, state_size, action_size, device):
     """
       Large ConvNet with batch norm between 3-Conv layers. Followed
@@ -184,24 +525,245 @@ class ConvNetL(torch.nn.Module):
     if type(m) == nn.Conv2d:
       torch.nn.init.kaiming_normal_(m.weight, nonlinearity='relu')
 
+  def features(self, x):
+
+    x = x.to(self.device).float() / 255.
+
+    x = F.relu(self.conv1(x))
+    x = F.relu(self.conv2(x))
+    x = F.relu(self.conv3(x))
+
+    return x.view(x.size(0), -1)
+
+  def heads(self, x, stop_gradient=False):
+
+    x = F.relu(self.fc1(x))
+
+    q = self.action(x)
+    # value loss kept out of the layers shared with the logits
+    v = self.value(x.detach() if stop_gradient else x)
+
+    # logits, value estimate for state
+    return q, v
+
   def forward(self, x):
 
+    return self.heads(self.features(x))
+
+
+class SeparableConv2d(torch.nn.Module):
+
+  def __init__(self, in_channels, out_channels, kernel_size, stride=1):
+    """
+      Depthwise (per channel spatial) conv followed by a pointwise (1x1) conv
+    """
+
+    super(SeparableConv2d, self).__init__()
+
+    self.depthwise = nn.Conv2d(in_channels, in_channels, kernel_size,
+                               stride=stride, groups=in_channels, bias=False)
+    self.pointwise = nn.Conv2d(in_channels, out_channels, kernel_size=1)
+
+  def forward(self, x):
+
+    return self.pointwise(self.depthwise(x))
+
+
+class ConvNetDW(torch.nn.Module):
+
+  encoder = ['conv1', 'conv2', 'conv3']
+  channels = [16, 32, 32]
+  strides = [4, 2, 1]
+  hidden = 256
+
+  def __init__(self, state_size, action_size, device):
+    """
+      CPU friendly ConvNet, a strided stem conv followed by 2-depthwise
+      separable conv layers and 1-linear layer. Same (q, v) heads as the
+      ConvNets above. Fewer FLOPs pay off at CPU learner batch sizes, at
+      batch 1 (actors) per-layer overhead dominates, see README
+    """
+
+    super(ConvNetDW, self).__init__()
+
+    self.device = device
+    self.action_size = action_size
+
+    (w, h) = state_size[1:]
+    c1, c2, c3 = self.channels
+    s1, s2, s3 = self.strides
+
+    # few input channels, depthwise does not pay off for the stem
+    self.conv1 = nn.Conv2d(state_size[0], c1, kernel_size=8, stride=s1)
+    self.conv2 = SeparableConv2d(c1, c2, kernel_size=4, stride=s2)
+    self.conv3 = SeparableConv2d(c2, c3, kernel_size=3, stride=s3)
+
+    def feat_shape(size, kernel_size, stride):
+      return (size - (kernel_size - 1) - 1) // stride + 1
+
+    for kernel_size, stride in zip([8, 4, 3], self.strides):
+      w, h = feat_shape(w, kernel_size, stride), feat_shape(h, kernel_size,
+                                                            stride)
+    feat_spatial_shape = w * h * c3
+
+    self.fc1 = nn.Linear(feat_spatial_shape, self.hidden)
+    self.action = nn.Linear(self.hidden, action_size)
+    self.value = nn.Linear(self.hidden, 1)
+
+  def init_weights(self, m):
+    if type(m) == nn.Linear:
+      torch.nn.init.kaiming_normal_(m.weight, nonlinearity='relu')
+      m.bias.data.fill_(0.0)
+
+    if type(m) == nn.Conv2d:
+      torch.nn.init.kaiming_normal_(m.weight, nonlinearity='relu')
+
+  def features(self, x):
+
     x = x.to(self.device).float() / 255.
 
     x = F.relu(self.conv1(x))
     x = F.relu(self.conv2(x))
     x = F.relu(self.conv3(x))
-    x = F.relu(self.fc1(x.view(x.size(0), -1)))
+
+    return x.view(x.size(0), -1)
+
+  def heads(self, x, stop_gradient=False):
+
+    x = F.relu(self.fc1(x))
 
     q = self.action(x)
-    v = self.value(x)
+    # value loss kept out of the layers shared with the logits
+    v = self.value(x.detach() if stop_gradient else x)
 
     # logits, value estimate for state
     return q, v
 
+  def forward(self, x):
+
+    return self.heads(self.features(x))
+
+
+class ConvNetDWS(ConvNetDW):
+  """
+    Smallest CPU ConvNet, strides 84x84 down to 4x4 within 3-Conv layers
+  """
+
+  channels = [8, 16, 16]
+  strides = [4, 2, 2]
+  hidden = 128
+
+
+class ConvNetDWM(ConvNetDW):
+  """
+    CPU ConvNet, ConvNetS sized features with a 7x7 output grid
+  """
+
+
+class ConvNetDWL(ConvNetDW):
+  """
+    CPU ConvNet, ConvNetL channel widths with separable convs + 256-wide FC
+  """
+
+  channels = [32, 64, 64]
+
+
+class ConvNetRecurrent(torch.nn.Module):
+
+  hidden_size = 512
+
+  def __init__(self, state_size, action_size, device):
+    """
+      ConvNetL sized features of a single frame followed by a GRU cell
+      instead of a stack of state_len frames. Input as [batch, steps, w, h],
+      returns (q, v) for every step and the last hidden state. Suitable for
+      Atari + Doom with DRQN
+    """
+
+    super(ConvNetRecurrent, self).__init__()
+
+    self.device = device
+    self.action_size = action_size
+
+    (w, h) = state_size[1:]
+
+    self.conv1 = nn.Conv2d(1, 32, kernel_size=8, stride=4, bias=False)
+    self.conv2 = nn.Conv2d(32, 64, kernel_size=4, stride=2, bias=False)
+    self.conv3 = nn.Conv2d(64, 64, kernel_size=3, stride=1, bias=False)
+
+    def feat_shape(size, kernel_size, stride):
+      return (size - (kernel_size - 1) - 1) // stride + 1
+
+    for kernel_size, stride in zip([8, 4, 3], [4, 2, 1]):
+      w, h = feat_shape(w, kernel_size, stride), feat_shape(h, kernel_size,
+                                                            stride)
+
+    self.fc1 = nn.Linear(w * h * 64, 512)
+    self.gru = nn.GRUCell(512, self.hidden_size)
+    self.action = nn.Linear(self.hidden_size, action_size)
+    self.value = nn.Linear(self.hidden_size, 1)
+
+  def init_weights(self, m):
+    if type(m) == nn.Linear:
+      torch.nn.init.kaiming_normal_(m.weight, nonlinearity='relu')
+      m.bias.data.fill_(0.0)
+
+    if type(m) == nn.Conv2d:
+      torch.nn.init.kaiming_normal_(m.weight, nonlinearity='relu')
+
+  def init_hidden(self, batch_size=1):
+
+    return torch.zeros((batch_size, self.hidden_size), device=self.device)
+
+  def features(self, x):
+
+    # all steps of all segments through the convs at once
+    b, t = x.shape[:2]
+    x = x.to(self.device).float().view(b * t, 1, *x.shape[2:]) / 255.
+
+    x = F.relu(self.conv1(x))
+    x = F.relu(self.conv2(x))
+    x = F.relu(self.conv3(x))
+    x = F.relu(self.fc1(x.view(b * t, -1)))
+
+    return x.view(b, t, -1)
+
+  def unroll(self, x, hidden, resets=None):
+    """GRU over the steps, resets [batch, steps] zero the hidden state"""
+
+    out = []
+
+    for t in range(x.size(1)):
+      if resets is not None:
+        hidden = hidden * (1. - resets[:, t:t + 1])
+      hidden = self.gru(x[:, t], hidden)
+      out.append(hidden)
+
+    return torch.stack(out, dim=1), hidden
+
+  def heads(self, x):
+
+    q = self.action(x)
+    v = self.value(x)
+
+    # logits, value estimate for every step
+    return q, v
+
+  def forward(self, x, hidden=None, resets=None):
+
+    if hidden is None:
+      hidden = self.init_hidden(x.size(0))
+
+    x, hidden = self.unroll(self.features(x), hidden.to(self.device), resets)
+    q, v = self.heads(x)
+
+    return q, v, hidden
+
 
 class MLP(torch.nn.Module):
 
+  encoder = ['l1']
+
   def __init__(self, state_size, action_size, device, continous=False):
     """
       3 linear layered MLP. Suitable for Classic control/Robotics task.
@@ -220,14 +782,18 @@ class MLP(torch.nn.Module):
     self.actor = nn.Linear(128, action_size)
     self.critic = nn.Linear(128, 1)
 
-  def forward(self, x, y=None):
+  def features(self, x):
 
     x = x.view(x.size(0), -1)
     x = x.to(self.device).float()
 
-    x = F.relu(self.l1(x))
+    return F.relu(self.l1(x))
+
+  def heads(self, x, y=None, stop_gradient=False):
+
     q = self.actor(x)
 
+    x = x.detach() if stop_gradient else x
     x = x if y is None else torch.cat([x, y], dim=-1)
 
     x = F.relu(self.l2(x))
@@ -235,3 +801,123 @@ class MLP(torch.nn.Module):
 
     # action value Q table, value estimate for state
     return q, v
+
+  def forward(self, x, y=None):
+
+    return self.heads(self.features(x), y)
+
+
+class MultiTaskModel(torch.nn.Module):
+
+  def __init__(self, model, state_size, action_sizes, device):
+    """
+      One model per task, all running the encoder (see freeze_encoder) of
+      the first one. Tasks keep their own heads and action sizes
+    """
+
+    super(MultiTaskModel, self).__init__()
+
+    self.device = device
+    self.action_sizes = action_sizes
+
+    self.tasks = nn.ModuleList([model(state_size, action_size, device)
+                                for action_size in action_sizes])
+
+    for net in self.tasks[1:]:
+      for name in net.encoder:
+        setattr(net, name, getattr(self.tasks[0], name))
+
+  def init_weights(self, m):
+
+    self.tasks[0].init_weights(m)
+
+  def features(self, x):
+
+    return self.tasks[0].features(x)
+
+  def heads(self, x, task):
+
+    return self.tasks[task].heads(x)
+
+  def forward(self, x, sizes):
+    """(q, v) per task, x holds sizes[k] states of task k back to back"""
+
+    x = self.features(x)
+
+    return [self.heads(x_task, task)
+            for task, x_task in enumerate(x.split(sizes))]
+
+
+class EnsembleLinear(torch.nn.Module):
+
+  def __init__(self, n_members, in_features, out_features):
+    """
+      n_members independent linear layers stacked into one [n, in, out]
+      weight. All members are evaluated by one batched matmul (baddbmm)
+    """
+
+    super(EnsembleLinear, self).__init__()
+
+    self.n_members = n_members
+
+    self.weight = nn.Parameter(torch.empty(n_members, in_features,
+                                           out_features))
+    self.bias = nn.Parameter(torch.empty(n_members, 1, out_features))
+
+    self.reset_parameters()
+
+  def reset_parameters(self):
+
+    # nn.Linear default init, for each member
+    bound = 1. / self.weight.size(1) ** 0.5
+
+    nn.init.uniform_(self.weight, -bound, bound)
+    nn.init.uniform_(self.bias, -bound, bound)
+
+  def forward(self, x):
+
+    # [batch, in] inputs are shared by all members, expand is a view
+    if x.dim() == 2:
+      x = x.expand(self.n_members, *x.shape)
+
+    # [n, batch, in] x [n, in, out] + [n, 1, out] -> [n, batch, out]
+    return torch.baddbmm(self.bias, x, self.weight)
+
+
+class EnsembleCritic(torch.nn.Module):
+
+  def __init__(self, state_size, action_size, device, n_critics=2,
+               hidden_size=256):
+    """
+      n_critics Q(s, a) MLPs (3 linear layers) as one module of stacked
+      parameters. Suitable for Robotics task (TD3 + SAC)
+    """
+
+    super(EnsembleCritic, self).__init__()
+
+    self.device = device
+    self.n_critics = n_critics
+
+    in_features = reduce(lambda x, y: x * y, state_size) + action_size
+
+    self.l1 = EnsembleLinear(n_critics, in_features, hidden_size)
+    self.l2 = EnsembleLinear(n_critics, hidden_size, hidden_size)
+    self.l3 = EnsembleLinear(n_critics, hidden_size, 1)
+
+  def init_weights(self, m):
+    if type(m) == EnsembleLinear:
+      # [in, out] member weights, transposed to nn.Linear's [out, in]
+      for weight in m.weight.data:
+        torch.nn.init.kaiming_uniform_(weight.t())
+      m.bias.data.fill_(0.0)
+
+  def forward(self, x, y):
+
+    x = x.view(x.size(0), -1).to(self.device).float()
+    x = torch.cat([x, y.to(self.device).float()], dim=-1)
+
+    x = F.relu(self.l1(x))
+    x = F.relu(self.l2(x))
+
+    # Q values of all critics, [n_critics, batch, 1]
+    return self.l3(x)
@@ -0,0 +1,270 @@
+from collections import deque
+from contextlib import nullcontext
+
+import tqdm
+import torch
+import random
+import numpy as np
+from torch import nn
+import torch.nn.functional as F
+
+from cherry.agents import ReplayBuffer, TargetNetwork, MultiTaskModel
+from cherry.agents.dqn import DQN
+from cherry.agents.learner import build_learner
+from cherry.agents.schedulers import ReplayRatio
+from utils.helpers import get_logger, build_optimizer, maybe_compile
+from utils.checkpoint import write_model
+
+
+class MultiTaskDQN(DQN):
+
+  def __init__(self, cfgs, model=None, model_file=None,
+               device=None, log_level='info'):
+    """
+      DQN over several envs (tasks, f.ex Atari games) in one process. Tasks
+      share the encoder of one model and keep their own heads, action size
+      and replay. Learner batches are stratified, an equal share of every
+      task's replay, and run the encoder once for all tasks
+    """
+
+    self.history = None
+    self.losses = None
+    self.rewards = None
+    self.top_scr = 0.0
+    self.task = 0
+    self.crop_shape = cfgs['crop_shape']
+    self.input_shape = cfgs['input_shape']
+    self.lr = cfgs['lr']
+    self.gamma = cfgs['gamma']
+    self.max_eps = cfgs['max_eps']
+    self.min_eps = cfgs['min_eps']
+    self.eps_decay = cfgs['eps_decay']
+    self.replay_size = cfgs['replay_size']
+    self.state_len = cfgs['state_len']
+    # one action size per task, in the order of the env blocks
+    self.action_size = cfgs['action_size']
+    self.input_transforms = cfgs['input_transforms']
+    self.cfgs = cfgs
+    self.log_level = log_level
+    self.compile = cfgs.get('compile')
+    self.fused_opt = cfgs.get('fused_opt')
+    self.frozen_encoder = False
+    self.grad_clip = cfgs['grad_clip']
+    self.device = device
+    self.eps = self.max_eps
+    self.state_size = [self.state_len] + self.input_shape
+    self.n_tasks = len(self.action_size)
+
+    assert self.input_shape is not None, 'Input shape has to be not None'
+    assert self.device is not None, 'Device has to be CPU/GPU'
+    assert isinstance(self.action_size, list), 'One action size per task'
+
+    self.zero_state = torch.zeros([1] + self.input_shape, dtype=torch.uint8)
+
+    self.logger = get_logger(__file__, log_level=log_level)
+
+    self.transform = self.state_transformer()
+
+    self.policy = MultiTaskModel(model, self.state_size, self.action_size,
+                                 self.device).to(self.device)
+
+    self.target = MultiTaskModel(model, self.state_size, self.action_size,
+                                 self.device).to(self.device)
+
+    self.target_sync = TargetNetwork(self.policy, self.target)
+    self.target_sync.hard_update()
+    self.target.eval()
+
+    # acting copy and its lock, swapped out by a learner thread
+    self.acting = self.policy
+    self.acting_lock = nullcontext()
+
+    self.optimizer = build_optimizer(cfgs['opt_name'],
+                                     self.policy.parameters(),
+                                     fused=self.fused_opt, lr=self.lr)
+    self.loss_fn = maybe_compile(self.loss, self.compile)
+
+    # frame history + episode rewards of every task
+    self.histories = [None] * self.n_tasks
+    self.task_rewards = [None] * self.n_tasks
+
+    for task in range(self.n_tasks):
+      self.reset_task(task)
+
+    buffer_shape = list(self.get_state(complete=True).shape)[1:]
+
+    self.replays = [ReplayBuffer(self.replay_size, buffer_shape, 1,
+                                 device=self.device)
+                    for _ in range(self.n_tasks)]
+    if model_file:
+      self.load_model(model_file)
+
+    self.logger.info('Done setting up {} Agent, {} tasks'.format(
+        __class__.__name__, self.n_tasks))
+
+  def reset_task(self, task):
+
+    self.reset()
+
+    self.histories[task] = self.history
+    self.task_rewards[task] = self.rewards
+
+  def select_task(self, task):
+    """Frame history + rewards of task for the DQN helpers"""
+
+    self.task = task
+    self.history = self.histories[task]
+    self.rewards = self.task_rewards[task]
+
+  def get_action(self, state, task=None):
+
+    task = self.task if task is None else task
+
+    if random.random() > self.eps:
+      with self.acting_lock, torch.no_grad():
+        q, _ = self.acting.heads(self.acting.features(state), task)
+        a = q.max(1)[1].cpu().view(1, 1)
+    else:
+      a = torch.tensor([[random.randrange(self.action_size[task])]],
+                       device='cpu', dtype=torch.long)
+
+    return a.numpy()[0, 0].item()
+
+  def task_sizes(self, batch_size):
+    """batch_size split evenly across tasks (stratified)"""
+
+    size, extra = divmod(batch_size, self.n_tasks)
+
+    return [size + (task < extra) for task in range(self.n_tasks)]
+
+  def loss(self, states, action, reward, done, sizes):
+
+    state_batch = states[:, :self.state_len]
+    next_state_batch = states[:, 1:]
+
+    # tasks differ in action sizes, gather per task
+    q_values = torch.cat([q.gather(1, a) for (q, _), a in
+                          zip(self.policy(state_batch, sizes),
+                              action.split(sizes))])
+
+    # no autograd graph for the target side
+    with torch.no_grad():
+      q_values_next = torch.cat([q.max(1)[0] for q, _ in
+                                 self.target(next_state_batch, sizes)])
+
+    # Bellman Equation : Computes the expected Q values (target)
+    q_values_target = (q_values_next * self.gamma) * \
+        (1. - done[:, 0]) + reward[:, 0]
+
+    # Compute Huber loss, every task weighs by its share of the batch
+    return F.smooth_l1_loss(q_values, q_values_target.unsqueeze(1))
+
+  def optimize(self, batch_size=32, grad_accum=1):
+
+    sizes = self.task_sizes(batch_size)
+
+    if any(len(replay) < size for replay, size in zip(self.replays, sizes)):
+      return False
+
+    self.optimizer.zero_grad(set_to_none=True)
+
+    # large batch as grad_accum batches of batch_size
+    for _ in range(grad_accum):
+
+      batches = [replay.sample(size)
+                 for replay, size in zip(self.replays, sizes)]
+      states, action, reward, done = [torch.cat(batch)
+                                      for batch in zip(*batches)]
+
+      # one host -> device copy for both overlapping slices
+      states = states.to(self.device)
+
+      loss = self.loss_fn(states, action, reward, done, sizes)
+      (loss / grad_accum).backward()
+
+    # Optimize the model
+    nn.utils.clip_grad_value_(self.policy.parameters(), self.grad_clip)
+    self.optimizer.step()
+
+    return True
+
+  def train(self, envs, train_cfgs, gitsha, model_dest):
+
+    assert not train_cfgs.get('n_actors'), 'Tasks train in a single process'
+    assert len(envs) == self.n_tasks, 'One env per task'
+
+    update_target = train_cfgs['update_target']
+    save_model = train_cfgs['save_model']
+    n_train_steps = train_cfgs['n_train_steps']
+
+    scheduler = ReplayRatio(train_cfgs)
+    learner = build_learner(self, self.policy, train_cfgs)
+
+    scores = [deque(maxlen=100) for _ in range(self.n_tasks)]
+
+    for task, env in enumerate(envs):
+      self.reset_task(task)
+      self.append_state(env.reset())
+
+    train_step = tqdm.tqdm(range(n_train_steps), ascii=True, unit='stp')
+
+    for step in train_step:
+
+      self.set_eps(step)
+
+      # one env step of every task
+      for task, env in enumerate(envs):
+
+        self.select_task(task)
+
+        state = self.get_state()
+        action = self.get_action(state)
+
+        next_state, reward, done, info = env.step(action)
+        self.append_reward(reward)
+        self.append_state(next_state)
+
+        states = self.get_state(complete=True)
+        self.replays[task].push(states, action, reward, done)
+
+        if done:
+          scores[task].append(self.get_episode_rewards())
+
+          self.reset_task(task)
+          self.append_state(env.reset())
+
+      n_updates = scheduler.step(step)
+      if n_updates:
+        learner.submit(scheduler.update, self.optimize, n_updates)
+
+      if step % update_target == 0:
+        learner.submit(self.update_target, step)
+
+      if step % save_model == 0:
+        tag = '{0:09d}-{1}'.format(step, gitsha)
+        learner.submit(write_model, self.policy, tag, model_dest,
+                       score=np.mean([np.mean(s) if s else 0.0
+                                      for s in scores]))
+
+      if step % 1000 == 0:
+        mean_rewards = [np.mean(s) if s else 0.0 for s in scores]
+        train_step.set_description('Rewards : {0}, Eps : {1:.4f}'.format(
+            ' '.join('{0:.1f}'.format(r) for r in mean_rewards), self.eps))
+
+    learner.close()
+    self.logger.info('Done training, {}'.format(scheduler.summary()))
+
+    for task, env in enumerate(envs):
+      self.logger.info('Task {0} ({1}), average reward {2:.3f}'.format(
+          task, env.cfgs.get('name'),
+          np.mean(scores[task]) if scores[task] else 0.0))
+
+    tag = 'final-{0}'.format(gitsha)
+    write_model(self.policy, tag, model_dest)
+
+  def play(self, env, test_cfgs, gitsha):
+
+    # the task of the env block picked by the player
+    self.select_task(test_cfgs.get('task', 0))
+
+    super(MultiTaskDQN, self).play(env, test_cfgs, gitsha)
@@ -0,0 +1,353 @@
+# https://arxiv.org/abs/1707.06347 (Proximal policy optimization, Schulman
+# et al.)
+from pathlib import Path
+from collections import deque
+
+import tqdm
+import torch
+import numpy as np
+from torch import nn
+from gym import wrappers
+import torch.nn.functional as F
+from skvideo.io import FFmpegWriter as vid_writer
+from torch.distributions import Categorical
+from torchvision.transforms import Compose, CenterCrop, Resize, ToPILImage
+
+from cherry.envs import build_vector_env
+from cherry.agents.returns import gae
+from utils.helpers import get_logger, build_optimizer, maybe_compile
+from utils.checkpoint import write_model, load_weights
+
+
+class PPO():
+
+  def __init__(self, cfgs, model=None, model_file=None,
+               device=None, log_level='info'):
+    """
+      Synchronous PPO with the clipped objective. Fixed length rollouts are
+      collected from n_envs envs side by side, advantages come from GAE
+      over [n_steps, n_envs] and are replayed for n_epochs of minibatches.
+      One (logits, value) model is used for policy and value
+    """
+
+    self.histories = None
+    self.rollout = None
+    self.lr = cfgs['lr']
+    self.gamma = cfgs['gamma']
+    self.lam = cfgs.get('lambda', 0.95)
+    self.clip = cfgs.get('clip', 0.1)
+    self.n_envs = cfgs.get('n_envs', 8)
+    self.n_steps = cfgs.get('n_steps', 128)
+    self.n_epochs = cfgs.get('n_epochs', 4)
+    self.minibatch_size = cfgs.get('minibatch_size', 256)
+    self.value_scaling = cfgs.get('value_scaling', 0.5)
+    self.entropy_scaling = cfgs.get('entropy_scaling', 0.01)
+    self.grad_clip = cfgs.get('grad_clip')
+    self.state_len = cfgs['state_len']
+    self.action_size = cfgs['action_size']
+    self.crop_shape = cfgs.get('crop_shape')
+    self.input_shape = cfgs.get('input_shape')
+    self.input_transforms = cfgs.get('input_transforms')
+    self.compile = cfgs.get('compile')
+    self.fused_opt = cfgs.get('fused_opt')
+    self.device = device
+    self.state_size = [self.state_len] + self.input_shape
+
+    assert self.input_shape, 'Input shape has to be not None'
+    assert self.action_size, 'Action size has to non None'
+    assert self.device, 'Device has to be CPU/GPU'
+
+    self.zero_state = torch.zeros([1] + self.input_shape, dtype=torch.uint8)
+
+    self.logger = get_logger(__file__, log_level=log_level)
+
+    self.transform = self.state_transformer()
+
+    self.policy = model(self.state_size, self.action_size,
+                        self.device).to(self.device)
+
+    self.optimizer = build_optimizer(cfgs['opt_name'],
+                                     self.policy.parameters(),
+                                     fused=self.fused_opt, lr=self.lr)
+    self.loss_fn = maybe_compile(self.loss, self.compile)
+
+    if model_file:
+      self.load_model(model_file)
+
+    self.logger.info('Done setting up {} Agent'.format(__class__.__name__))
+
+  def state_transformer(self):
+
+    if not self.input_transforms:
+      return None
+
+    transforms = [ToPILImage()]
+    if 'crop' in self.input_transforms:
+      transforms.append(CenterCrop(self.crop_shape))
+    if 'resize' in self.input_transforms:
+      transforms.append(Resize(self.input_shape))
+
+    return Compose(transforms)
+
+  def build_rollout(self, n_steps, n_envs):
+
+    # image states are kept in uint8, see state_transformer
+    state_type = torch.uint8 if self.transform else torch.float32
+    size = [n_steps, n_envs]
+
+    self.rollout = {'states': torch.zeros(size + self.state_size,
+                                          dtype=state_type),
+                    'actions': torch.zeros(size, dtype=torch.long),
+                    'log_probs': torch.zeros(size),
+                    'values': torch.zeros(size),
+                    'rewards': torch.zeros(size),
+                    'dones': torch.zeros(size)}
+
+  def load_model(self, model_file):
+
+    self.logger.info('Loading agent weights from {}'.format(model_file))
+
+    load_weights(self.policy, model_file, self.device)
+
+  def eval(self):
+
+    self.policy.eval()
+
+  def reset(self, n_envs):
+
+    no_history = [self.zero_state for _ in range(self.state_len)]
+    self.histories = [deque(no_history, maxlen=self.state_len)
+                      for _ in range(n_envs)]
+
+  def frame(self, state):
+
+    state = self.zero_state if state is None else state
+
+    if self.transform:
+      state = np.array(self.transform(state), dtype=np.uint8)
+      state = np.expand_dims(state, 0)
+
+    return torch.from_numpy(np.asarray(state))
+
+  def append_states(self, states):
+
+    for history, state in zip(self.histories, states):
+      history.append(self.frame(state))
+
+  def set_state(self, idx, state):
+    """First frame of an episode fills the history of env idx"""
+
+    frame = self.frame(state)
+
+    for _ in range(self.state_len):
+      self.histories[idx].append(frame)
+
+  def get_states(self):
+
+    states = [torch.cat(list(history)) for history in self.histories]
+
+    return torch.stack(states).view([len(states)] + self.state_size)
+
+  def get_actions(self, states, deterministic=False):
+
+    with torch.no_grad():
+      logits, values = self.policy(states)
+
+    m = Categorical(logits=logits)
+    actions = logits.max(1)[1] if deterministic else m.sample()
+
+    return actions.cpu(), m.log_prob(actions).cpu(), values[:, 0].cpu()
+
+  def collect(self, venv, ep_rewards, scores):
+    """
+      n_steps from each env into the rollout, GAE advantages and value
+      targets over the rollout. Finished episodes go into scores
+    """
+
+    rollout = self.rollout
+
+    for t in range(self.n_steps):
+
+      states = self.get_states()
+      actions, log_probs, values = self.get_actions(states)
+
+      next_states, rewards, dones, infos = venv.step(actions.tolist())
+
+      rollout['states'][t] = states
+      rollout['actions'][t] = actions
+      rollout['log_probs'][t] = log_probs
+      rollout['values'][t] = values
+      rollout['rewards'][t] = torch.tensor(rewards, dtype=torch.float32)
+      rollout['dones'][t] = torch.tensor(dones, dtype=torch.float32)
+
+      self.append_states(next_states)
+
+      for idx, (reward, done) in enumerate(zip(rewards, dones)):
+        ep_rewards[idx] += reward
+        if done:
+          scores.append(ep_rewards[idx])
+          ep_rewards[idx] = 0.0
+          # envs reset on done, next_states holds the first frame
+          self.set_state(idx, next_states[idx])
+
+    _, _, last_values = self.get_actions(self.get_states())
+
+    advantages, returns = gae(rollout['rewards'].numpy(),
+                              rollout['values'].numpy(),
+                              rollout['dones'].numpy(), self.gamma, self.lam,
+                              last_values.numpy())
+
+    rollout['advantages'] = torch.from_numpy(advantages)
+    rollout['returns'] = torch.from_numpy(returns)
+
+  def loss(self, states, actions, log_probs, returns, advantages):
+
+    logits, values = self.policy(states)
+
+    m = Categorical(logits=logits)
+    ratio = torch.exp(m.log_prob(actions) - log_probs)
+
+    # clipped surrogate objective
+    surrogate = torch.min(ratio * advantages,
+                          ratio.clamp(1. - self.clip, 1. + self.clip) *
+                          advantages)
+
+    policy_loss = -surrogate.mean()
+    value_loss = F.mse_loss(values[:, 0], returns)
+    entropy_loss = -m.entropy().mean()
+
+    return policy_loss + self.value_scaling * value_loss + \
+        self.entropy_scaling * entropy_loss
+
+  def optimize(self):
+
+    n = self.n_steps * self.n_envs
+
+    # [n_steps, n_envs, ..] -> [n_steps * n_envs, ..]
+    batch = {k: v.reshape([n] + list(v.shape[2:]))
+             for k, v in self.rollout.items()}
+
+    losses = []
+
+    for epoch in range(self.n_epochs):
+      for mb in torch.split(torch.randperm(n), self.minibatch_size):
+
+        advantages = batch['advantages'][mb]
+        advantages = (advantages - advantages.mean()) / \
+            (advantages.std() + 1e-8)
+
+        loss = self.loss_fn(batch['states'][mb],
+                            batch['actions'][mb].to(self.device),
+                            batch['log_probs'][mb].to(self.device),
+                            batch['returns'][mb].to(self.device),
+                            advantages.to(self.device))
+
+        self.optimizer.zero_grad(set_to_none=True)
+        loss.backward()
+        if self.grad_clip:
+          nn.utils.clip_grad_norm_(self.policy.parameters(), self.grad_clip)
+        self.optimizer.step()
+
+        losses.append(loss.item())
+
+    return np.mean(losses)
+
+  def train(self, env, train_cfgs, gitsha, model_dest):
+
+    save_model = train_cfgs['save_model']
+    n_train_steps = train_cfgs['n_train_steps']
+    subproc = train_cfgs.get('subproc')
+
+    # acts on n_envs copies of the trainer's env, which only lends its
+    # cfgs + env_solution (inf on DDP ranks)
+    venv = build_vector_env(env.cfgs, self.n_envs, subproc=subproc)
+    env_solution = train_cfgs.get('env_solution',
+                                  getattr(env, 'env_solution', None))
+    env.close()
+
+    self.build_rollout(self.n_steps, self.n_envs)
+    self.reset(self.n_envs)
+
+    for idx, state in enumerate(venv.reset()):
+      self.set_state(idx, state)
+
+    n_updates = max(n_train_steps // (self.n_steps * self.n_envs), 1)
+
+    ep_rewards = [0.0] * self.n_envs
+    scores = deque(maxlen=100)
+
+    train_up = tqdm.tqdm(range(n_updates), ascii=True, unit='update')
+
+    for update in train_up:
+
+      self.collect(venv, ep_rewards, scores)
+      loss = self.optimize()
+
+      mean_reward = np.mean(scores) if scores else 0.0
+      train_up.set_description('Average reward: {0:.3f}, '
+                               'Loss : {1:.4f}'.format(mean_reward, loss))
+
+      step = (update + 1) * self.n_steps * self.n_envs
+
+      if update % save_model == 0:
+        tag = '{0:09d}-{1}'.format(step, gitsha)
+        self.logger.debug('Saving model {}'.format(tag))
+        write_model(self.policy, tag, model_dest, score=mean_reward)
+
+      if env_solution is not None and len(scores) == scores.maxlen \
+              and mean_reward >= env_solution:
+        self.logger.info('Solved! At step {}'
+                         ' reward {:.3f} > {:.3f}'.format(step, mean_reward,
+                                                          env_solution))
+        break
+
+    venv.close()
+
+    tag = 'final-{0}'.format(gitsha)
+    write_model(self.policy, tag, model_dest)
+
+  def play(self, env, test_cfgs, gitsha):
+
+    self.eval()
+
+    state_dest = test_cfgs['state_dest']
+    test_episodes = test_cfgs['n_test_episodes']
+    max_steps = test_cfgs['max_steps']
+
+    vid_dst = Path(state_dest)
+    vid_dst.mkdir(parents=True, exist_ok=True)
+
+    env.update_env(wrappers.Monitor, directory=vid_dst.as_posix(), force=True)
+    test_ep = tqdm.tqdm(range(test_episodes), ascii=True, unit='episode')
+
+    for ep in test_ep:
+
+      vid_file = vid_dst.joinpath('episode-{1:03d}-{0}.mp4'.format(gitsha, ep))
+
+      writer = vid_writer(vid_file.as_posix(), outputdict={'-vcodec': 'h264',
+                                                           '-b': '300000000'})
+
+      self.reset(1)
+      state = env.reset()
+
+      self.set_state(0, state)
+      writer.writeFrame(state)
+
+      test_step = tqdm.tqdm(range(max_steps), ascii=True, unit='stp')
+      total_reward = 0.0
+
+      for step in test_step:
+
+        actions, _, _ = self.get_actions(self.get_states())
+        next_state, reward, done, info = env.step(actions[0].item())
+        total_reward += reward
+
+        if done:
+          test_step.set_description('{0}/{1} Reward : {2:.3f}'.format(
+              ep, step, total_reward))
+          break
+
+        self.append_states([next_state])
+        writer.writeFrame(next_state)
+
+      writer.close()
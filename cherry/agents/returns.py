@@ -0,0 +1,48 @@
+import numpy as np
+
+
+def discount_returns(rewards, dones, gamma, last_value=None):
+  """
+    Discounted rewards to go, reverse scan over time in O(T). Accepts [T] or
+    [T, N] (N trajectories side by side) arrays. dones[t] marks the last
+    step of an episode, last_value bootstraps truncated trajectories
+  """
+
+  rewards = np.asarray(rewards, dtype=np.float32)
+  dones = np.asarray(dones, dtype=np.float32)
+
+  returns = np.zeros_like(rewards)
+  running = np.zeros_like(rewards[0]) if last_value is None else \
+      np.asarray(last_value, dtype=np.float32)
+
+  for t in reversed(range(len(rewards))):
+    running = rewards[t] + gamma * running * (1. - dones[t])
+    returns[t] = running
+
+  return returns
+
+
+def gae(rewards, values, dones, gamma, lam, last_value=None):
+  """
+    Generalized advantage estimation (https://arxiv.org/abs/1506.02438),
+    same layout/conventions as discount_returns. Returns advantages and
+    lambda returns (value targets)
+  """
+
+  rewards = np.asarray(rewards, dtype=np.float32)
+  values = np.asarray(values, dtype=np.float32)
+  dones = np.asarray(dones, dtype=np.float32)
+
+  advantages = np.zeros_like(rewards)
+  running = np.zeros_like(rewards[0])
+  next_value = np.zeros_like(rewards[0]) if last_value is None else \
+      np.asarray(last_value, dtype=np.float32)
+
+  for t in reversed(range(len(rewards))):
+    nonterminal = 1. - dones[t]
+    delta = rewards[t] + gamma * next_value * nonterminal - values[t]
+    running = delta + gamma * lam * nonterminal * running
+    advantages[t] = running
+    next_value = values[t]
+
+  return advantages, advantages + values
@@ -0,0 +1,145 @@
+# https://arxiv.org/abs/1812.05905 (Soft actor-critic algorithms and
+# applications, Haarnoja et al.)
+import math
+
+import torch
+import torch.nn.functional as F
+from torch.distributions import Normal
+
+from cherry.agents.ddpg import DDPG
+from cherry.agents.models import EnsembleCritic
+from utils.helpers import build_optimizer
+
+
+class SAC(DDPG):
+
+  def __init__(self, cfgs, model=None, model_file=None,
+               device=None, log_level='info'):
+    """
+      Soft actor-critic with a tanh squashed gaussian actor (mean, log std
+      from one model) and n_critics Q(s, a) critics in one EnsembleCritic.
+      Targets are the min over the target critics plus the entropy bonus,
+      alpha is tuned towards target_entropy when auto_alpha is set
+    """
+
+    self.n_critics = cfgs.get('n_critics', 2)
+    self.hidden_size = cfgs.get('hidden_size', 256)
+    self.auto_alpha = cfgs.get('auto_alpha', True)
+    self.target_entropy = cfgs.get('target_entropy',
+                                   -float(cfgs['action_size']))
+
+    assert cfgs.get('continous'), 'SAC needs a continous action space'
+
+    super(SAC, self).__init__(cfgs, model=model, model_file=model_file,
+                              device=device, log_level=log_level)
+
+    # no target actor, the soft target samples from the actor itself
+    self.actor_target = None
+    self.actor_sync = None
+
+    self.log_alpha = torch.tensor(math.log(cfgs.get('alpha', 0.2)),
+                                  device=self.device, requires_grad=True)
+    self.alpha_optimizer = build_optimizer(cfgs['opt_name'],
+                                           [self.log_alpha],
+                                           lr=cfgs.get('alpha_lr',
+                                                       self.actor_lr))
+
+  def build_actor(self, model):
+
+    # mean and log std of the gaussian for every action dimension
+    return model(self.state_size, 2 * self.action_size,
+                 self.device).to(self.device)
+
+  def build_critic(self, model):
+
+    return EnsembleCritic(self.state_size, self.action_size, self.device,
+                          n_critics=self.n_critics,
+                          hidden_size=self.hidden_size).to(self.device)
+
+  @property
+  def alpha(self):
+
+    return self.log_alpha.detach().exp()
+
+  def sample_action(self, model, states, deterministic=False):
+    """Squashed (tanh) action, scaled to the env limits, and its log prob"""
+
+    out, _ = model(states)
+    mean, log_std = out.chunk(2, dim=-1)
+
+    if deterministic:
+      return self.scale_action(mean), None
+
+    log_std = log_std.clamp(-20, 2)
+    u = Normal(mean, log_std.exp()).rsample()
+
+    # change of variables for tanh, log(1 - tanh(u)^2) in a stable form
+    log_prob = Normal(mean, log_std.exp()).log_prob(u) - \
+        2. * (math.log(2.) - u - F.softplus(-2. * u))
+
+    return self.scale_action(u), log_prob.sum(-1, keepdim=True)
+
+  def get_action(self, state):
+
+    # samples while training, the mean action when playing (eval mode)
+    with self.acting_lock, torch.no_grad():
+      action, _ = self.sample_action(
+          self.acting, state, deterministic=not self.acting.training)
+
+    return action[0].detach().cpu().numpy()
+
+  def critic_loss(self, states, action, reward, done):
+
+    state_batch = states[:, :self.state_len]
+    next_state_batch = states[:, 1:]
+
+    # no autograd graph for the target side
+    with torch.no_grad():
+      next_action_batch, next_log_prob = self.sample_action(
+          self.actor, next_state_batch)
+
+      # pessimistic (min over critics) soft Bellman target
+      q_values_next = self.critic_target(next_state_batch,
+                                         next_action_batch).min(0)[0]
+      q_values_next = q_values_next - self.alpha * next_log_prob
+      q_values_target = (q_values_next * self.gamma) * (1. - done) + reward
+
+    q_values = self.critic(state_batch, action)
+
+    # sum of the per critic losses
+    return self.n_critics * F.mse_loss(q_values,
+                                       q_values_target.expand_as(q_values))
+
+  def actor_loss(self, states):
+
+    state_batch = states[:, :self.state_len]
+
+    action, log_prob = self.sample_action(self.actor, state_batch)
+    q_values = self.critic(state_batch, action).min(0)[0]
+
+    return (self.alpha * log_prob - q_values).mean()
+
+  def optimize_actor(self, batches):
+
+    super(SAC, self).optimize_actor(batches)
+
+    if not self.auto_alpha:
+      return
+
+    with torch.no_grad():
+      log_prob = torch.cat([self.sample_action(self.actor,
+                                               states[:, :self.state_len])[1]
+                            for states, _, _, _ in batches])
+
+    alpha_loss = -(self.log_alpha * (log_prob + self.target_entropy)).mean()
+
+    self.alpha_optimizer.zero_grad(set_to_none=True)
+    alpha_loss.backward()
+    self.alpha_optimizer.step()
+
+  def update_target(self, step):
+
+    # Update the frozen target critics, no target actor in SAC
+    self.critic_sync.soft_update(self.tau)
+
+    self.logger.debug('Updating agent at {}'.format(step))
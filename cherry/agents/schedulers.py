@@ -0,0 +1,67 @@
+import time
+
+
+class ReplayRatio():
+
+  def __init__(self, train_cfgs):
+    """
+      Learner schedule of off-policy agents, n_updates gradient steps every
+      policy_update env steps once learning_starts transitions were
+      collected. Each update accumulates gradients over grad_accum sampled
+      batches (effective batch size batch_size * grad_accum)
+    """
+
+    self.policy_update = train_cfgs['policy_update']
+    self.batch_size = train_cfgs['batch_size']
+    self.n_updates = train_cfgs.get('n_updates', 1)
+    self.learning_starts = train_cfgs.get('learning_starts', 0)
+    self.grad_accum = train_cfgs.get('grad_accum', 1)
+
+    assert self.policy_update > 0, 'policy_update has to be > 0'
+    assert self.n_updates > 0, 'n_updates has to be > 0'
+    assert self.grad_accum > 0, 'grad_accum has to be > 0'
+
+    self.start = time.time()
+    self.env_steps = 0
+    self.updates = 0
+
+  @property
+  def replay_ratio(self):
+    """Replayed samples per env step"""
+
+    return self.n_updates * self.batch_size * self.grad_accum / \
+        self.policy_update
+
+  def step(self, global_step):
+    """Count one env step, returns the number of updates due now"""
+
+    self.env_steps += 1
+
+    if global_step < self.learning_starts:
+      return 0
+
+    if global_step % self.policy_update:
+      return 0
+
+    return self.n_updates
+
+  def update(self, optimize, n_updates):
+
+    # optimize returns False without an update (f.ex replay < batch size)
+    for _ in range(n_updates):
+      if optimize(batch_size=self.batch_size, grad_accum=self.grad_accum):
+        self.updates += 1
+
+  def rates(self):
+    """env samples/sec, updates/sec and replayed samples/sec"""
+
+    elapsed = max(time.time() - self.start, 1e-6)
+    replayed = self.updates * self.batch_size * self.grad_accum
+
+    return (self.env_steps / elapsed, self.updates / elapsed,
+            replayed / elapsed)
+
+  def summary(self):
+
+    return 'Samples/s : {0:.1f}, Updates/s : {1:.1f}, ' \
+        'Replayed/s : {2:.1f}'.format(*self.rates())
@@ -0,0 +1,108 @@
+# https://arxiv.org/abs/1802.09477 (Addressing function approximation error
+# in actor-critic methods, Fujimoto et al.)
+import torch
+import numpy as np
+import torch.nn.functional as F
+
+from cherry.agents.ddpg import DDPG
+from cherry.agents.models import EnsembleCritic
+
+
+class TD3(DDPG):
+
+  def __init__(self, cfgs, model=None, model_file=None,
+               device=None, log_level='info'):
+    """
+      Twin delayed DDPG. n_critics Q(s, a) critics live in one
+      EnsembleCritic, a forward/backward of all of them is one batched
+      matmul per layer. Targets are the min over the target critics with
+      clipped noise on the target action, the actor is updated every
+      policy_delay critic updates
+    """
+
+    self.n_critics = cfgs.get('n_critics', 2)
+    self.hidden_size = cfgs.get('hidden_size', 256)
+    self.policy_noise = cfgs.get('policy_noise', 0.2)
+    self.noise_clip = cfgs.get('noise_clip', 0.5)
+    self.expl_noise = cfgs.get('expl_noise', 0.1)
+    self.policy_delay = cfgs.get('policy_delay', 2)
+    self.n_critic_updates = 0
+
+    assert cfgs.get('continous'), 'TD3 needs a continous action space'
+
+    super(TD3, self).__init__(cfgs, model=model, model_file=model_file,
+                              device=device, log_level=log_level)
+
+  def build_critic(self, model):
+
+    return EnsembleCritic(self.state_size, self.action_size, self.device,
+                          n_critics=self.n_critics,
+                          hidden_size=self.hidden_size).to(self.device)
+
+  def get_action(self, state):
+
+    action = super(TD3, self).get_action(state)
+
+    # gaussian exploration while training, play runs in eval mode
+    if self.acting.training and self.expl_noise:
+      env_hi = self.env_hi.cpu().numpy()
+      noise = self.expl_noise * env_hi * np.random.randn(*action.shape)
+      action = np.clip(action + noise, -env_hi, env_hi).astype(np.float32)
+
+    return action
+
+  def critic_loss(self, states, action, reward, done):
+
+    state_batch = states[:, :self.state_len]
+    next_state_batch = states[:, 1:]
+
+    # no autograd graph for the target side
+    with torch.no_grad():
+      next_action_batch, _ = self.actor_target(next_state_batch)
+      next_action_batch = self.scale_action(next_action_batch)
+
+      # target policy smoothing
+      noise = torch.randn_like(next_action_batch) * self.policy_noise
+      noise = noise.clamp(-self.noise_clip, self.noise_clip) * self.env_hi
+      next_action_batch = torch.max(torch.min(next_action_batch + noise,
+                                              self.env_hi), -self.env_hi)
+
+      # pessimistic (min over critics) Bellman target
+      q_values_next = self.critic_target(next_state_batch,
+                                         next_action_batch).min(0)[0]
+      q_values_target = (q_values_next * self.gamma) * (1. - done) + reward
+
+    q_values = self.critic(state_batch, action)
+
+    # sum of the per critic losses
+    return self.n_critics * F.mse_loss(q_values,
+                                       q_values_target.expand_as(q_values))
+
+  def actor_loss(self, states):
+
+    state_batch = states[:, :self.state_len]
+
+    action, _ = self.actor(state_batch)
+    action = self.scale_action(action)
+
+    # the first critic drives the actor
+    return -self.critic(state_batch, action)[0].mean()
+
+  def optimize(self, batch_size=32, grad_accum=1):
+
+    if len(self.replay) < batch_size:
+      return False
+
+    batches = []
+    for _ in range(grad_accum):
+      states, action, reward, done = self.replay.sample(batch_size)
+      batches.append((states.to(self.device), action, reward, done))
+
+    self.optimize_critic(batches)
+    self.n_critic_updates += 1
+
+    # delayed policy updates
+    if self.n_critic_updates % self.policy_delay == 0:
+      self.optimize_actor(batches)
+
+    return True
@@ -18,7 +18,10 @@ from torch.distributions import Categorical
 from torchvision.transforms import Compose, CenterCrop, \
     Grayscale, Resize, ToPILImage, ToTensor
 
-from utils.helpers import get_logger, write_model, OPTS
+from cherry.agents import RolloutBuffer
+from cherry.agents.returns import discount_returns, gae
+from utils.helpers import get_logger, build_optimizer, maybe_compile
+from utils.checkpoint import write_model, load_weights
 
 
 class VPG():
@@ -27,17 +30,12 @@ class VPG():
                device=None, log_level='info'):
 
     self.history = None
-    self.states = None
-    self.actions = None
     self.rewards = None
-    self.values = None
-    self.mb_states = None
-    self.mb_actions = None
-    self.mb_rewards = None
-    self.mb_values = None
+    self.rollout = None
     self.ep_rewards = None
     self.rr = 10
     self.gamma = cfgs['gamma']
+    self.lam = cfgs.get('lambda')
     self.policy_lr = cfgs['policy_lr']
     self.value_lr = cfgs['value_lr']
     self.state_len = cfgs['state_len']
@@ -47,9 +45,16 @@ class VPG():
     self.input_transforms = cfgs.get('input_transforms')
     self.grad_clip = cfgs.get('grad_clip')
     self.init_weights = cfgs.get('init_weights')
-    self.vpg_scaling = cfgs.get('vpg_scaling')
-    self.value_scaling = cfgs.get('value_scaling')
-    self.entropy_scaling = cfgs.get('entropy_scaling')
+    self.vpg_scaling = cfgs.get('vpg_scaling', 1.0)
+    self.value_scaling = cfgs.get('value_scaling', 1.0)
+    self.entropy_scaling = cfgs.get('entropy_scaling', 0.0)
+    self.shared_trunk = cfgs.get('shared_trunk')
+    self.stop_gradient = cfgs.get('stop_gradient')
+    self.chunk_size = cfgs.get('chunk_size')
+    self.minibatch_size = cfgs.get('minibatch_size')
+    self.n_epochs = cfgs.get('n_epochs', 1)
+    self.compile = cfgs.get('compile')
+    self.fused_opt = cfgs.get('fused_opt')
     self.reward_norm = cfgs.get('reward_norm')
     self.device = device
     self.stable_eps = np.finfo(np.float32).eps.item()
@@ -68,18 +73,27 @@ class VPG():
     self.policy = model(self.state_size, self.action_size,
                         self.device).to(self.device)
 
-    self.value = model(self.state_size, self.action_size,
-                       self.device).to(self.device)
+    # shared trunk : one model for both (logits, value) heads
+    self.value = self.policy if self.shared_trunk else \
+        model(self.state_size, self.action_size, self.device).to(self.device)
 
     if self.init_weights:
       self.policy.apply(self.policy.init_weights)
 
-    optimizer = OPTS.get(cfgs['opt_name'])
-
-    self.policy_optimizer = optimizer(self.policy.parameters(),
-                                      lr=self.policy_lr)
-    self.value_optimizer = optimizer(self.value.parameters(),
-                                     lr=self.value_lr)
+    batch_norm = any(isinstance(m, nn.modules.batchnorm._BatchNorm)
+                     for m in self.policy.modules())
+    if self.chunk_size and batch_norm:
+      self.logger.warning('chunk_size with batch norm ({}), statistics are '
+                          'per chunk'.format(type(self.policy).__name__))
+
+    self.policy_optimizer = build_optimizer(cfgs['opt_name'],
+                                            self.policy.parameters(),
+                                            fused=self.fused_opt,
+                                            lr=self.policy_lr)
+    self.value_optimizer = None if self.shared_trunk else \
+        build_optimizer(cfgs['opt_name'], self.value.parameters(),
+                        fused=self.fused_opt, lr=self.value_lr)
+    self.loss_fn = maybe_compile(self.loss, self.compile)
 
     if model_file:
       self.load_model(model_file)
@@ -99,14 +113,21 @@ class VPG():
 
     return Compose(transforms)
 
+  def build_rollout(self, max_steps):
+
+    # image states are kept in uint8, see state_transformer
+    state_type = torch.uint8 if self.transform else torch.float32
+
+    self.rollout = RolloutBuffer(max_steps, self.state_size,
+                                 state_type=state_type, device=self.device)
+
   def reset(self):
 
-    self.mb_states = []
-    self.mb_actions = []
-    self.mb_rewards = []
-    self.mb_values = []
     self.ep_rewards = []
 
+    if self.rollout is not None:
+      self.rollout.reset()
+
     no_history = [self.zero_state for _ in range(self.state_len)]
     self.history = deque(no_history, maxlen=self.state_len)
 
@@ -114,16 +135,13 @@ class VPG():
 
   def flash_episode(self):
 
-    self.states = []
-    self.actions = []
     self.rewards = []
-    self.values = []
 
   def load_model(self, model_file):
 
     self.logger.info('Loading agent weights from {}'.format(model_file))
 
-    self.policy.load_state_dict(torch.load(model_file))
+    load_weights(self.policy, model_file, self.device)
 
   def eval(self):
 
@@ -132,8 +150,9 @@ class VPG():
   def get_action(self, state, deterministic=False):
 
     with torch.no_grad():
-      logits, _ = self.policy(state)
-      _, value = self.value(state)
+      logits, value = self.policy(state)
+      if not self.shared_trunk:
+        _, value = self.value(state)
 
     if deterministic:
       return logits.max(1)[1]
@@ -141,9 +160,7 @@ class VPG():
     c = Categorical(logits=logits)
     a = c.sample()
 
-    self.states.append(state)
-    self.actions.append(a)
-    self.values.append(value)
+    self.rollout.push(state, a, value)
 
     return a.detach().cpu().numpy()[0]
 
@@ -166,12 +183,24 @@ class VPG():
   def append_reward(self, r):
 
     self.rewards.append(r)
+    self.rollout.push_reward(r)
 
   def get_state(self):
 
     return torch.cat(list(self.history)).unsqueeze(0)
 
-  def discount_episode(self):
+  def bootstrap_value(self):
+
+    with torch.no_grad():
+      _, value = self.value(self.get_state())
+
+    return value.item()
+
+  def discount_episode(self, last_value=None):
+    """
+      Rewards to go (or GAE with lambda) for the finished episode.
+      last_value bootstraps an episode truncated by max_steps
+    """
 
     ep_reward = self.get_episode_rewards()
     self.append_episode_reward(ep_reward)
@@ -180,31 +209,34 @@ class VPG():
 
     if ep_length == 1:
       # std is not defined for array of length 1
+      self.rollout.discard_episode()
       return
 
-    ep_rewards = torch.tensor(self.rewards, dtype=torch.float32,
-                              requires_grad=False)
-    ep_discounts = torch.tensor([self.gamma ** t for t in range(ep_length)],
-                                dtype=torch.float32, requires_grad=False)
-
-    rewards = [ep_rewards[idx:] * ep_discounts[:ep_length - idx]
-               for idx in range(ep_length)]
-
-    rewards = list(map(torch.sum, rewards))
-
-    states = torch.cat(self.states)
-    actions = torch.cat(self.actions)
-    rewards = torch.stack(rewards).to(self.device)
-    values = torch.cat(self.values)
-
-    if self.reward_norm:
-      mean, std = rewards.mean(), rewards.std()
-      rewards = (rewards - mean)/(std + self.stable_eps)
-
-    self.mb_states.append(states)
-    self.mb_actions.append(actions)
-    self.mb_rewards.append(rewards)
-    self.mb_values.append(values)
+    ep = self.rollout.episode()
+    values = self.rollout.values[ep]
+
+    dones = np.zeros(ep_length, dtype=np.float32)
+    dones[-1] = last_value is None
+
+    if self.lam is None:
+      rewards = discount_returns(self.rollout.rewards[ep].numpy(), dones,
+                                 self.gamma, last_value)
+      rewards = torch.from_numpy(rewards)
+      if self.reward_norm:
+        mean, std = rewards.mean(), rewards.std()
+        rewards = (rewards - mean)/(std + self.stable_eps)
+      advantages = rewards - values
+    else:
+      advantages, rewards = gae(self.rollout.rewards[ep].numpy(),
+                                values.numpy(), dones, self.gamma, self.lam,
+                                last_value)
+      advantages = torch.from_numpy(advantages)
+      rewards = torch.from_numpy(rewards)
+      if self.reward_norm:
+        mean, std = advantages.mean(), advantages.std()
+        advantages = (advantages - mean)/(std + self.stable_eps)
+
+    self.rollout.finish_episode(rewards, advantages)
 
   def append_episode_reward(self, reward):
 
@@ -216,78 +248,137 @@ class VPG():
 
     return np.sum(self.rewards)
 
-  def optimize(self):
+  def forward(self, states):
 
-    mb_states = torch.cat(self.mb_states)
-    mb_actions = torch.cat(self.mb_actions)
-    mb_rewards = torch.cat(self.mb_rewards)
-    mb_values = torch.cat(self.mb_values)
-
-    # policy optimisation
-    self.policy_optimizer.zero_grad()
-    mb_logits, _ = self.policy(mb_states)
-    ce = F.cross_entropy(mb_logits, mb_actions, reduction='none')
-    m = Categorical(logits=mb_logits)
-    adv = mb_rewards - mb_values
-    policy_loss = self.vpg_scaling * (adv * ce).mean()
+    if not self.shared_trunk:
+      logits, _ = self.policy(states)
+      _, values = self.value(states)
+      return logits, values
+
+    if not self.stop_gradient:
+      return self.policy(states)
+
+    # value loss does not back-propagate into the layers shared with the
+    # logits (features + hidden layers of the heads)
+    return self.policy.heads(self.policy.features(states),
+                             stop_gradient=True)
+
+  def loss(self, states, actions, returns, advantages):
+
+    logits, values = self.forward(states)
+
+    ce = F.cross_entropy(logits, actions, reduction='none')
+    m = Categorical(logits=logits)
+    policy_loss = self.vpg_scaling * (advantages * ce).mean()
     entropy_loss = (-self.entropy_scaling * m.entropy()).mean()
-    vpg_loss = policy_loss + entropy_loss
-    vpg_loss.backward()
+    value_loss = self.value_scaling * F.smooth_l1_loss(values.squeeze(1),
+                                                       returns)
+
+    # policy/value models without shared trunk get disjoint gradients
+    return policy_loss + entropy_loss + value_loss
+
+  def step(self, states, actions, returns, advantages):
+    """
+      One optimizer step, gradients accumulated over chunk_size chunks.
+      Chunk losses are weighted by chunk length, the gradient matches a
+      single forward over all states except for batch norm models (f.ex
+      convnet-medium), which normalise every chunk with its own statistics
+    """
+
+    optimizers = [self.policy_optimizer, self.value_optimizer]
+    optimizers = [opt for opt in optimizers if opt is not None]
+
+    for opt in optimizers:
+      opt.zero_grad(set_to_none=True)
+
+    n = len(actions)
+    chunk_size = self.chunk_size or n
+    total_loss = 0.0
+
+    for idx in range(0, n, chunk_size):
+      chunk = slice(idx, idx + chunk_size)
+      loss = self.loss_fn(states[chunk], actions[chunk],
+                          returns[chunk], advantages[chunk])
+      loss = loss * len(actions[chunk]) / n
+      loss.backward()
+      total_loss += loss.item()
+
     if self.grad_clip:
       nn.utils.clip_grad_norm_(self.policy.parameters(), self.grad_clip)
-    self.policy_optimizer.step()
-
-    # value optimisation
-    self.value_optimizer.zero_grad()
-    _, mb_values = self.value(mb_states)
-    mb_values = mb_values.squeeze(1)
-    value_loss = self.value_scaling * F.smooth_l1_loss(mb_values, mb_rewards)
-    value_loss.backward()
-    if self.grad_clip:
-      nn.utils.clip_grad_norm_(self.value.parameters(), self.grad_clip)
-    self.value_optimizer.step()
+      if not self.shared_trunk:
+        nn.utils.clip_grad_norm_(self.value.parameters(), self.grad_clip)
 
-    loss = policy_loss + vpg_loss
+    for opt in optimizers:
+      opt.step()
 
-    return loss.detach().cpu().numpy()
+    return total_loss
 
-  def train(self, env, train_cfgs, gitsha, model_dest):
+  def optimize(self):
 
-    save_model = train_cfgs['save_model']
-    train_eps = train_cfgs['n_train_episodes']
-    max_steps = train_cfgs['max_steps']
+    mb_states, mb_actions, mb_rewards, mb_advantages = self.rollout.get()
 
-    train_ep = tqdm.tqdm(range(train_eps), ascii=True, unit='ep', leave=True)
+    n = len(mb_actions)
 
-    for ep in train_ep:
+    if self.n_epochs == 1 and not self.minibatch_size:
+      return self.step(mb_states, mb_actions, mb_rewards, mb_advantages)
 
-      self.reset()
-      state = env.reset()
+    # several epochs over shuffled minibatches, one step per minibatch
+    losses = []
 
-      self.set_state(state)
+    for epoch in range(self.n_epochs):
+      for mb in torch.split(torch.randperm(n), self.minibatch_size or n):
+        mb_device = mb.to(self.device)
+        losses.append(self.step(mb_states[mb], mb_actions[mb_device],
+                                mb_rewards[mb_device],
+                                mb_advantages[mb_device]))
 
-      train_step = tqdm.tqdm(range(max_steps), ascii=True,
-                             unit='stp', leave=False)
-      done = False
+    return np.mean(losses)
 
-      for step in train_step:
+  def collect(self, env, max_steps, render=True, progress=True):
+    """Rollout of max_steps env steps, episodes are restarted on done"""
 
-        env.render()
+    self.reset()
+    state = env.reset()
 
-        state = self.get_state()
-        action = self.get_action(state)
-        next_state, reward, done, info = env.step(action)
-        self.append_reward(reward)
+    self.set_state(state)
 
-        if done:
-          self.discount_episode()
-          self.flash_episode()
-          next_state = env.reset()
+    train_step = tqdm.tqdm(range(max_steps), ascii=True, unit='stp',
+                           leave=False, disable=not progress)
+    done = False
 
-        self.append_state(next_state)
+    for step in train_step:
 
-      if not done:
+      if render:
+        env.render()
+
+      state = self.get_state()
+      action = self.get_action(state)
+      next_state, reward, done, info = env.step(action)
+      self.append_reward(reward)
+
+      if done:
         self.discount_episode()
+        self.flash_episode()
+        next_state = env.reset()
+
+      self.append_state(next_state)
+
+    if not done:
+      self.discount_episode(last_value=self.bootstrap_value())
+
+  def train(self, env, train_cfgs, gitsha, model_dest):
+
+    save_model = train_cfgs['save_model']
+    train_eps = train_cfgs['n_train_episodes']
+    max_steps = train_cfgs['max_steps']
+
+    self.build_rollout(max_steps)
+
+    train_ep = tqdm.tqdm(range(train_eps), ascii=True, unit='ep', leave=True)
+
+    for ep in train_ep:
+
+      self.collect(env, max_steps)
 
       loss = self.optimize()
 
@@ -297,7 +388,7 @@ class VPG():
       if ep % save_model == 0:
         tag = '{0:09d}-{1}'.format(ep * max_steps, gitsha)
         self.logger.debug('Saving model {}'.format(tag))
-        write_model(self.policy, tag, model_dest)
+        write_model(self.policy, tag, model_dest, score=mean_reward)
 
       best_reward = np.max(self.ep_rewards)
       if best_reward >= env.env_solution:
@@ -317,6 +408,8 @@ class VPG():
     test_episodes = test_cfgs['n_test_episodes']
     max_steps = test_cfgs['max_steps']
 
+    self.build_rollout(max_steps)
+
     vid_dst = Path(state_dest)
     vid_dst.mkdir(parents=True, exist_ok=True)
 
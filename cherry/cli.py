@@ -1,12 +1,16 @@
 import argparse
 
-from cherry.runner import Trainer, Player
+from cherry.runner import Trainer, Player, Exporter, Server, \
+    Distillation
 
 
 def run():
 
   trainer = Trainer()
   player = Player()
+  exporter = Exporter()
+  server = Server()
+  distillation = Distillation()
 
   Formatter = argparse.ArgumentDefaultsHelpFormatter
 
@@ -14,16 +18,29 @@ def run():
                                    'playing the agent')
   subparsers = parser.add_subparsers(title='Commands', dest='command',
                                      description='Valid command for Cherry',
-                                     help='Select train/play mode')
+                                     help='Select train/play/export/serve/distill mode')
   subparsers.required = True
 
   train_parser = subparsers.add_parser('train', help='🚆 Train the RL agent',
                                        formatter_class=Formatter)
   play_parser = subparsers.add_parser('play', help='🎮 Play the RL agent',
                                       formatter_class=Formatter)
+  export_parser = subparsers.add_parser('export',
+                                        help='📦 Export the RL agent to ONNX',
+                                        formatter_class=Formatter)
+  serve_parser = subparsers.add_parser('serve',
+                                       help='🛎 Serve the RL agent locally',
+                                       formatter_class=Formatter)
+  distill_parser = subparsers.add_parser('distill',
+                                         help='⚗ Distill the RL agent into '
+                                         'a smaller model',
+                                         formatter_class=Formatter)
 
   trainer.build_parser(train_parser)
   player.build_parser(play_parser)
+  exporter.build_parser(export_parser)
+  server.build_parser(serve_parser)
+  distillation.build_parser(distill_parser)
 
   args = parser.parse_args()
   args.main(args)
@@ -2,6 +2,7 @@ from cherry.envs.atari import AtariEnvironment
 from cherry.envs.doom import DoomEnvironment
 from cherry.envs.classic_control import ClassicControlEnvironment
 from cherry.envs.pybullet_robotics import PyBulletRoboticsEnvironment
+from cherry.envs.vector import VectorEnv, SubprocVectorEnv, build_vector_env
 from utils.helpers import get_logger
 
 logger = get_logger(__name__)
@@ -22,6 +22,7 @@ class AtariEnvironment():
 
   def __init__(self, cfgs, play=False):
 
+    self.cfgs = cfgs
     self.env = None
     self.seed = cfgs.get('seed')
     self.env_name = cfgs.get('name')
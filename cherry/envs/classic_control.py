@@ -20,6 +20,7 @@ class ClassicControlEnvironment():
 
   def __init__(self, cfgs):
 
+    self.cfgs = cfgs
     self.game = None
     self.env_name = cfgs.get('name')
     self.seed = cfgs.get('seed')
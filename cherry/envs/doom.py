@@ -18,6 +18,8 @@ class DoomEnvironment():
 
   def __init__(self, cfgs):
 
+    self.cfgs = cfgs
+
     scenario_name = cfgs['name']
     filepath = Path(__file__).parent
 
@@ -21,6 +21,7 @@ class PyBulletRoboticsEnvironment():
 
   def __init__(self, cfgs):
 
+    self.cfgs = cfgs
     self.game = None
     self.env_name = cfgs.get('name')
     self.seed = cfgs.get('seed')
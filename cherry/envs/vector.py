@@ -0,0 +1,153 @@
+import torch.multiprocessing as mp
+
+from utils.helpers import get_logger
+
+logger = get_logger(__file__)
+
+
+def env_seeds(cfgs, n_envs, seeds=None):
+
+  if seeds is not None:
+    return list(seeds)
+
+  seed = cfgs.get('seed')
+
+  return [None if seed is None else seed + rank for rank in range(n_envs)]
+
+
+def auto_reset(env, action):
+  """Steps env, an episode end resets it and returns the first frame"""
+
+  state, reward, done, info = env.step(action)
+
+  if done:
+    state = env.reset()
+
+  return state, reward, done, info
+
+
+class VectorEnv():
+
+  def __init__(self, cfgs, n_envs, seeds=None):
+    """
+      n_envs copies of an env (seeded seed + rank or seeds) stepped one
+      after the other in this process. Finished episodes are reset by step
+    """
+
+    from cherry.envs import build_env
+
+    self.n_envs = n_envs
+    self.envs = [build_env(dict(cfgs, seed=seed))
+                 for seed in env_seeds(cfgs, n_envs, seeds)]
+
+    self.action_size = self.envs[0].action_size
+    self.env_solution = getattr(self.envs[0], 'env_solution', None)
+
+  def reset(self):
+
+    return [env.reset() for env in self.envs]
+
+  def step(self, actions):
+
+    states, rewards, dones, infos = zip(*[auto_reset(env, action)
+                                          for env, action in zip(self.envs,
+                                                                 actions)])
+
+    return list(states), list(rewards), list(dones), list(infos)
+
+  def close(self):
+
+    for env in self.envs:
+      env.close()
+
+
+def run_env(remote, cfgs, seed):
+
+  from cherry.envs import build_env
+
+  env = build_env(dict(cfgs, seed=seed))
+
+  remote.send((env.action_size, getattr(env, 'env_solution', None)))
+
+  while True:
+
+    cmd, data = remote.recv()
+
+    if cmd == 'step':
+      remote.send(auto_reset(env, data))
+    elif cmd == 'reset':
+      remote.send(env.reset())
+    elif cmd == 'close':
+      env.close()
+      remote.close()
+      break
+
+
+class SubprocVectorEnv():
+
+  def __init__(self, cfgs, n_envs, seeds=None):
+    """
+      Same interface as VectorEnv, each env steps in its own process so
+      expensive envs (Doom, Atari) step in parallel
+    """
+
+    ctx = mp.get_context('spawn')
+
+    self.n_envs = n_envs
+    self.remotes, remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+    self.procs = [ctx.Process(target=run_env, args=(remote, cfgs, seed),
+                              daemon=True)
+                  for seed, remote in zip(env_seeds(cfgs, n_envs, seeds),
+                                          remotes)]
+
+    for proc in self.procs:
+      proc.start()
+
+    for remote in remotes:
+      remote.close()
+
+    try:
+      self.action_size, self.env_solution = self.remotes[0].recv()
+    except EOFError:
+      # f.ex a script without a __main__ guard, re-run by spawn
+      for proc in self.procs:
+        proc.join()
+      raise RuntimeError('Env processes exited while starting, exit codes '
+                         '{}'.format([proc.exitcode for proc in self.procs]))
+
+    for remote in self.remotes[1:]:
+      remote.recv()
+
+  def reset(self):
+
+    for remote in self.remotes:
+      remote.send(('reset', None))
+
+    return [remote.recv() for remote in self.remotes]
+
+  def step(self, actions):
+
+    for remote, action in zip(self.remotes, actions):
+      remote.send(('step', action))
+
+    states, rewards, dones, infos = zip(*[remote.recv()
+                                          for remote in self.remotes])
+
+    return list(states), list(rewards), list(dones), list(infos)
+
+  def close(self):
+
+    for remote in self.remotes:
+      remote.send(('close', None))
+
+    for proc in self.procs:
+      proc.join()
+
+
+def build_vector_env(cfgs, n_envs, subproc=False, seeds=None):
+
+  vector_env = SubprocVectorEnv if subproc else VectorEnv
+
+  logger.info('Setting up {} {} envs'.format(n_envs, cfgs['type']))
+
+  return vector_env(cfgs, n_envs, seeds=seeds)
@@ -1,2 +1,5 @@
 from cherry.runner.trainer import Trainer
 from cherry.runner.player import Player
+from cherry.runner.exporter import Exporter
+from cherry.runner.server import Server
+from cherry.runner.distiller import Distillation
@@ -0,0 +1,80 @@
+from pathlib import Path
+
+import yaml
+import torch
+
+from cherry.envs import build_env
+from cherry.agents import get_model, build_agent
+from cherry.agents.distill import Distiller
+from utils.helpers import add_verbosity_parser, read_yaml, get_repo_hexsha, \
+    get_logger
+
+
+class Distillation:
+
+  def __init__(self):
+
+    pass
+
+  def build_parser(self, parser):
+
+    parser.add_argument('-c', '--config_file', type=Path,
+                        help='Path to teacher Config file with a distill '
+                        'block', required=True)
+    parser.add_argument('-m', dest='model_file', type=Path,
+                        help='Teacher model', required=True)
+    parser.add_argument('-d', dest='device', choices=['gpu', 'cpu'],
+                        help='Device to run the distillation', default='gpu')
+    parser.set_defaults(main=self._run)
+
+    parser = add_verbosity_parser(parser)
+
+  def _run(self, args):
+
+    log_level = args.log
+    device = args.device
+    model_file = args.model_file
+    config_file = args.config_file
+
+    logger = get_logger(__file__, log_level=log_level)
+
+    gitsha = get_repo_hexsha()
+
+    cuda_available = torch.cuda.is_available()
+    cuda_and_device = cuda_available and device == 'gpu'
+
+    device = torch.device('cuda' if cuda_and_device else 'cpu')
+
+    try:
+      cfgs = read_yaml(config_file)
+    except Exception as err:
+      logger.error('Error reading config file {}, {}'.format(config_file, err))
+      return
+
+    env_cfgs = cfgs['env']
+    agent_cfgs = cfgs['agent']
+    distill_cfgs = cfgs.get('distill')
+
+    assert distill_cfgs, 'Expected distill info in config file'
+
+    model_dest = Path(distill_cfgs['model_dest'])
+    model_dest.mkdir(parents=True, exist_ok=True)
+
+    env = build_env(env_cfgs)
+
+    model = get_model(agent_cfgs['model_type'])
+    teacher = build_agent(agent_cfgs, model=model, model_file=model_file,
+                          device=device, log_level=log_level)
+
+    student = get_model(distill_cfgs['student_type'])
+    distiller = Distiller(distill_cfgs, teacher=teacher, student=student,
+                          device=device, log_level=log_level)
+
+    # student config, usable with cherry play
+    cfgs['agent']['model_type'] = distill_cfgs['student_type']
+    student_cfg = model_dest.joinpath('{}-student-{}.yaml'.format(
+        config_file.stem, gitsha))
+    with student_cfg.open('w') as pfile:
+      yaml.dump(cfgs, pfile, default_flow_style=False)
+
+    distiller.distill(env, distill_cfgs, gitsha, model_dest)
@@ -0,0 +1,69 @@
+from pathlib import Path
+
+import torch
+
+from cherry.agents import get_model, build_agent
+from utils.helpers import add_verbosity_parser, read_yaml, get_logger
+
+
+class Exporter:
+
+  def __init__(self):
+
+    pass
+
+  def build_parser(self, parser):
+
+    parser.add_argument('-c', '--config_file', type=Path,
+                        help='Path to Config file', required=True)
+    parser.add_argument('-m', dest='model_file', type=Path,
+                        help='Model to export', required=True)
+    parser.add_argument('-o', dest='onnx_file', type=Path,
+                        help='Exported ONNX graph, defaults to model file '
+                        'with .onnx suffix', default=None)
+    parser.add_argument('--opset', dest='opset', type=int,
+                        help='ONNX opset version', default=13)
+    parser.set_defaults(main=self._run)
+
+    parser = add_verbosity_parser(parser)
+
+  def _run(self, args):
+
+    log_level = args.log
+    model_file = args.model_file
+    config_file = args.config_file
+    onnx_file = args.onnx_file or model_file.with_suffix('.onnx')
+
+    logger = get_logger(__file__, log_level=log_level)
+
+    device = torch.device('cpu')
+
+    try:
+      cfgs = read_yaml(config_file)
+    except Exception as err:
+      logger.error('Error reading config file {}, {}'.format(config_file, err))
+      return
+
+    agent_cfgs = cfgs['agent']
+
+    model = get_model(agent_cfgs['model_type'])
+    agent = build_agent(agent_cfgs, model=model, model_file=model_file,
+                        device=device, log_level=log_level)
+
+    # DQN/DDQN/VPG act with policy, DDPG acts with actor
+    policy = getattr(agent, 'policy', None) or getattr(agent, 'actor')
+    policy.eval()
+
+    # image states are kept in uint8, normalisation happens in the graph
+    state_type = torch.uint8 if agent.transform else torch.float32
+    state = torch.zeros([1] + agent.state_size, dtype=state_type)
+
+    torch.onnx.export(policy, (state,), onnx_file.as_posix(),
+                      input_names=['state'], output_names=['q', 'v'],
+                      dynamic_axes={'state': {0: 'batch'},
+                                    'q': {0: 'batch'},
+                                    'v': {0: 'batch'}},
+                      opset_version=args.opset)
+
+    logger.info('Exported {} to {}'.format(model_file.as_posix(),
+                                           onnx_file.as_posix()))
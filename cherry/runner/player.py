@@ -1,11 +1,57 @@
 from pathlib import Path
 
 import torch
+import numpy as np
 
 from cherry.envs import build_env
 from cherry.agents import get_model, build_agent
 from utils.helpers import add_verbosity_parser, read_yaml, copy_yaml, \
-    get_repo_hexsha, validate_config, get_logger, write_model
+    get_repo_hexsha, validate_config, get_logger
+from utils.checkpoint import write_model
+
+ORT_TYPES = {'tensor(uint8)': np.uint8,
+             'tensor(float)': np.float32}
+
+
+class OnnxPolicy:
+
+  # inference only, f.ex TD3/SAC skip exploration noise
+  training = False
+
+  def __init__(self, model_file, intra_threads=None, inter_threads=None):
+    """
+      Runs an exported policy graph (see `cherry export`) on onnxruntime's
+      CPU execution provider. Mimics the (q, v) forward of cherry models
+    """
+
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    if intra_threads:
+      opts.intra_op_num_threads = intra_threads
+    if inter_threads:
+      opts.inter_op_num_threads = inter_threads
+
+    self.session = ort.InferenceSession(model_file.as_posix(),
+                                        sess_options=opts,
+                                        providers=['CPUExecutionProvider'])
+
+    state = self.session.get_inputs()[0]
+    self.state_name = state.name
+    self.state_type = ORT_TYPES.get(state.type, np.float32)
+
+  def __call__(self, x, y=None):
+
+    x = x.cpu().numpy().astype(self.state_type, copy=False)
+    q, v = self.session.run(None, {self.state_name: x})
+
+    return torch.from_numpy(q), torch.from_numpy(v)
+
+  def eval(self):
+
+    return self
 
 
 class Player:
@@ -22,6 +68,16 @@ class Player:
                         help='Model to test with', required=True)
     parser.add_argument('-d', dest='device', choices=['gpu', 'cpu'],
                         help='Device to run the train/test', default='gpu')
+    parser.add_argument('-b', '--backend', dest='backend',
+                        choices=['torch', 'onnx'], default='torch',
+                        help='Inference backend, onnx expects an exported '
+                        'graph as model file')
+    parser.add_argument('-t', '--threads', dest='threads', type=int,
+                        help='Intra-op threads for the onnx backend',
+                        default=None)
+    parser.add_argument('--inter_threads', dest='inter_threads', type=int,
+                        help='Inter-op threads for the onnx backend',
+                        default=None)
     parser.set_defaults(main=self._run)
 
     parser = add_verbosity_parser(parser)
@@ -30,6 +86,7 @@ class Player:
 
     log_level = args.log
     device = args.device
+    backend = args.backend
     model_file = args.model_file
     config_file = args.config_file
 
@@ -39,6 +96,7 @@ class Player:
 
     cuda_available = torch.cuda.is_available()
     cuda_and_device = cuda_available and device == 'gpu'
+    cuda_and_device = cuda_and_device and backend == 'torch'
 
     device = torch.device('cuda' if cuda_and_device else 'cpu')
 
@@ -57,13 +115,45 @@ class Player:
     agent_cfgs = cfgs['agent']
     test_cfgs = cfgs['test']
 
+    # multi-task configs play one of their tasks (env blocks)
+    if isinstance(env_cfgs, list):
+      env_cfgs = env_cfgs[test_cfgs.get('task', 0)]
+
     env = build_env(env_cfgs)
 
     model = get_model(agent_cfgs['model_type'])
-    agent = build_agent(agent_cfgs, model=model, model_file=model_file,
-                        device=device, log_level=log_level)
 
-    assert env.action_size == agent.action_size, "Env ≠ Agent {} ≠ {} action' \
-        ' size should match".format(env.action_size, agent.action_size)
+    if backend == 'onnx':
+      agent = build_agent(agent_cfgs, model=model, device=device,
+                          log_level=log_level)
+      self.attach_onnx(agent, model_file, args.threads, args.inter_threads)
+      logger.info('Running {} with onnxruntime'.format(model_file.name))
+    else:
+      agent = build_agent(agent_cfgs, model=model, model_file=model_file,
+                          device=device, log_level=log_level)
+
+    action_size = agent.action_size
+    if isinstance(action_size, list):
+      action_size = action_size[test_cfgs.get('task', 0)]
+
+    assert env.action_size == action_size, "Env ≠ Agent {} ≠ {} action' \
+        ' size should match".format(env.action_size, action_size)
 
     agent.play(env, test_cfgs, gitsha)
+
+  def attach_onnx(self, agent, model_file, intra_threads, inter_threads):
+
+    policy = OnnxPolicy(model_file, intra_threads=intra_threads,
+                        inter_threads=inter_threads)
+
+    # the graph is a plain (q, v) forward of one model
+    assert not isinstance(agent.action_size, list), \
+        'No onnxruntime backend for multi-task agents'
+    assert not hasattr(getattr(agent, 'acting', None), 'init_hidden'), \
+        'No onnxruntime backend for recurrent models'
+
+    # DQN/DDQN act with policy, VPG with policy + value, DDPG with actor,
+    # DQN/DDQN/DDPG (+ TD3/SAC) through acting
+    for name in ['policy', 'value', 'actor', 'acting']:
+      if hasattr(agent, name):
+        setattr(agent, name, policy)
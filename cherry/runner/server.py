@@ -0,0 +1,322 @@
+import os
+import json
+import time
+import queue
+import threading
+from pathlib import Path
+from collections import deque
+from concurrent.futures import Future
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import torch
+import numpy as np
+
+from cherry.agents import get_model
+from utils.helpers import add_verbosity_parser, read_yaml, get_logger
+from utils.checkpoint import load_weights
+
+
+class ServeStats:
+
+  def __init__(self, window=10000):
+    """
+      Request latency (submit to result) and micro-batch size bookkeeping,
+      latencies are kept over the last `window` requests
+    """
+
+    self.lock = threading.Lock()
+    self.start = time.time()
+    self.requests = 0
+    self.batches = 0
+    self.latencies = deque(maxlen=window)
+
+  def record(self, latencies):
+
+    with self.lock:
+      self.requests += len(latencies)
+      self.batches += 1
+      self.latencies.extend(latencies)
+
+  def summary(self):
+
+    with self.lock:
+      elapsed = time.time() - self.start
+      latencies = np.array(self.latencies) * 1000.
+      requests, batches = self.requests, self.batches
+
+    summary = {'requests': requests,
+               'batches': batches,
+               'mean_batch': requests / max(batches, 1),
+               'throughput_rps': requests / max(elapsed, 1e-6)}
+
+    for p in [50, 95, 99]:
+      value = np.percentile(latencies, p) if len(latencies) else 0.0
+      summary['latency_p{}_ms'.format(p)] = float(value)
+
+    return summary
+
+
+class MicroBatcher(threading.Thread):
+
+  def __init__(self, model, max_batch=32, max_latency=0.002, stats=None):
+    """
+      Coalesces concurrent observations into one forward pass. A batch is
+      closed after `max_batch` requests or `max_latency` seconds after its
+      first request, whichever comes first
+    """
+
+    super(MicroBatcher, self).__init__(daemon=True)
+
+    self.model = model
+    self.max_batch = max_batch
+    self.max_latency = max_latency
+    self.stats = stats or ServeStats()
+    self.requests = queue.Queue()
+    self.running = True
+
+  def submit(self, state):
+
+    future = Future()
+    self.requests.put((state, future, time.time()))
+
+    return future
+
+  def stop(self):
+
+    self.running = False
+
+  def collect(self):
+
+    try:
+      batch = [self.requests.get(timeout=0.1)]
+    except queue.Empty:
+      return []
+
+    deadline = batch[0][2] + self.max_latency
+
+    while len(batch) < self.max_batch:
+      timeout = deadline - time.time()
+      try:
+        # past the deadline only drain what is already waiting
+        if timeout > 0:
+          batch.append(self.requests.get(timeout=timeout))
+        else:
+          batch.append(self.requests.get_nowait())
+      except queue.Empty:
+        break
+
+    return batch
+
+  def run(self):
+
+    while self.running:
+
+      batch = self.collect()
+
+      if not batch:
+        continue
+
+      states, futures, starts = zip(*batch)
+
+      try:
+        with torch.no_grad():
+          q, v = self.model(torch.stack(states))
+        q, v = q.cpu().numpy(), v.cpu().numpy()
+      except Exception as err:
+        for future in futures:
+          future.set_exception(err)
+        continue
+
+      for idx, future in enumerate(futures):
+        future.set_result({'action': int(q[idx].argmax()),
+                           'q': q[idx].tolist(),
+                           'v': float(v[idx, 0])})
+
+      now = time.time()
+      self.stats.record([now - start for start in starts])
+
+
+class PolicyHandler(BaseHTTPRequestHandler):
+  """
+    POST /act with a raw (application/octet-stream) or JSON ({"state": ...})
+    observation of shape state_size, GET /stats for latency/throughput
+  """
+
+  protocol_version = 'HTTP/1.1'
+  # small request/response pairs, avoid the 40ms delayed ack stall
+  disable_nagle_algorithm = True
+
+  def address_string(self):
+
+    # unix sockets have no client address
+    return str(self.client_address or self.server.server_address)
+
+  def log_message(self, format, *args):
+
+    self.server.logger.debug(format % args)
+
+  def reply(self, code, payload):
+
+    body = json.dumps(payload).encode('utf-8')
+
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def read_state(self):
+
+    length = int(self.headers.get('Content-Length', 0))
+    body = self.rfile.read(length)
+
+    state_size, state_type = self.server.state_size, self.server.state_type
+
+    if self.headers.get('Content-Type') == 'application/octet-stream':
+      state = np.frombuffer(bytearray(body), dtype=state_type)
+    else:
+      state = np.array(json.loads(body)['state'], dtype=state_type)
+
+    return torch.from_numpy(state.reshape(state_size))
+
+  def do_GET(self):
+
+    if self.path == '/stats':
+      self.reply(200, self.server.batcher.stats.summary())
+    else:
+      self.reply(404, {'error': 'unknown path {}'.format(self.path)})
+
+  def do_POST(self):
+
+    if self.path != '/act':
+      self.reply(404, {'error': 'unknown path {}'.format(self.path)})
+      return
+
+    try:
+      state = self.read_state()
+    except Exception as err:
+      self.reply(400, {'error': 'bad observation, {}'.format(err)})
+      return
+
+    try:
+      result = self.server.batcher.submit(state).result()
+    except Exception as err:
+      self.reply(500, {'error': str(err)})
+      return
+
+    self.reply(200, result)
+
+
+class UnixPolicyHandler(PolicyHandler):
+
+  # no TCP options on unix sockets
+  disable_nagle_algorithm = False
+
+
+class PolicyHTTPServer(ThreadingMixIn, HTTPServer):
+
+  daemon_threads = True
+
+
+class PolicyUnixServer(ThreadingMixIn, UnixStreamServer):
+
+  daemon_threads = True
+
+
+class Server:
+
+  def __init__(self):
+
+    pass
+
+  def build_parser(self, parser):
+
+    parser.add_argument('-c', '--config_file', type=Path,
+                        help='Path to Config file', required=True)
+    parser.add_argument('-m', dest='model_file', type=Path,
+                        help='Model to serve', required=True)
+    parser.add_argument('-d', dest='device', choices=['gpu', 'cpu'],
+                        help='Device to run the policy on', default='cpu')
+    parser.add_argument('--host', dest='host', default='127.0.0.1',
+                        help='Address to listen on')
+    parser.add_argument('--port', dest='port', type=int, default=8000,
+                        help='Port to listen on')
+    parser.add_argument('--socket', dest='socket', type=Path, default=None,
+                        help='Listen on a unix socket instead of host:port')
+    parser.add_argument('--max_batch', dest='max_batch', type=int,
+                        default=32, help='Largest micro-batch')
+    parser.add_argument('--max_latency', dest='max_latency', type=float,
+                        default=2.0, help='Longest wait (ms) for a '
+                        'micro-batch to fill up')
+    parser.set_defaults(main=self._run)
+
+    parser = add_verbosity_parser(parser)
+
+  def _run(self, args):
+
+    log_level = args.log
+    device = args.device
+    model_file = args.model_file
+    config_file = args.config_file
+
+    logger = get_logger(__file__, log_level=log_level)
+
+    cuda_available = torch.cuda.is_available()
+    cuda_and_device = cuda_available and device == 'gpu'
+
+    device = torch.device('cuda' if cuda_and_device else 'cpu')
+
+    try:
+      cfgs = read_yaml(config_file)
+    except Exception as err:
+      logger.error('Error reading config file {}, {}'.format(config_file, err))
+      return
+
+    agent_cfgs = cfgs['agent']
+
+    state_size = [agent_cfgs['state_len']] + agent_cfgs['input_shape']
+    action_size = agent_cfgs['action_size']
+    # image states are kept in uint8, see ReplayBuffer
+    state_type = np.uint8 if agent_cfgs.get('input_transforms') \
+        else np.float32
+
+    model = get_model(agent_cfgs['model_type'])
+    policy = model(state_size, action_size, device).to(device)
+    load_weights(policy, model_file, device)
+    policy.eval()
+
+    logger.info('Loaded {} from {}'.format(agent_cfgs['model_type'],
+                                           model_file.as_posix()))
+
+    batcher = MicroBatcher(policy, max_batch=args.max_batch,
+                           max_latency=args.max_latency / 1000.)
+    batcher.start()
+
+    if args.socket:
+      if args.socket.exists():
+        os.unlink(args.socket.as_posix())
+      server = PolicyUnixServer(args.socket.as_posix(), UnixPolicyHandler)
+      address = args.socket.as_posix()
+    else:
+      server = PolicyHTTPServer((args.host, args.port), PolicyHandler)
+      address = 'http://{}:{}'.format(args.host, args.port)
+
+    server.logger = logger
+    server.batcher = batcher
+    server.state_size = state_size
+    server.state_type = state_type
+
+    logger.info('Serving on {}, max batch {}, '
+                'max latency {}ms'.format(address, args.max_batch,
+                                          args.max_latency))
+
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      logger.info('Stats {}'.format(batcher.stats.summary()))
+    finally:
+      batcher.stop()
+      server.server_close()
+      if args.socket and args.socket.exists():
+        os.unlink(args.socket.as_posix())
@@ -3,11 +3,19 @@ from pathlib import Path
 import tqdm
 import torch
 import numpy as np
+import torch.multiprocessing as mp
+import torch.distributed as dist
 
 from cherry.envs import build_env
 from cherry.agents import get_model, build_agent
+from cherry.agents.distributed import distribute, init_distributed, rank_seed
 from utils.helpers import add_verbosity_parser, read_yaml, copy_yaml, \
-    get_repo_hexsha, validate_config, get_logger, write_model
+    get_repo_hexsha, validate_config, get_logger
+from utils.checkpoint import write_model, is_rank_zero, CheckpointWriter, \
+    set_checkpoint_writer
+
+# agents which save (save_state) and restore (--resume) the training state
+RESUMABLE = ['dqn', 'ddqn']
 
 
 class Trainer:
@@ -22,6 +30,18 @@ class Trainer:
                         help='Path to Config file', required=True)
     parser.add_argument('-d', dest='device', choices=['gpu', 'cpu'],
                         help='Device to run the train/test', default='gpu')
+    parser.add_argument('--nproc', type=int, default=1,
+                        help='Data parallel processes (ranks) on this node')
+    parser.add_argument('--nnodes', type=int, default=1,
+                        help='Nodes taking part in data parallel training')
+    parser.add_argument('--node_rank', type=int, default=0,
+                        help='Rank of this node, 0 hosts the rendezvous')
+    parser.add_argument('--master_addr', default='127.0.0.1',
+                        help='Address of node 0')
+    parser.add_argument('--master_port', type=int, default=29500,
+                        help='Free port on node 0')
+    parser.add_argument('--resume', action='store_true',
+                        help='Resume from the training state in model_dest')
     parser.set_defaults(main=self._run)
 
     parser = add_verbosity_parser(parser)
@@ -53,26 +73,105 @@ class Trainer:
       logger.error('Error reading config file {}, {}'.format(config_file, err))
       return
 
+    world_size = args.nproc * args.nnodes
+
+    if world_size == 1:
+      self._train(cfgs, config_file, device, gitsha, log_level,
+                  resume=args.resume)
+      return
+
+    logger.info('Data parallel training, {} ranks on {} node(s)'.format(
+        world_size, args.nnodes))
+
+    mp.spawn(self._train_rank, args=(args, cfgs, device, gitsha, world_size),
+             nprocs=args.nproc)
+
+  def _train_rank(self, local_rank, args, cfgs, device, gitsha, world_size):
+
+    rank = args.node_rank * args.nproc + local_rank
+
+    # ranks on a node split its cores
+    torch.set_num_threads(max(mp.cpu_count() // args.nproc, 1))
+
+    if device.type == 'cuda':
+      device = torch.device('cuda', local_rank % torch.cuda.device_count())
+
+    init_distributed(rank, world_size, args.master_addr, args.master_port)
+
+    try:
+      self._train(cfgs, args.config_file, device, gitsha, args.log, rank=rank,
+                  resume=args.resume)
+    finally:
+      dist.destroy_process_group()
+
+  def _train(self, cfgs, config_file, device, gitsha, log_level, rank=None,
+             resume=False):
+
+    logger = get_logger(__file__, log_level=log_level)
+
     env_cfgs = cfgs['env']
     agent_cfgs = cfgs['agent']
     train_cfgs = cfgs['train']
 
+    # multi-task agents train on a list of env blocks, one per task
+    multi_task = isinstance(env_cfgs, list)
+    task_cfgs = env_cfgs if multi_task else [env_cfgs]
+
+    if rank is not None:
+      # own experience (env seed, replay) per rank
+      task_cfgs = [dict(c, seed=rank_seed(c.get('seed'), rank))
+                   for c in task_cfgs]
+      # ranks run the same number of updates (gradient all-reduces), an
+      # early stop on one rank would leave the others waiting on it
+      train_cfgs = dict(train_cfgs, env_solution=float('inf'))
+
+    if resume:
+      assert agent_cfgs['agent_type'] in RESUMABLE, \
+          'No resume for {}'.format(agent_cfgs['agent_type'])
+      train_cfgs = dict(train_cfgs, resume=True)
+
     model_dest = train_cfgs['model_dest']
     model_dest = Path(model_dest)
 
-    env = build_env(env_cfgs)
+    envs = [build_env(c) for c in task_cfgs]
+
+    if rank is not None:
+      for env in envs:
+        env.env_solution = float('inf')
 
     model = get_model(agent_cfgs['model_type'])
     agent = build_agent(agent_cfgs, model=model, device=device,
                         log_level=log_level)
 
+    if rank is not None:
+      agent = distribute(agent, agent_cfgs['agent_type'], train_cfgs)
+
     model_dest.mkdir(parents=True, exist_ok=True)
     logger.debug('Making exp dir {}'.format(model_dest.as_posix()))
-    copy_yaml(config_file, model_dest, gitsha)
-    logger.debug('Copying {} to {}'.format(config_file.as_posix(),
-                                           model_dest.as_posix()))
 
-    assert env.action_size == agent.action_size, "Env ≠ Agent {} ≠ {} action' \
-        ' size should match".format(env.action_size, agent.action_size)
+    if is_rank_zero():
+      copy_yaml(config_file, model_dest, gitsha)
+      logger.debug('Copying {} to {}'.format(config_file.as_posix(),
+                                             model_dest.as_posix()))
+
+    env_sizes = [env.action_size for env in envs]
+    agent_sizes = agent.action_size if multi_task else [agent.action_size]
 
-    agent.train(env, train_cfgs, gitsha, model_dest)
+    assert env_sizes == agent_sizes, "Env ≠ Agent {} ≠ {} action' \
+        ' size should match".format(env_sizes, agent_sizes)
+
+    # checkpoints are serialized in the background, the env loop only
+    # copies the weights
+    writer = CheckpointWriter(keep_last=train_cfgs.get('keep_last'),
+                              keep_best=train_cfgs.get('keep_best'),
+                              flat=train_cfgs.get('flat_checkpoints'),
+                              half=train_cfgs.get('half_checkpoints'),
+                              delta=train_cfgs.get('delta_checkpoints'))
+    set_checkpoint_writer(writer)
+
+    try:
+      agent.train(envs if multi_task else envs[0], train_cfgs, gitsha,
+                  model_dest)
+    finally:
+      set_checkpoint_writer(None)
+      writer.close()
@@ -0,0 +1,65 @@
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import torch
+
+from cherry.envs import build_env
+from cherry.agents import get_model, build_agent
+from utils.helpers import read_yaml, get_logger
+
+logger = get_logger(__file__)
+
+
+def run(args):
+
+  cfgs = read_yaml(args.config_file)
+
+  agent_cfgs = dict(cfgs['agent'], agent_type='a3c')
+  train_cfgs = dict(cfgs['train'], n_train_episodes=args.n_episodes,
+                    save_model=args.n_episodes + 1)
+
+  env = build_env(cfgs['env'])
+  # fixed amount of work, no early stop once solved
+  env.env_solution = float('inf')
+  model = get_model(agent_cfgs['model_type'])
+
+  print('| Workers | Wall (s) | Env steps/s | Speedup |')
+  print('|---|---|---|---|')
+
+  base = None
+
+  for n_workers in args.workers:
+
+    torch.manual_seed(0)
+    agent = build_agent(agent_cfgs, model=model, device=torch.device('cpu'),
+                        log_level='warning')
+
+    # episodes are max_steps long rollouts, see VPG.collect
+    steps = args.n_episodes * train_cfgs['max_steps']
+
+    with tempfile.TemporaryDirectory() as model_dest:
+      start = time.perf_counter()
+      agent.train(env, dict(train_cfgs, n_workers=n_workers), 'bench',
+                  model_dest)
+      elapsed = time.perf_counter() - start
+
+    rate = steps / elapsed
+    base = base or rate
+
+    print('| {} | {:.1f} | {:.1f} | {:.2f}x |'.format(n_workers, elapsed,
+                                                     rate, rate / base))
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='A3C env throughput for a '
+                                   'range of worker process counts')
+  parser.add_argument('-c', '--config_file', type=Path,
+                      default=Path('configs/control-a3c.yaml'))
+  parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+  parser.add_argument('--n_episodes', type=int, default=64,
+                      help='Rollouts per run, shared by all workers')
+
+  run(parser.parse_args())
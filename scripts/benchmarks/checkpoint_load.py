@@ -0,0 +1,86 @@
+import os
+import time
+import argparse
+import tempfile
+
+import torch
+
+from cherry.agents import MODELS
+from utils.helpers import get_logger
+from utils.checkpoint import save_atomic, save_flat, read_flat, load_weights
+
+logger = get_logger(__file__)
+
+
+def load_time(model, model_file, n_runs):
+
+  load_weights(model, model_file, 'cpu')
+
+  start = time.perf_counter()
+  for _ in range(n_runs):
+    load_weights(model, model_file, 'cpu')
+
+  return (time.perf_counter() - start) / n_runs * 1e3
+
+
+def run(args):
+
+  torch.set_num_threads(args.threads)
+
+  state_size = [args.state_len] + args.input_shape
+  dest = tempfile.mkdtemp()
+
+  print('| Model | .pth (MB) | .pth load (ms) | flat load (ms) '
+        '| float16 (MB) | Frozen encoder delta (MB) |')
+  print('|---|---|---|---|---|---|')
+
+  for name, model in MODELS.items():
+
+    # frame stack convnets only
+    if name in [None, 'mlp'] or not hasattr(model, 'encoder'):
+      continue
+
+    policy = model(state_size, args.action_size, 'cpu')
+    state_dict = policy.state_dict()
+
+    files = {k: os.path.join(dest, '{}.{}'.format(name, k))
+             for k in ['pth', 'ckpt', 'half', 'delta']}
+
+    save_atomic(state_dict, files['pth'])
+    save_flat(state_dict, files['ckpt'])
+    save_flat(state_dict, files['half'], half=True)
+
+    # a later checkpoint of a frozen encoder run, only the heads moved
+    prefixes = tuple('{}.'.format(k) for k in model.encoder)
+    later = {k: v if k.startswith(prefixes) else v + 1e-3
+             for k, v in state_dict.items()}
+    save_flat(later, files['delta'], half=True,
+              base=(files['ckpt'], read_flat(files['ckpt'])))
+
+    sizes = {k: os.path.getsize(f) / 1e6 for k, f in files.items()}
+    times = [load_time(policy, files[k], args.n_runs)
+             for k in ['pth', 'ckpt']]
+
+    print('| {} | {:.2f} | {:.2f} | {:.2f} | {:.2f} | {:.2f} |'.format(
+        name, sizes['pth'], times[0], times[1], sizes['half'],
+        sizes['delta']))
+
+    for f in files.values():
+      os.remove(f)
+
+  os.rmdir(dest)
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='Checkpoint sizes + load '
+                                   'times, torch (.pth) vs flat checkpoints')
+  parser.add_argument('--input_shape', type=int, nargs='+',
+                      default=[84, 84])
+  parser.add_argument('--state_len', type=int, default=4)
+  parser.add_argument('--action_size', type=int, default=6)
+  parser.add_argument('--threads', type=int, default=1,
+                      help='torch intra-op threads')
+  parser.add_argument('--n_runs', type=int, default=50)
+
+  run(parser.parse_args())
@@ -0,0 +1,32 @@
+import time
+
+import torch
+
+from cherry.agents import DQN
+
+
+def build(cfgs, model, device, n_fill):
+  """DQN with n_fill random uint8 frame stack transitions in its replay"""
+
+  agent = DQN(cfgs, model=model, device=device, log_level='warning')
+
+  state_size = [1, cfgs['state_len'] + 1] + cfgs['input_shape']
+  for _ in range(n_fill):
+    state = torch.randint(0, 255, state_size, dtype=torch.uint8)
+    agent.push_to_memory(state, 1, 1, False)
+
+  return agent
+
+
+def throughput(agent, batch_size, n_runs):
+  """Learner updates/sec"""
+
+  # warm up, includes torch.compile tracing
+  for _ in range(10):
+    agent.optimize(batch_size)
+
+  start = time.perf_counter()
+  for _ in range(n_runs):
+    agent.optimize(batch_size)
+
+  return n_runs / (time.perf_counter() - start)
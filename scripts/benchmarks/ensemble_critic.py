@@ -0,0 +1,92 @@
+import time
+import argparse
+
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+from cherry.agents import EnsembleCritic
+
+
+class Critic(nn.Module):
+
+  def __init__(self, in_features, hidden_size):
+
+    super(Critic, self).__init__()
+
+    self.l1 = nn.Linear(in_features, hidden_size)
+    self.l2 = nn.Linear(hidden_size, hidden_size)
+    self.l3 = nn.Linear(hidden_size, 1)
+
+  def forward(self, x, y):
+
+    x = torch.cat([x.view(x.size(0), -1), y], dim=-1)
+
+    return self.l3(F.relu(self.l2(F.relu(self.l1(x)))))
+
+
+def step_rate(fn, params, n_runs):
+
+  # forward + backward of all critics, as in a critic update
+  for _ in range(10):
+    fn().sum().backward()
+
+  start = time.perf_counter()
+  for _ in range(n_runs):
+    for p in params:
+      p.grad = None
+    fn().sum().backward()
+
+  return n_runs / (time.perf_counter() - start)
+
+
+def run(args):
+
+  torch.set_num_threads(args.threads)
+
+  device = torch.device('cuda' if args.device == 'gpu' and
+                        torch.cuda.is_available() else 'cpu')
+
+  states = torch.randn(args.batch_size, 1, args.state_size, device=device)
+  actions = torch.randn(args.batch_size, args.action_size, device=device)
+  in_features = args.state_size + args.action_size
+
+  print('| Critics | Separate (updates/s) | Ensemble (updates/s) | Speedup |')
+  print('|---|---|---|---|')
+
+  for n_critics in args.critics:
+
+    critics = [Critic(in_features, args.hidden_size).to(device)
+               for _ in range(n_critics)]
+    ensemble = EnsembleCritic([1, args.state_size], args.action_size, device,
+                              n_critics=n_critics,
+                              hidden_size=args.hidden_size).to(device)
+
+    separate = step_rate(lambda: torch.stack([c(states, actions)
+                                              for c in critics]),
+                         [p for c in critics for p in c.parameters()],
+                         args.n_runs)
+    batched = step_rate(lambda: ensemble(states, actions),
+                        list(ensemble.parameters()), args.n_runs)
+
+    print('| {} | {:.1f} | {:.1f} | {:.2f}x |'.format(n_critics, separate,
+                                                     batched,
+                                                     batched / separate))
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='Critic forward + backward/sec'
+                                   ', K separate MLPs vs one EnsembleCritic')
+  parser.add_argument('-d', dest='device', choices=['gpu', 'cpu'],
+                      default='cpu')
+  parser.add_argument('--critics', type=int, nargs='+', default=[2, 5, 10])
+  parser.add_argument('--state_size', type=int, default=28)
+  parser.add_argument('--action_size', type=int, default=8)
+  parser.add_argument('--hidden_size', type=int, default=256)
+  parser.add_argument('--batch_size', type=int, default=64)
+  parser.add_argument('--threads', type=int, default=1,
+                      help='torch intra-op threads')
+  parser.add_argument('--n_runs', type=int, default=200)
+
+  run(parser.parse_args())
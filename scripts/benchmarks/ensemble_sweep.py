@@ -0,0 +1,89 @@
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+from cherry.agents import DQN, EnsembleDQN, MLP
+from utils.helpers import read_yaml, get_logger
+
+logger = get_logger(__file__)
+
+
+def fill(agent, states, n_fill):
+
+  for _ in range(n_fill):
+    agent.replay.push(states(), 1, 1, False)
+
+
+def rate(fn, n_runs):
+
+  for _ in range(10):
+    fn()
+
+  start = time.perf_counter()
+  for _ in range(n_runs):
+    fn()
+
+  return n_runs / (time.perf_counter() - start)
+
+
+def run(args):
+
+  torch.set_num_threads(args.threads)
+
+  device = torch.device('cpu')
+  cfgs = read_yaml(args.config_file)['agent']
+  cfgs.update(replay_size=args.n_fill, seeds=None, lr=cfgs['lr'][0])
+  frames = [cfgs['state_len'] + 1] + cfgs['input_shape']
+
+  # one member, the learner step + action of a plain DQN
+  dqn = DQN(dict(cfgs, agent_type='dqn', input_transforms=[]), model=MLP,
+            device=device, log_level='warning')
+  fill(dqn, lambda: torch.randn([1] + frames), args.n_fill)
+  state = torch.randn([1] + frames[1:])
+
+  def dqn_step():
+    dqn.eps = 0.0
+    dqn.get_action(state)
+    dqn.optimize(args.batch_size)
+
+  base = rate(dqn_step, args.n_runs)
+
+  print('| Members | Steps/s | Member steps/s | Speedup vs M runs |')
+  print('|---|---|---|---|')
+  print('| 1 (dqn) | {0:.1f} | {0:.1f} | 1.00x |'.format(base))
+
+  for n_members in args.members:
+
+    agent = EnsembleDQN(dict(cfgs, n_members=n_members), model=MLP,
+                        device=device, log_level='warning')
+    agent.reset()
+    fill(agent, lambda: torch.randn([n_members] + frames), args.n_fill)
+
+    def ensemble_step():
+      agent.get_actions(agent.get_states())
+      agent.optimize(args.batch_size)
+
+    steps = rate(ensemble_step, args.n_runs)
+
+    print('| {0} | {1:.1f} | {2:.1f} | {3:.2f}x |'.format(
+        n_members, steps, steps * n_members, steps * n_members / base))
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='Learner + acting steps/sec '
+                                   'of M vectorized DQN members vs M runs')
+  parser.add_argument('-c', '--config_file', type=Path,
+                      default=Path('configs/control-dqn-ensemble.yaml'))
+  parser.add_argument('--members', type=int, nargs='+',
+                      default=[2, 4, 8, 16, 32])
+  parser.add_argument('--batch_size', type=int, default=64)
+  parser.add_argument('--threads', type=int, default=1,
+                      help='torch intra-op threads')
+  parser.add_argument('--n_fill', type=int, default=1000,
+                      help='Transitions in the replay buffer')
+  parser.add_argument('--n_runs', type=int, default=200)
+
+  run(parser.parse_args())
@@ -0,0 +1,69 @@
+import argparse
+from pathlib import Path
+
+import torch
+
+from cherry.agents import MODELS
+from utils.helpers import read_yaml, get_logger
+from dqn_learner import build, throughput
+
+logger = get_logger(__file__)
+
+
+def transition_bytes(replay):
+
+  return replay.states[0].numel() * replay.states.element_size()
+
+
+def run(args):
+
+  torch.set_num_threads(args.threads)
+
+  device = torch.device('cuda' if args.device == 'gpu' and
+                        torch.cuda.is_available() else 'cpu')
+  cfgs = read_yaml(args.config_file)['agent']
+  cfgs.update(replay_size=args.n_fill, input_transforms=[],
+              input_shape=args.input_shape, state_len=args.state_len)
+
+  print('| Model | Frames (KB/step) | Embeddings (KB/step) | Full (updates/s) '
+        '| Frozen encoder (updates/s) | Speedup |')
+  print('|---|---|---|---|---|---|')
+
+  for name, model in MODELS.items():
+
+    # frame stack convnets only
+    if name in [None, 'mlp'] or not hasattr(model, 'encoder'):
+      continue
+
+    agents = []
+    for frozen in [False, True]:
+      torch.manual_seed(0)
+      agents.append(build(dict(cfgs, model_type=name, frozen_encoder=frozen),
+                          model, device, args.n_fill))
+
+    sizes = [transition_bytes(agent.replay) / 1e3 for agent in agents]
+    rates = [throughput(agent, args.batch_size, args.n_runs)
+             for agent in agents]
+
+    print('| {} | {:.1f} | {:.1f} | {:.1f} | {:.1f} | {:.2f}x |'.format(
+        name, sizes[0], sizes[1], rates[0], rates[1], rates[1] / rates[0]))
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='DQN replay bytes + learner '
+                                   'updates/sec, frames vs cached embeddings')
+  parser.add_argument('-c', '--config_file', type=Path,
+                      default=Path('configs/atari-dqn.yaml'))
+  parser.add_argument('-d', dest='device', choices=['gpu', 'cpu'],
+                      default='cpu')
+  parser.add_argument('--input_shape', type=int, nargs=2, default=[84, 84])
+  parser.add_argument('--state_len', type=int, default=4)
+  parser.add_argument('--batch_size', type=int, default=32)
+  parser.add_argument('--threads', type=int, default=1,
+                      help='torch intra-op threads')
+  parser.add_argument('--n_fill', type=int, default=1000,
+                      help='Transitions in the replay buffer')
+  parser.add_argument('--n_runs', type=int, default=100)
+
+  run(parser.parse_args())
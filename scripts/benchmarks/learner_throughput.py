@@ -0,0 +1,65 @@
+import argparse
+from pathlib import Path
+
+import torch
+
+from cherry.agents import MODELS
+from utils.helpers import read_yaml, get_logger
+from dqn_learner import build, throughput
+
+logger = get_logger(__file__)
+
+
+def run(args):
+
+  torch.set_num_threads(args.threads)
+
+  device = torch.device('cuda' if args.device == 'gpu' and
+                        torch.cuda.is_available() else 'cpu')
+  cfgs = read_yaml(args.config_file)['agent']
+  cfgs.update(replay_size=args.n_fill, input_transforms=[])
+
+  print('| Model | Eager (updates/s) | Compiled + fused (updates/s) '
+        '| Speedup |')
+  print('|---|---|---|---|')
+
+  for name, model in MODELS.items():
+
+    # recurrent models learn on sequences (DRQN), not frame stacks
+    if name is None or hasattr(model, 'init_hidden'):
+      continue
+
+    # mlp is the low dimensional (control) model
+    shape = [[4], 1] if name == 'mlp' else [args.input_shape, args.state_len]
+    cfgs.update(model_type=name, input_shape=shape[0], state_len=shape[1])
+
+    rates = []
+    for fast in [False, True]:
+      cfgs.update(compile=fast, fused_opt=fast)
+      torch.manual_seed(0)
+      agent = build(cfgs, model, device, args.n_fill)
+      rates.append(throughput(agent, args.batch_size, args.n_runs))
+
+    print('| {} | {:.1f} | {:.1f} | {:.2f}x |'.format(name, rates[0],
+                                                     rates[1],
+                                                     rates[1] / rates[0]))
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='DQN learner updates/sec, '
+                                   'eager vs compiled step + fused optimizer')
+  parser.add_argument('-c', '--config_file', type=Path,
+                      default=Path('configs/atari-dqn.yaml'))
+  parser.add_argument('-d', dest='device', choices=['gpu', 'cpu'],
+                      default='cpu')
+  parser.add_argument('--input_shape', type=int, nargs=2, default=[84, 84])
+  parser.add_argument('--state_len', type=int, default=4)
+  parser.add_argument('--batch_size', type=int, default=32)
+  parser.add_argument('--threads', type=int, default=1,
+                      help='torch intra-op threads')
+  parser.add_argument('--n_fill', type=int, default=1000,
+                      help='Transitions in the replay buffer')
+  parser.add_argument('--n_runs', type=int, default=100)
+
+  run(parser.parse_args())
@@ -0,0 +1,94 @@
+import time
+import argparse
+
+import torch
+from torch import nn
+
+from cherry.agents import MODELS
+from utils.helpers import get_logger
+
+logger = get_logger(__file__)
+
+
+def count_flops(model, state):
+  """Multiply-adds of Conv2d/Linear layers for one forward of `state`"""
+
+  flops = []
+
+  def hook(module, inputs, output):
+    if isinstance(module, nn.Conv2d):
+      k = module.kernel_size[0] * module.kernel_size[1]
+      flops.append(output.numel() * k * module.in_channels // module.groups)
+    if isinstance(module, nn.Linear):
+      flops.append(output.numel() * module.in_features)
+
+  handles = [m.register_forward_hook(hook) for m in model.modules()
+             if isinstance(m, (nn.Conv2d, nn.Linear))]
+
+  with torch.no_grad():
+    model(state)
+
+  for h in handles:
+    h.remove()
+
+  return sum(flops) / state.size(0)
+
+
+def latency(model, state, n_runs):
+
+  with torch.no_grad():
+    for _ in range(5):
+      model(state)
+
+    timings = []
+    for _ in range(n_runs):
+      start = time.perf_counter()
+      model(state)
+      timings.append(time.perf_counter() - start)
+
+  timings.sort()
+  return timings[len(timings) // 2] * 1000.
+
+
+def run(args):
+
+  torch.set_num_threads(args.threads)
+
+  state_size = [args.state_len] + args.input_shape
+  device = torch.device('cpu')
+
+  print('| Model | Params | MFLOPs/obs | Batch 1 (ms) | Batch 32 (ms) |')
+  print('|---|---|---|---|---|')
+
+  for name, model in MODELS.items():
+
+    if name is None or name == 'mlp':
+      continue
+
+    net = model(state_size, args.action_size, device).eval()
+    params = sum(p.numel() for p in net.parameters())
+
+    row = [name, '{:.2f}M'.format(params / 1e6)]
+
+    for idx, batch_size in enumerate([1, 32]):
+      state = torch.randint(0, 255, [batch_size] + state_size,
+                            dtype=torch.uint8)
+      if idx == 0:
+        row.append('{:.1f}'.format(count_flops(net, state) / 1e6))
+      row.append('{:.2f}'.format(latency(net, state, args.n_runs)))
+
+    print('| ' + ' | '.join(row) + ' |')
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='Forward latency/FLOPs of '
+                                   'cherry models on CPU')
+  parser.add_argument('--input_shape', type=int, nargs=2, default=[84, 84])
+  parser.add_argument('--state_len', type=int, default=4)
+  parser.add_argument('--action_size', type=int, default=4)
+  parser.add_argument('--threads', type=int, default=1,
+                      help='torch intra-op threads')
+  parser.add_argument('--n_runs', type=int, default=100)
+
+  run(parser.parse_args())
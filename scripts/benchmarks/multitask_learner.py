@@ -0,0 +1,91 @@
+import time
+import argparse
+from pathlib import Path
+
+import torch
+
+from cherry.agents import MODELS, DQN, MultiTaskDQN
+from utils.helpers import read_yaml, get_logger
+
+logger = get_logger(__file__)
+
+
+def fill(replay, state_size, n_fill):
+
+  for _ in range(n_fill):
+    replay.push(torch.randint(0, 255, state_size, dtype=torch.uint8), 1, 1,
+                False)
+
+
+def throughput(optimize, n_runs):
+
+  for _ in range(10):
+    optimize()
+
+  start = time.perf_counter()
+  for _ in range(n_runs):
+    optimize()
+
+  return n_runs / (time.perf_counter() - start)
+
+
+def run(args):
+
+  torch.set_num_threads(args.threads)
+
+  device = torch.device('cuda' if args.device == 'gpu' and
+                        torch.cuda.is_available() else 'cpu')
+  cfgs = read_yaml(args.config_file)['agent']
+  cfgs.update(replay_size=args.n_fill, input_transforms=[])
+
+  model = MODELS[cfgs['model_type']]
+  state_size = [1, cfgs['state_len'] + 1] + cfgs['input_shape']
+
+  print('| Tasks | Separate DQNs (updates/s) | Multi-task (updates/s) '
+        '| Speedup |')
+  print('|---|---|---|---|')
+
+  for n_tasks in args.tasks:
+
+    # one DQN per task, each with its own learner step
+    agents = [DQN(dict(cfgs, agent_type='dqn', action_size=6), model=model,
+                  device=device, log_level='warning')
+              for _ in range(n_tasks)]
+    for agent in agents:
+      fill(agent.replay, state_size, args.n_fill)
+
+    multi = MultiTaskDQN(dict(cfgs, action_size=[6] * n_tasks), model=model,
+                         device=device, log_level='warning')
+    for replay in multi.replays:
+      fill(replay, state_size, args.n_fill)
+
+    def separate():
+      for agent in agents:
+        agent.optimize(args.batch_size)
+
+    separate_rate = throughput(separate, args.n_runs)
+    multi_rate = throughput(
+        lambda: multi.optimize(args.batch_size * n_tasks), args.n_runs)
+
+    print('| {} | {:.1f} | {:.1f} | {:.2f}x |'.format(
+        n_tasks, separate_rate, multi_rate, multi_rate / separate_rate))
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='Learner updates/sec of K '
+                                   'DQNs vs one multi-task DQN, same samples')
+  parser.add_argument('-c', '--config_file', type=Path,
+                      default=Path('configs/atari-dqn-multitask.yaml'))
+  parser.add_argument('-d', dest='device', choices=['gpu', 'cpu'],
+                      default='cpu')
+  parser.add_argument('--tasks', type=int, nargs='+', default=[2, 3, 4])
+  parser.add_argument('--batch_size', type=int, default=32,
+                      help='Samples per task')
+  parser.add_argument('--threads', type=int, default=1,
+                      help='torch intra-op threads')
+  parser.add_argument('--n_fill', type=int, default=500,
+                      help='Transitions in every replay buffer')
+  parser.add_argument('--n_runs', type=int, default=30)
+
+  run(parser.parse_args())
@@ -0,0 +1,106 @@
+import json
+import time
+import socket
+import argparse
+import threading
+import http.client
+
+import numpy as np
+
+from utils.helpers import get_logger
+
+logger = get_logger(__file__)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+  def __init__(self, socket_path):
+
+    super(UnixHTTPConnection, self).__init__('localhost')
+    self.socket_path = socket_path
+
+  def connect(self):
+
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.connect(self.socket_path)
+
+
+def connect(args):
+
+  if args.socket:
+    return UnixHTTPConnection(args.socket)
+
+  return http.client.HTTPConnection(args.host, args.port)
+
+
+def client(args, latencies, stop):
+
+  conn = connect(args)
+  dtype = np.uint8 if args.uint8 else np.float32
+  headers = {'Content-Type': 'application/octet-stream'}
+
+  while not stop.is_set():
+
+    state = np.random.randint(0, 255, size=args.state_size).astype(dtype)
+
+    start = time.time()
+    conn.request('POST', '/act', body=state.tobytes(), headers=headers)
+    response = conn.getresponse()
+    response.read()
+    latencies.append(time.time() - start)
+
+    assert response.status == 200, 'Request failed {}'.format(response.status)
+
+  conn.close()
+
+
+def run(args):
+
+  stop = threading.Event()
+  latencies = [[] for _ in range(args.clients)]
+
+  clients = [threading.Thread(target=client, args=(args, latencies[idx], stop))
+             for idx in range(args.clients)]
+
+  for c in clients:
+    c.start()
+
+  time.sleep(args.duration)
+  stop.set()
+
+  for c in clients:
+    c.join()
+
+  latencies = np.concatenate([np.array(l) for l in latencies]) * 1000.
+
+  logger.info('{} clients, {} requests in {}s, {:.1f} req/s'.format(
+      args.clients, len(latencies), args.duration,
+      len(latencies) / args.duration))
+  logger.info('Client latency p50 {:.2f}ms, p95 {:.2f}ms, '
+              'p99 {:.2f}ms'.format(*np.percentile(latencies, [50, 95, 99])))
+
+  conn = connect(args)
+  conn.request('GET', '/stats')
+  logger.info('Server stats {}'.format(json.loads(conn.getresponse().read())))
+
+
+if __name__ == '__main__':
+
+  parser = argparse.ArgumentParser(description='Localhost load generator '
+                                   'for cherry serve')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8000)
+  parser.add_argument('--socket', default=None,
+                      help='Unix socket of the server')
+  parser.add_argument('--clients', type=int, default=16,
+                      help='Concurrent clients')
+  parser.add_argument('--duration', type=float, default=10.,
+                      help='Benchmark duration in seconds')
+  parser.add_argument('--state_size', type=int, nargs='+',
+                      default=[4, 84, 84], help='Observation shape')
+  parser.add_argument('--uint8', action='store_true', default=True,
+                      help='Send uint8 observations (image states)')
+  parser.add_argument('--float32', dest='uint8', action='store_false',
+                      help='Send float32 observations (control states)')
+
+  run(parser.parse_args())
@@ -0,0 +1,513 @@
+import os
+import re
+import json
+import mmap
+import uuid
+import struct
+import random
+import shutil
+import tempfile
+import threading
+from functools import partial
+from collections import OrderedDict
+
+import torch
+import numpy as np
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+
+from utils.helpers import get_logger
+
+logger = get_logger(__file__)
+
+# process umask, read once (setting it is not thread safe) for the mode of
+# files written through temp files
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+# flat checkpoints, magic + header size + json header, tensor bytes at
+# FLAT_ALIGN aligned offsets
+FLAT_MAGIC = b'CHERRYFC'
+FLAT_ALIGN = 64
+
+
+def is_rank_zero():
+
+  return not (dist.is_available() and dist.is_initialized()) or \
+      dist.get_rank() == 0
+
+
+def save_atomic(obj, savefile, save_fn=torch.save):
+  """save_fn to a temp file next to savefile, renamed once complete"""
+
+  dest = os.path.dirname(os.path.abspath(savefile))
+  fd, tmp_file = tempfile.mkstemp(dir=dest, suffix='.tmp')
+
+  try:
+    with os.fdopen(fd, 'wb') as pfile:
+      save_fn(obj, pfile)
+      pfile.flush()
+      os.fsync(pfile.fileno())
+    # mkstemp files are owner only, others (f.ex servers) read checkpoints
+    os.chmod(tmp_file, 0o666 & ~UMASK)
+    os.replace(tmp_file, savefile)
+  except BaseException:
+    os.remove(tmp_file)
+    raise
+
+
+def is_flat(model_file):
+
+  with open(model_file, 'rb') as pfile:
+    return pfile.read(len(FLAT_MAGIC)) == FLAT_MAGIC
+
+
+def read_header(model_file):
+
+  with open(model_file, 'rb') as pfile:
+    assert pfile.read(len(FLAT_MAGIC)) == FLAT_MAGIC, \
+        '{} is not a flat checkpoint'.format(model_file)
+    size, = struct.unpack('<Q', pfile.read(8))
+    return json.loads(pfile.read(size))
+
+
+def write_flat(state_dict, pfile, half=False, base=None):
+  """
+    Writes state_dict without pickle. half stores float tensors as float16,
+    base (file, state dict as read) stores differences to a full flat
+    checkpoint, tensors equal to base take no space
+  """
+
+  base_file, base_state = base or (None, None)
+
+  header = {'id': uuid.uuid4().hex,
+            'base': base_file and os.path.basename(base_file),
+            'base_id': base_file and read_header(base_file)['id'],
+            'tensors': OrderedDict()}
+  buffers = []
+
+  for name, tensor in state_dict.items():
+
+    tensor = tensor.detach().cpu().contiguous()
+    delta = False
+
+    if base_state is not None and torch.equal(tensor, base_state[name]):
+      tensor = None
+    elif base_state is not None and tensor.is_floating_point():
+      tensor = tensor - base_state[name]
+      delta = True
+
+    info = {'dtype': str(state_dict[name].dtype).split('.')[-1],
+            'shape': list(state_dict[name].shape),
+            'delta': delta}
+
+    if tensor is not None:
+      if half and tensor.is_floating_point():
+        tensor = tensor.half()
+      info['stored'] = str(tensor.dtype).split('.')[-1]
+      buffers.append((info, tensor.view(-1).view(torch.uint8).numpy()))
+
+    header['tensors'][name] = info
+
+  # offsets are relative to the aligned end of the header
+  offset = 0
+  for info, data in buffers:
+    info['offset'] = offset
+    offset += -(-data.nbytes // FLAT_ALIGN) * FLAT_ALIGN
+
+  blob = json.dumps(header).encode()
+  start = -(-(len(FLAT_MAGIC) + 8 + len(blob)) // FLAT_ALIGN) * FLAT_ALIGN
+
+  pfile.write(FLAT_MAGIC)
+  pfile.write(struct.pack('<Q', len(blob)))
+  pfile.write(blob)
+  pfile.write(bytes(start - pfile.tell()))
+
+  for info, data in buffers:
+    pfile.write(data.tobytes())
+    pfile.write(bytes(-data.nbytes % FLAT_ALIGN))
+
+
+def save_flat(state_dict, savefile, half=False, base=None):
+
+  save_atomic(state_dict, savefile, save_fn=partial(write_flat, half=half,
+                                                    base=base))
+
+
+def read_flat(model_file, map_location=None):
+  """
+    State dict of a flat checkpoint. The file is memory mapped (copy on
+    write), tensors stored as they are loaded point into it, float16 and
+    delta tensors are computed on load
+  """
+
+  with open(model_file, 'rb') as pfile:
+    buf = mmap.mmap(pfile.fileno(), 0, access=mmap.ACCESS_COPY)
+
+  assert buf[:len(FLAT_MAGIC)] == FLAT_MAGIC, \
+      '{} is not a flat checkpoint'.format(model_file)
+
+  size, = struct.unpack('<Q', buf[len(FLAT_MAGIC):len(FLAT_MAGIC) + 8])
+  header = json.loads(buf[len(FLAT_MAGIC) + 8:len(FLAT_MAGIC) + 8 + size])
+  start = -(-(len(FLAT_MAGIC) + 8 + size) // FLAT_ALIGN) * FLAT_ALIGN
+
+  base_state = None
+  if header['base']:
+    base_file = os.path.join(os.path.dirname(model_file), header['base'])
+    assert read_header(base_file)['id'] == header['base_id'], \
+        'Base {} of {} was overwritten'.format(base_file, model_file)
+    base_state = read_flat(base_file)
+
+  state_dict = OrderedDict()
+
+  for name, info in header['tensors'].items():
+
+    dtype = getattr(torch, info['dtype'])
+
+    if 'stored' not in info:
+      tensor = base_state[name]
+    elif not np.prod(info['shape']):
+      tensor = torch.empty(info['shape'], dtype=dtype)
+    else:
+      tensor = torch.frombuffer(buf, dtype=getattr(torch, info['stored']),
+                                count=int(np.prod(info['shape'])),
+                                offset=start + info['offset'])
+      tensor = tensor.view(info['shape']).to(dtype)
+
+    if info['delta']:
+      tensor = base_state[name] + tensor
+
+    state_dict[name] = tensor if map_location is None else \
+        tensor.to(map_location)
+
+  return state_dict
+
+
+def read_checkpoint(model_file, map_location=None):
+  """State dict of a torch (.pth) or flat checkpoint"""
+
+  if is_flat(model_file):
+    return read_flat(model_file, map_location=map_location)
+
+  return torch.load(model_file, map_location=map_location)
+
+
+def load_weights(model, model_file, device=None):
+  """
+    Loads a torch (.pth) or flat checkpoint into model. Parameters read
+    from a flat checkpoint with the model's dtype and device (f.ex float32
+    on CPU) keep pointing into the memory mapped file instead of a copy
+  """
+
+  state_dict = read_checkpoint(model_file, map_location=device)
+
+  if not is_flat(model_file):
+    model.load_state_dict(state_dict)
+    return
+
+  own_state = model.state_dict(keep_vars=True)
+
+  missing = [k for k in own_state if k not in state_dict]
+  unexpected = [k for k in state_dict if k not in own_state]
+  assert not missing and not unexpected, \
+      'Missing keys {}, unexpected keys {} in {}'.format(missing, unexpected,
+                                                          model_file)
+
+  # swapping the data keeps the parameters (f.ex held by an optimizer)
+  with torch.no_grad():
+    for name, tensor in own_state.items():
+
+      value = state_dict[name]
+      assert tensor.shape == value.shape, \
+          'Size mismatch of {}, {} ≠ {}'.format(name, list(tensor.shape),
+                                               list(value.shape))
+
+      if value.dtype == tensor.dtype and value.device == tensor.device:
+        tensor.data = value
+      else:
+        tensor.copy_(value)
+
+
+class CheckpointWriter(threading.Thread):
+
+  def __init__(self, keep_last=None, keep_best=None, flat=False,
+               half=False, delta=None):
+    """
+      Writes checkpoints on a background thread. The caller only copies the
+      state dict to host memory, serializing + disk I/O happen here. A
+      checkpoint series (tag without the leading step) keeps its keep_last
+      latest and keep_best best scored checkpoints, others of this run are
+      removed. final-* checkpoints are always kept. A checkpoint still
+      queued when the next one of its series arrives is replaced by it
+      instead of making the caller wait. flat writes flat checkpoints (see
+      write_flat), every delta-th one of a series in full and the others
+      as differences to it
+    """
+
+    super(CheckpointWriter, self).__init__(daemon=True)
+
+    self.keep_last = keep_last
+    self.keep_best = keep_best
+    self.flat = flat
+    self.half = half
+    self.delta = delta if flat else None
+    self.suffix = 'ckpt' if flat else 'pth'
+    # queued checkpoints by series, at most one each
+    self.jobs = OrderedDict()
+    self.pending = threading.Condition()
+    self.closed = False
+    self.series = {}
+    # last full checkpoint of a series + deltas written against it
+    self.bases = {}
+    self.error = None
+
+    self.start()
+
+  @staticmethod
+  def snapshot(state_dict):
+
+    return OrderedDict((k, v.detach().to('cpu', copy=True))
+                       for k, v in state_dict.items())
+
+  def submit(self, state_dict, savefile, tag, score=None):
+
+    if self.error is not None:
+      raise self.error
+
+    job = (self.snapshot(state_dict), savefile, tag, score)
+    # final checkpoints are never replaced
+    name = savefile if tag.startswith('final') else re.sub(r'^\d+-', '', tag)
+
+    with self.pending:
+      if name in self.jobs:
+        logger.info('Checkpoint writer busy, {} replaces {}'.format(
+            savefile, self.jobs[name][1]))
+      self.jobs[name] = job
+      self.pending.notify()
+
+  def write(self, state_dict, savefile, tag):
+    """Writes savefile, returns the checkpoint it is a delta of"""
+
+    if not self.flat:
+      save_atomic(state_dict, savefile)
+      return None
+
+    name = re.sub(r'^\d+-', '', tag)
+    base, state, n_deltas = self.bases.get(name, (None, None, 0))
+
+    # final checkpoints are standalone
+    if self.delta and base and n_deltas + 1 < self.delta and \
+            not tag.startswith('final'):
+      save_flat(state_dict, savefile, half=self.half, base=(base, state))
+      self.bases[name] = (base, state, n_deltas + 1)
+      return base
+
+    save_flat(state_dict, savefile, half=self.half)
+
+    if self.delta and not tag.startswith('final'):
+      # deltas are taken to the weights as read, f.ex after float16
+      state = OrderedDict((k, v.clone())
+                          for k, v in read_flat(savefile).items())
+      self.bases[name] = (savefile, state, 0)
+
+    return None
+
+  def retain(self, savefile, tag, score, base=None):
+
+    if tag.startswith('final'):
+      return
+
+    name = re.sub(r'^\d+-', '', tag)
+    series = self.series.setdefault(name, [])
+    series.append((savefile, score, base))
+
+    keep = set()
+
+    if self.keep_last is None:
+      keep.update(f for f, _, _ in series)
+    else:
+      keep.update(f for f, _, _ in series[-self.keep_last:])
+
+    if self.keep_best:
+      scored = sorted([c for c in series if c[1] is not None],
+                      key=lambda c: c[1], reverse=True)
+      keep.update(f for f, _, _ in scored[:self.keep_best])
+
+    # bases of kept deltas + the base of the next delta
+    keep.update([b for f, _, b in series if f in keep and b] +
+                [self.bases.get(name, [None])[0]])
+
+    for f, _, _ in series:
+      if f not in keep and os.path.exists(f):
+        logger.debug('Removing checkpoint {}'.format(f))
+        os.remove(f)
+
+    series[:] = [c for c in series if c[0] in keep]
+
+  def run(self):
+
+    while True:
+
+      with self.pending:
+        self.pending.wait_for(lambda: self.jobs or self.closed)
+
+        if not self.jobs:
+          break
+
+        _, (state_dict, savefile, tag, score) = self.jobs.popitem(last=False)
+
+      try:
+        base = self.write(state_dict, savefile, tag)
+        self.retain(savefile, tag, score, base)
+      except Exception as err:
+        self.error = err
+        logger.error('Error writing {}, {}'.format(savefile, err))
+
+  def close(self):
+    """Waits for the queued checkpoints"""
+
+    with self.pending:
+      self.closed = True
+      self.pending.notify()
+
+    self.join()
+
+    if self.error is not None:
+      raise self.error
+
+
+# background writer of write_model, set by the trainer
+checkpoint_writer = None
+
+
+def set_checkpoint_writer(writer):
+
+  global checkpoint_writer
+  checkpoint_writer = writer
+
+
+def unwrap_model(model):
+  """Plain model of a data parallel one, state dicts without module."""
+
+  if isinstance(model, DistributedDataParallel):
+    return model.module
+
+  return model
+
+
+def write_model(model, tag, dest, score=None):
+  """
+    Saves model as <dest>/agent-<tag>.pth (.ckpt if flat), score (f.ex
+    average reward) ranks checkpoints for keep_best
+  """
+
+  # data parallel ranks hold the same weights, rank 0 writes them
+  if not is_rank_zero():
+    return
+
+  model = unwrap_model(model)
+
+  suffix = 'pth' if checkpoint_writer is None else checkpoint_writer.suffix
+  model_savefile = '{0}/agent-{1}.{2}'.format(dest, tag, suffix)
+  logger.debug("Saving Agent to {}".format(model_savefile))
+
+  if checkpoint_writer is not None:
+    checkpoint_writer.submit(model.state_dict(), model_savefile, tag, score)
+  else:
+    save_atomic(model.state_dict(), model_savefile)
+
+
+def state_dir(dest):
+  """Resume state of this process (data parallel rank) under dest"""
+
+  if dist.is_available() and dist.is_initialized():
+    return os.path.join(dest, 'state-rank{}'.format(dist.get_rank()))
+
+  return os.path.join(dest, 'state')
+
+
+def rng_states():
+
+  states = {'python': random.getstate(),
+            'numpy': np.random.get_state(),
+            'torch': torch.get_rng_state()}
+
+  if torch.cuda.is_available():
+    states['cuda'] = torch.cuda.get_rng_state_all()
+
+  return states
+
+
+def set_rng_states(states):
+
+  random.setstate(states['python'])
+  np.random.set_state(states['numpy'])
+  torch.set_rng_state(states['torch'])
+
+  if 'cuda' in states and torch.cuda.is_available():
+    torch.cuda.set_rng_state_all(states['cuda'])
+
+
+def write_state(agent, progress, dest):
+  """
+    Training state to resume from, agent.state_dict() (models, optimizer,
+    exploration), progress (f.ex episode counter), RNG states and the
+    replay columns (.npy). Written to a new directory which then replaces
+    the previous state
+  """
+
+  savedir = state_dir(dest)
+  tmp_dir = tempfile.mkdtemp(dir=dest, prefix='state.tmp-')
+
+  logger.info('Saving training state to {}'.format(savedir))
+
+  try:
+    replay = agent.replay.save(tmp_dir)
+    torch.save({'agent': agent.state_dict(), 'progress': progress,
+                'rng': rng_states(), 'replay': replay},
+               os.path.join(tmp_dir, 'state.pth'))
+  except BaseException:
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    raise
+
+  # a crash in between leaves the previous state at <savedir>.old
+  old_dir = savedir + '.old'
+  shutil.rmtree(old_dir, ignore_errors=True)
+
+  if os.path.exists(savedir):
+    os.replace(savedir, old_dir)
+
+  os.replace(tmp_dir, savedir)
+  shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def read_state(agent, dest):
+  """
+    Restores a state of write_state into agent, returns its progress. With
+    another number of ranks than the saved run, ranks without a state of
+    their own resume from the rank 0 (or single process) state
+  """
+
+  own_dir = state_dir(dest)
+  # rank 0 state first, ranks fall back to the same state as rank 0
+  candidates = [own_dir, os.path.join(dest, 'state-rank0'),
+                os.path.join(dest, 'state')]
+
+  savedirs = [d + suffix for d in candidates for suffix in ['', '.old']
+              if os.path.exists(os.path.join(d + suffix, 'state.pth'))]
+
+  assert savedirs, 'No training state to resume from in {}'.format(dest)
+  savedir = savedirs[0]
+
+  logger.info('Resuming training state from {}'.format(savedir))
+
+  state = torch.load(os.path.join(savedir, 'state.pth'), weights_only=False)
+
+  agent.load_state_dict(state['agent'])
+  agent.replay.load(savedir, **state['replay'])
+
+  # ranks sharing a state keep their own random streams
+  if savedir in [own_dir, own_dir + '.old']:
+    set_rng_states(state['rng'])
+
+  return state['progress']
@@ -87,12 +87,40 @@ def copy_yaml(src_file, dest_dir, hexsha):
   shutil.copyfile(src_file.as_posix(), dst_file.as_posix())
 
 
-def write_model(model, tag, dest):
+def build_optimizer(opt_name, params, fused=False, **kwargs):
+  """
+    Optimizer from OPTS. With fused, asks for the fused (single kernel) or
+    else foreach (multi-tensor) implementation, whichever this torch
+    build/device supports first
+  """
 
-  model_savefile = '{0}/agent-{1}.pth'.format(dest, tag)
-  logger.debug("Saving Agent to {}".format(model_savefile))
+  optimizer = OPTS.get(opt_name)
 
-  torch.save(model.state_dict(), model_savefile)
+  if not fused:
+    return optimizer(params, **kwargs)
+
+  params = list(params)
+
+  for impl in ['fused', 'foreach']:
+    try:
+      return optimizer(params, **{impl: True}, **kwargs)
+    except (TypeError, RuntimeError) as err:
+      logger.debug('No {} {}, {}'.format(impl, opt_name, err))
+
+  return optimizer(params, **kwargs)
+
+
+def maybe_compile(fn, enabled=False):
+  """torch.compile fn (forward + loss) when enabled and available"""
+
+  if not enabled:
+    return fn
+
+  if not hasattr(torch, 'compile'):
+    logger.warning('torch.compile not available, running eager')
+    return fn
+
+  return torch.compile(fn)
 
 
 def add_verbosity_parser(parser):